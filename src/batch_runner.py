@@ -0,0 +1,151 @@
+# This module runs the chapter-1 pipeline (download, trend identification and figures) for a list of instruments in
+# parallel: every instrument is processed in its own worker process, which renders its figures with the Agg backend on
+# explicit Figure objects, i.e. without the global pyplot state. matplotlib is only imported when the figures are saved.
+
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from tqdm import tqdm
+
+import utils as ut
+import profiling as prof
+import data_sourcer as ds
+import data_providers as dp
+import trend_identification as trend
+
+
+def process_instrument(code, start_date, end_date, window_in_days, window_in_days_list, figure_folder,
+                       cache_folder=None, max_age_in_hours=12, is_offline=False, is_profiled=False, track_memory=False,
+                       provider=None, max_retries=3, backoff_in_seconds=1.0):
+    """
+    This function performs the chapter-1 pipeline for one instrument: it downloads the prices, identifies the trends
+    for all the windows and saves the curve and scatter figures.
+
+    :param code: the Yahoo Finance code of the instrument.
+    :param start_date: start date of the prices in the format 'YYYY-MM-DD'.
+    :param end_date: end date of the prices in the format 'YYYY-MM-DD'.
+    :param window_in_days: the window of the curve figure.
+    :param window_in_days_list: the four windows of the scatter figure.
+    :param figure_folder: the folder in which the figures are saved.
+    :param cache_folder: optional folder of the local price cache.
+    :param max_age_in_hours: see data_sourcer.LocalSeriesCache.
+    :param is_offline: see data_sourcer.LocalSeriesCache.
+    :param is_profiled: whether the stages are recorded; see the profiling module.
+    :param track_memory: whether the profiling records the memory as well.
+    :param provider: the data_providers.DataProvider of the prices; by default Yahoo Finance.
+    :param max_retries: the number of retries of a failed download; see data_sourcer.call_with_retry.
+    :param backoff_in_seconds: the waiting time before the first retry; it doubles for every next retry.
+    :return: a dictionary with the TrendResult per window, the paths of the saved figures and the profiling records.
+    """
+    if not is_profiled:
+        return run_instrument_pipeline(code, start_date, end_date, window_in_days, window_in_days_list,
+                                       figure_folder, cache_folder, max_age_in_hours, is_offline, provider,
+                                       max_retries, backoff_in_seconds)
+    # The worker process records its own stages and sends them back with the result.
+    profiler = prof.enable(track_memory)
+    try:
+        with prof.labels(code=code):
+            result = run_instrument_pipeline(code, start_date, end_date, window_in_days, window_in_days_list,
+                                             figure_folder, cache_folder, max_age_in_hours, is_offline, provider,
+                                             max_retries, backoff_in_seconds)
+    finally:
+        prof.disable()
+    result['profile'] = profiler.records
+    return result
+
+
+def run_instrument_pipeline(code, start_date, end_date, window_in_days, window_in_days_list, figure_folder,
+                            cache_folder=None, max_age_in_hours=12, is_offline=False, provider=None, max_retries=3,
+                            backoff_in_seconds=1.0):
+    """
+    This function performs the stages of process_instrument.
+    """
+    provider = dp.YahooFinanceProvider() if provider is None else provider
+    fetch_function = provider.fetch_one
+    if cache_folder is not None:
+        fetch_function = ds.LocalSeriesCache(cache_folder, provider.fetch_one, max_age_in_hours, is_offline).get
+    # A failed download is retried with backoff (only over the network, and not offline) and then raised, such that
+    # run_batch reports it for the instrument, as it does for an empty download.
+    price = ds.call_with_retry(fetch_function, code, start_date, end_date,
+                               max_retries=max_retries if provider.is_network and not is_offline else 0,
+                               backoff_in_seconds=backoff_in_seconds)
+    if price is None or len(price) == 0:
+        raise LookupError(f"No prices of {code} between {start_date} and {end_date}.")
+    price_raw = price['Close']
+
+    # All windows share one range-extremum index of the price curve. The compact results are cheap to send back to the
+    # parent process; their dataframes are only built here, for the figures.
+    with prof.stage('trend_identification_sweep') as record:
+        trend_results = trend.trend_identification_sweep(price_raw, False,
+                                                         [window_in_days] + list(window_in_days_list), is_compact=True)
+        record['rows'] = len(price_raw)
+    with prof.stage('save_figures'):
+        figure_files = save_figures(code, trend_results, window_in_days, window_in_days_list, figure_folder)
+    return {'trend_results': trend_results, 'figure_files': figure_files}
+
+
+def save_figures(code, trend_results, window_in_days, window_in_days_list, figure_folder):
+    """
+    This function saves the curve figure and the 2x2 scatter figure of an instrument.
+
+    :return: the paths of the saved figures.
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    fig_file_name = ut.remove_illegal_symbols(code)
+    figure = Figure(figsize=(10, 6))
+    FigureCanvasAgg(figure)
+    result = trend_results[window_in_days]
+    trend.trend_plot_curve(result.RP_vector, result.RP_summary, window_in_days, ax=figure.add_subplot(111))
+    curve_file = os.path.join(figure_folder, f"curve_{fig_file_name}_{window_in_days}D.png")
+    figure.savefig(curve_file)
+
+    # Create a 2x2 subplot grid for scatter plots
+    figure = Figure(figsize=(10, 8))
+    FigureCanvasAgg(figure)
+    for ax, window in zip(figure.subplots(2, 2).flatten(), window_in_days_list):
+        trend.trend_plot_scatter(trend_results[window].RP_summary, window, ax=ax)
+    # Adjust the layout to prevent overlapping titles
+    figure.tight_layout()
+    scatter_file = os.path.join(figure_folder, f"scatter_{fig_file_name}.png")
+    figure.savefig(scatter_file)
+    return [curve_file, scatter_file]
+
+
+def run_batch(code_list, start_date, end_date, window_in_days, window_in_days_list, figure_folder, cache_folder=None,
+              max_age_in_hours=12, is_offline=False, max_workers=None, is_profiled=False, track_memory=False,
+              provider=None, max_retries=3, backoff_in_seconds=1.0):
+    """
+    This function fans the instruments out over a pool of processes; see process_instrument. An instrument that fails
+    does not stop the others: its error is collected instead. With is_profiled, the profiling records of all the
+    instruments can be summarized with profiling.summary_table(batch_runner.profile_records(results)).
+
+    :param max_workers: the number of worker processes; by default the number of CPUs.
+    :param provider: the data_providers.DataProvider of the prices, sent to every worker; by default Yahoo Finance.
+    :param max_retries: the number of retries of a failed download, in the worker.
+    :param backoff_in_seconds: the waiting time before the first retry; it doubles for every next retry.
+    :return results: the output of process_instrument per code.
+    :return errors: the formatted traceback per code that failed.
+    """
+    results = {}
+    errors = {}
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(process_instrument, code, start_date, end_date, window_in_days, window_in_days_list,
+                                   figure_folder, cache_folder, max_age_in_hours, is_offline, is_profiled,
+                                   track_memory, provider, max_retries, backoff_in_seconds): code
+                   for code in code_list}
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Processing instruments in the code list"):
+            code = futures[future]
+            try:
+                results[code] = future.result()
+            except Exception as e:
+                errors[code] = ''.join(traceback.format_exception(e))
+    return results, errors
+
+
+def profile_records(results):
+    """
+    :return: the profiling records of all the instruments of run_batch, in one list.
+    """
+    return [record for result in results.values() for record in result.get('profile', [])]
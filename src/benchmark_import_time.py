@@ -0,0 +1,55 @@
+# This script measures the import time of the modules of the project, each in a fresh interpreter (as a worker process
+# or a cron job would), and which of the heavy packages each import loads. The results are printed and written to
+# output/benchmarks as JSON, next to the benchmark of the trend identification.
+
+import os
+import sys
+import json
+import subprocess
+import numpy as np
+import pandas as pd
+
+# The modules that a compute-only worker should not need.
+HEAVY_PACKAGES = ['matplotlib', 'scipy', 'yfinance', 'pandas_datareader', 'requests', 'sklearn']
+MODULES = ['numpy', 'pandas', 'trend_core', 'trend_identification', 'data_sourcer', 'batch_runner']
+
+MEASURE_CODE = """
+import sys, time, json
+start_time = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start_time
+print(json.dumps({{'seconds': seconds, 'loaded': [name for name in {heavy_packages} if name in sys.modules]}}))
+"""
+
+
+def measure_import(module, repeats=5):
+    """
+    This function imports the module in fresh interpreters.
+
+    :param module: the name of the module.
+    :param repeats: the number of interpreters.
+    :return: a dictionary with the median and minimum import time in seconds and the heavy packages that are loaded.
+    """
+    current_folder = os.path.dirname(os.path.abspath(__file__))
+    durations = []
+    loaded = []
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, '-c', MEASURE_CODE.format(module=module, heavy_packages=HEAVY_PACKAGES)],
+                                capture_output=True, text=True, cwd=current_folder, check=True).stdout
+        measurement = json.loads(output.strip().splitlines()[-1])
+        durations.append(measurement['seconds'])
+        loaded = measurement['loaded']
+    return {'module': module, 'median_seconds': float(np.median(durations)), 'min_seconds': min(durations),
+            'heavy_packages_loaded': loaded}
+
+
+if __name__ == '__main__':
+    import_time_df = pd.DataFrame([measure_import(module) for module in MODULES])
+    print(import_time_df.to_string(index=False))
+
+    current_folder = os.path.dirname(os.path.abspath(__file__))
+    benchmark_folder = os.path.join(current_folder, '..', 'output', 'benchmarks')
+    os.makedirs(benchmark_folder, exist_ok=True)
+    file_name = f"import_time_{pd.Timestamp.now().strftime('%Y%m%d_%H%M%S')}.json"
+    with open(os.path.join(benchmark_folder, file_name), 'w') as file:
+        json.dump(import_time_df.to_dict(orient='records'), file, indent=2)
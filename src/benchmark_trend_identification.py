@@ -0,0 +1,134 @@
+# This script benchmarks the stages of the trend identification on synthetic price curves (see synthetic_data), i.e.
+# fully offline and deterministic. Every stage is timed for every size, window, model and frequency of the [benchmark]
+# section in config.ini, and its peak memory is measured in a separate run with tracemalloc. The results are written
+# to output/benchmarks as JSON (with the versions and the git commit) and CSV, such that runs of different commits can
+# be compared.
+
+import os
+import json
+import time
+import platform
+import subprocess
+import tracemalloc
+from configparser import ConfigParser, ExtendedInterpolation
+import numpy as np
+import pandas as pd
+
+import synthetic_data as sd
+import data_sourcer as ds
+import trend_identification as trend
+
+
+def measure_stage(function, repeats=3):
+    """
+    This function times a stage and measures its peak memory.
+
+    :param function: the stage, without arguments.
+    :param repeats: the number of timed runs; the best one is reported.
+    :return: a dictionary with the best and median wall time in seconds and the peak of the traced memory in bytes.
+    """
+    durations = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start_time)
+    # tracemalloc slows the stage down, so the memory is measured in a run that is not timed.
+    tracemalloc.start()
+    function()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'best_seconds': min(durations), 'median_seconds': float(np.median(durations)),
+            'peak_memory_bytes': peak_memory}
+
+
+def benchmark_stages(price, window_in_days, number_state_dates=20):
+    """
+    This function lists the stages of the trend identification on one price curve.
+
+    :param price: the price curve, a dataframe with one column.
+    :param window_in_days: the window in bars.
+    :param number_state_dates: the number of (last) dates for which current_state_in_trend is called.
+    :return: a dictionary of the stages, each a function without arguments.
+    """
+    RP_vector, RP_summary = trend.trend_identification_main(price, False, window_in_days)
+    # current_state_in_trend needs 1 RP before the date of interest.
+    state_dates = price.index[-number_state_dates:]
+
+    def current_state_loop():
+        for date in state_dates:
+            trend.current_state_in_trend(date, 1, RP_vector, RP_summary)
+
+    return {
+        'find_RP': lambda: trend.find_RP(price, window_in_days),
+        'trend_identification_main': lambda: trend.trend_identification_main(price, False, window_in_days),
+        'trend_identification_compact': lambda: trend.trend_identification_compact(price, False, window_in_days),
+        'calculate_running_percentile': lambda: ds.calculate_running_percentile(price, window_in_days),
+        f'current_state_in_trend_x{number_state_dates}': current_state_loop,
+        f'trend_state_history_x{number_state_dates}': lambda: trend.trend_state_history(RP_vector, RP_summary,
+                                                                                         state_dates, (1,)),
+    }
+
+
+def run_benchmark(sizes, window_in_days_list, models, frequencies, repeats=3, seed=0):
+    """
+    This function runs all the stages for every combination of the settings.
+
+    :param sizes: the numbers of bars.
+    :param window_in_days_list: the windows in bars.
+    :param models: the synthetic models, see synthetic_data.generate_price.
+    :param frequencies: the frequencies of the synthetic curves, 'B' and/or 'M'.
+    :param repeats: the number of timed runs per stage.
+    :param seed: the seed of the synthetic curves.
+    :return: a dataframe with one row per stage and setting.
+    """
+    records = []
+    for model in models:
+        for frequency in frequencies:
+            for number_bars in sizes:
+                price = sd.generate_price(model, number_bars, frequency, seed)
+                for window_in_days in window_in_days_list:
+                    if 2 * window_in_days > number_bars:
+                        continue
+                    for stage, function in benchmark_stages(price, window_in_days).items():
+                        result = measure_stage(function, repeats)
+                        records.append({'stage': stage, 'model': model, 'frequency': frequency,
+                                        'number_bars': number_bars, 'window_in_days': window_in_days, **result})
+                        print(f"{stage:<35}{model:<18}{frequency:<3}{number_bars:>10}{window_in_days:>5}"
+                              f"{result['best_seconds']:>12.4f} s{result['peak_memory_bytes'] / 2 ** 20:>10.1f} MB")
+    return pd.DataFrame(records)
+
+
+def environment_info():
+    """
+    :return: the versions and the git commit, to compare benchmark files of different commits.
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = None
+    return {'git_commit': commit, 'python': platform.python_version(), 'numpy': np.__version__,
+            'pandas': pd.__version__, 'platform': platform.platform(), 'timestamp': pd.Timestamp.now().isoformat()}
+
+
+if __name__ == '__main__':
+    # read configuration
+    config = ConfigParser(interpolation=ExtendedInterpolation())
+    config.read('config.ini')
+    sizes = [int(item.strip()) for item in config['benchmark']['sizes'].split(',')]
+    window_in_days_list = [int(item.strip()) for item in config['benchmark']['window_in_days_list'].split(',')]
+    models = [item.strip() for item in config['benchmark']['models'].split(',')]
+    frequencies = [item.strip() for item in config['benchmark']['frequencies'].split(',')]
+    repeats = int(config['benchmark']['repeats'])
+
+    benchmark_df = run_benchmark(sizes, window_in_days_list, models, frequencies, repeats)
+
+    current_folder = os.path.dirname(os.path.abspath(__file__))
+    benchmark_folder = os.path.join(current_folder, '..', 'output', 'benchmarks')
+    if not os.path.exists(benchmark_folder):
+        os.makedirs(benchmark_folder)
+    info = environment_info()
+    file_name = f"benchmark_{pd.Timestamp.now().strftime('%Y%m%d_%H%M%S')}_{(info['git_commit'] or 'unknown')[:8]}"
+    benchmark_df.to_csv(os.path.join(benchmark_folder, file_name + '.csv'), index=False)
+    with open(os.path.join(benchmark_folder, file_name + '.json'), 'w') as file:
+        json.dump({'environment': info, 'results': benchmark_df.to_dict(orient='records')}, file, indent=2)
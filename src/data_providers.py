@@ -0,0 +1,152 @@
+# This module contains the data providers: interchangeable sources of time series with the same batch interface,
+# such that the pipelines, the benchmarks and the GUI can run on live downloads or, offline, on recorded snapshots.
+#
+# A provider fetches one series with fetch_one(code, start_date, end_date), which raises an exception if the series
+# cannot be delivered, and many series at once with fetch(code_list, start_date, end_date), which returns the panel and
+# the failures. fetch_one has the signature of the fetch function of data_sourcer.LocalSeriesCache, so a provider can
+# also sit behind the local cache.
+
+import os
+import time
+from abc import ABC, abstractmethod
+import pandas as pd
+
+import data_sourcer as ds
+
+
+class DataProvider(ABC):
+    """
+    The base class of the providers. The class attributes are the capability flags:
+        is_network: whether the provider downloads over the network (and thus benefits from retries and a cache).
+        is_batch_native: whether the source can deliver many series in one request; otherwise fetch downloads the
+        series concurrently, one by one.
+        frequencies: the frequencies of the series the provider delivers, e.g. ('D',) or ('D', 'M').
+    """
+    name = 'base'
+    is_network = True
+    is_batch_native = False
+    frequencies = ('D',)
+
+    @abstractmethod
+    def fetch_one(self, code, start_date, end_date):
+        """
+        Fetches one series in [start_date, end_date), raising an exception if it cannot be delivered.
+
+        Returns:
+            pandas.DataFrame: The series, with the values in the first column and a (timezone-naive) date index.
+        """
+
+    def fetch(self, code_list, start_date, end_date, cache=None, max_workers=8, max_retries=3, backoff_in_seconds=1.0):
+        """
+        Fetches several series; see data_sourcer.download_series_panel for the concurrency and the retries, which are
+        only used for network providers.
+
+        Returns:
+            pandas.DataFrame: The first column of each series, one column per code, aligned on the union of the dates.
+            dict: The exception per code that could not be fetched.
+        """
+        if not self.is_network:
+            max_retries = 0
+        return ds.download_series_panel(code_list, start_date, end_date, self.fetch_one, cache, max_workers,
+                                        max_retries, backoff_in_seconds)
+
+
+class YahooFinanceProvider(DataProvider):
+    """
+    The daily close prices from Yahoo Finance; see data_sourcer.fetch_stock_price_daily_close.
+    """
+    name = 'yahoo'
+
+    def fetch_one(self, code, start_date, end_date):
+        return ds.fetch_stock_price_daily_close(code, start_date, end_date)
+
+
+class FredProvider(DataProvider):
+    """
+    The economic series from Fred, in their own frequency; see data_sourcer.fetch_fred_data.
+    """
+    name = 'fred'
+    frequencies = ('D', 'W', 'M', 'Q')
+
+    def fetch_one(self, code, start_date, end_date):
+        return ds.fetch_fred_data(code, start_date, end_date)
+
+
+class ReplayProvider(DataProvider):
+    """
+    Serves recorded snapshots from a local folder, one CSV or Parquet file per code (named like the files of
+    data_sourcer.LocalSeriesCache), with the dates in the first column. An optional latency per fetch stands in for the
+    network, such that a pipeline can be load-tested deterministically; without it, the pipeline runs at full speed
+    offline. Snapshots can be recorded from any other provider with record().
+    """
+    name = 'replay'
+    is_network = False
+    frequencies = ('D', 'W', 'M', 'Q')
+
+    def __init__(self, snapshot_folder, latency_in_seconds=0.0, file_format='csv'):
+        """
+        :param snapshot_folder: the folder of the snapshots.
+        :param latency_in_seconds: the waiting time of every fetch_one.
+        :param file_format: 'csv' or 'parquet', the format in which record() writes; both are read.
+        """
+        assert file_format in ('csv', 'parquet'), "The file format should be 'csv' or 'parquet'!"
+        self.snapshot_folder = snapshot_folder
+        self.latency_in_seconds = latency_in_seconds
+        self.file_format = file_format
+
+    def file_path(self, code, file_format):
+        return os.path.join(self.snapshot_folder, f"{ds.series_file_name(code)}.{file_format}")
+
+    def load(self, code):
+        """
+        Returns the full snapshot of the code.
+        """
+        for file_format in ('parquet', 'csv'):
+            file_path = self.file_path(code, file_format)
+            if os.path.exists(file_path):
+                if file_format == 'parquet':
+                    return pd.read_parquet(file_path)
+                return pd.read_csv(file_path, index_col=0, parse_dates=True)
+        raise LookupError(f"There is no snapshot of {code} in {self.snapshot_folder}.")
+
+    def fetch_one(self, code, start_date, end_date):
+        if self.latency_in_seconds > 0:
+            time.sleep(self.latency_in_seconds)
+        data = self.load(code)
+        return data[(data.index >= pd.Timestamp(start_date)) & (data.index < pd.Timestamp(end_date))]
+
+    def record(self, provider, code_list, start_date, end_date):
+        """
+        Fetches the series from another provider and saves them as snapshots.
+
+        Returns:
+            dict: The exception per code that could not be fetched.
+        """
+        os.makedirs(self.snapshot_folder, exist_ok=True)
+        failures = {}
+        for code, data, error in ds.iterate_series_downloads(code_list, start_date, end_date, provider.fetch_one):
+            if error is not None:
+                failures[code] = error
+            elif self.file_format == 'parquet':
+                data.to_parquet(self.file_path(code, 'parquet'))
+            else:
+                data.to_csv(self.file_path(code, 'csv'))
+        return failures
+
+
+def create_provider(name, snapshot_folder=None, latency_in_seconds=0.0):
+    """
+    Creates a provider by its name, e.g. from the configuration.
+
+    Parameters:
+        name (str): 'yahoo', 'fred' or 'replay'.
+        snapshot_folder (str): the folder of the snapshots of the replay provider.
+        latency_in_seconds (float): the latency of the replay provider.
+    """
+    if name == 'yahoo':
+        return YahooFinanceProvider()
+    elif name == 'fred':
+        return FredProvider()
+    elif name == 'replay':
+        return ReplayProvider(snapshot_folder, latency_in_seconds)
+    raise ValueError(f"Unknown data provider {name}; should be 'yahoo', 'fred' or 'replay'.")
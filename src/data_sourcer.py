@@ -1,29 +1,334 @@
 # This ensembles all the data sourcing and processing codes.
 
+import os
+import json
+import hashlib
+import time
+import threading
+from urllib.parse import quote
+from bisect import bisect_left, bisect_right, insort
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
 import pandas as pd
-import pandas_datareader.data as web
 from datetime import datetime
-import yfinance as yf
-import scipy.stats as stats
 import utils as ut
+import profiling as prof
 
 
 # Stock price data downloader. Generated by CHATGPT.
-def download_stock_price_daily_close(code, start_date, end_date):
+def download_stock_price_daily_close(code, start_date, end_date, cache=None, provider=None):
+    """
+    Downloads the daily close prices of an instrument from Yahoo Finance.
+
+    Parameters:
+        code (str): The Yahoo Finance code of the instrument.
+        start_date (str): Start date of the data in the format 'YYYY-MM-DD'.
+        end_date (str): End date of the data in the format 'YYYY-MM-DD' (exclusive).
+        cache (LocalSeriesCache): optional local store; if given, only the dates that are not on disk yet are downloaded.
+        provider (data_providers.DataProvider): optional source of the prices instead of Yahoo Finance; not used with a
+            cache, which has its own fetch function.
+
+    Returns:
+        pandas.Series: The daily close prices, or None if the download failed.
+    """
 
     try:
-        # Download data for the S&P 500 index
-        price = yf.download(code, start=start_date, end=end_date)
+        if cache is None:
+            fetch_function = fetch_stock_price_daily_close if provider is None else provider.fetch_one
+            daily_close_prices = fetch_function(code, start_date, end_date)
+        else:
+            daily_close_prices = cache.get(code, start_date, end_date)
         # Select the 'Close' column from the DataFrame
-        daily_close_prices = price['Close']
-        return daily_close_prices
+        return daily_close_prices['Close']
     except Exception as e:
         print("An error occurred:", e)
         return None
 
 
+# One HTTP session is shared by all downloads, such that concurrent downloads reuse the connections. The network
+# packages (requests, yfinance, pandas_datareader) are only imported on the first download, so that the processing
+# functions of this module can be imported without them.
+http_session = None
+
+
+def get_http_session():
+    global http_session
+    if http_session is None:
+        import requests
+        http_session = requests.Session()
+    return http_session
+
+
+def fetch_stock_price_daily_close(code, start_date, end_date):
+    """
+    Fetches the daily close prices of an instrument from Yahoo Finance, raising an exception if the download fails.
+
+    Returns:
+        pandas.DataFrame: A DataFrame with the column 'Close' and a (timezone-naive) date index.
+    """
+    import yfinance as yf
+
+    with prof.stage('fetch_stock_price_daily_close', code=code) as record:
+        price = yf.Ticker(code, session=get_http_session()).history(start=start_date, end=end_date,
+                                                                    auto_adjust=False, actions=False, raise_errors=True)
+        record['rows'] = len(price)
+    price.index = price.index.tz_localize(None)
+    return price[['Close']]
+
+
+def call_with_retry(function, *args, max_retries=3, backoff_in_seconds=1.0, no_retry_on=(LookupError,)):
+    """
+    Calls the function and retries it with exponential backoff if it raises an exception. The exception of the last
+    attempt is raised again. The exceptions of no_retry_on are raised at once: by default a LookupError, which reports
+    that the series is not there at all (e.g. not in an offline cache or in the snapshots) and would only fail again.
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            return function(*args)
+        except no_retry_on:
+            raise
+        except Exception:
+            if attempt == max_retries:
+                raise
+            time.sleep(backoff_in_seconds * 2 ** attempt)
+
+
+def iterate_series_downloads(code_list, start_date, end_date, fetch_function, cache=None, max_workers=8,
+                             max_retries=3, backoff_in_seconds=1.0):
+    """
+    Downloads several series concurrently with a bounded pool of threads, and yields each of them as soon as it is
+    downloaded. The caller can thus already process the first series while the others are still being downloaded.
+
+    Parameters:
+        code_list (list): The codes of the series.
+        start_date (str): Start date of the data in the format 'YYYY-MM-DD'.
+        end_date (str): End date of the data in the format 'YYYY-MM-DD' (exclusive).
+        fetch_function: function (code, start_date, end_date) -> pandas.DataFrame that downloads one series.
+        cache (LocalSeriesCache): optional local store of the series; its own fetch function is used then.
+        max_workers (int): The maximum number of concurrent downloads.
+        max_retries (int): The number of retries of a failed download.
+        backoff_in_seconds (float): The waiting time before the first retry; it doubles for every next retry.
+
+    Yields:
+        tuple: (code, pandas.DataFrame or None, the exception or None), in order of completion.
+    """
+
+    def download(code):
+        function = fetch_function if cache is None else cache.get
+        return call_with_retry(function, code, start_date, end_date, max_retries=max_retries,
+                               backoff_in_seconds=backoff_in_seconds)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(download, code): code for code in code_list}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result(), None
+            except Exception as e:
+                yield futures[future], None, e
+
+
+def download_series_panel(code_list, start_date, end_date, fetch_function, cache=None, max_workers=8, max_retries=3,
+                          backoff_in_seconds=1.0):
+    """
+    Downloads several series concurrently, see iterate_series_downloads, and puts their first columns in one DataFrame
+    with a single concat.
+
+    Returns:
+        pandas.DataFrame: The series, one column per code in the order of the code list, aligned on the union of the
+        dates.
+        dict: The exception per code for which the download failed.
+    """
+    series = {}
+    failures = {}
+    for code, data, error in iterate_series_downloads(code_list, start_date, end_date, fetch_function, cache,
+                                                      max_workers, max_retries, backoff_in_seconds):
+        if error is None:
+            series[code] = data.iloc[:, 0]
+        else:
+            failures[code] = error
+    # keep the order of the code list
+    series = {code: series[code] for code in code_list if code in series}
+    panel = pd.concat(series, axis=1).sort_index() if series else pd.DataFrame()
+    return panel, failures
+
+
+def iterate_stock_price_daily_close(code_list, start_date, end_date, cache=None, max_workers=8, max_retries=3,
+                                    backoff_in_seconds=1.0):
+    """
+    Downloads the daily close prices of several instruments concurrently; see iterate_series_downloads.
+
+    Yields:
+        tuple: (code, daily close prices as pandas.Series or None, the exception or None), in order of completion.
+    """
+    for code, price, error in iterate_series_downloads(code_list, start_date, end_date, fetch_stock_price_daily_close,
+                                                       cache, max_workers, max_retries, backoff_in_seconds):
+        yield code, None if price is None else price['Close'], error
+
+
+def download_stock_price_daily_close_batch(code_list, start_date, end_date, cache=None, max_workers=8, max_retries=3,
+                                           backoff_in_seconds=1.0):
+    """
+    Downloads the daily close prices of several instruments concurrently; see download_series_panel.
+
+    Returns:
+        pandas.DataFrame: The daily close prices with one column per code, aligned on the union of the dates.
+        dict: The exception per code for which the download failed.
+    """
+    return download_series_panel(code_list, start_date, end_date, fetch_stock_price_daily_close, cache, max_workers,
+                                 max_retries, backoff_in_seconds)
+
+
+def series_file_name(code):
+    """
+    Returns the file name (without extension) of a series code. The code is percent-encoded, which is reversible, so
+    that codes like '^DJI' and 'DJI' get distinct files.
+    """
+    return quote(code, safe='')
+
+
+class LocalSeriesCache:
+    """
+    Persistent local store of downloaded time series, with one file per series code. Only the head or tail of a
+    requested date range that is not on disk yet is downloaded; the rest is served from disk.
+
+    The cached range is kept in a small metadata file next to the data. A tail that was downloaded up to the day of the
+    download may still change (e.g. the close of the current day), so it is downloaded again once it is older than
+    max_age_in_hours. In offline mode nothing is downloaded and whatever is on disk is served.
+
+    The fetch function is any function (code, start_date, end_date) -> pandas.DataFrame, so that the cache can be
+    measured with a fake provider. The stats attribute counts the cold (download only), warm (disk only) and partial
+    loads, together with the time spent on fetching and in total.
+
+    The cache can be shared by threads: the loads of the same code are serialized by a lock per code, so that a second
+    request waits for the download of the first one and reads its files instead of downloading and writing them too.
+    """
+
+    def __init__(self, cache_folder, fetch_function, max_age_in_hours=12, is_offline=False):
+        self.cache_folder = cache_folder
+        self.fetch_function = fetch_function
+        self.max_age_in_hours = max_age_in_hours
+        self.is_offline = is_offline
+        self.stats = {'cold_loads': 0, 'warm_loads': 0, 'partial_loads': 0, 'fetches': 0,
+                      'fetch_seconds': 0.0, 'load_seconds': 0.0}
+        self.lock = threading.Lock()
+        self.code_locks = {}
+        os.makedirs(cache_folder, exist_ok=True)
+
+    def file_paths(self, code):
+        file_name = series_file_name(code)
+        return (os.path.join(self.cache_folder, f"{file_name}.pkl"),
+                os.path.join(self.cache_folder, f"{file_name}.json"))
+
+    def load(self, code):
+        """
+        Returns the cached data and its metadata, or (None, None) if the code is not on disk.
+        """
+        data_path, metadata_path = self.file_paths(code)
+        if not (os.path.exists(data_path) and os.path.exists(metadata_path)):
+            return None, None
+        with prof.stage('cache_load', code=code) as record:
+            with open(metadata_path, 'r') as file:
+                metadata = json.load(file)
+            data = pd.read_pickle(data_path)
+            record['rows'] = len(data)
+        return data, metadata
+
+    def save(self, code, data, metadata):
+        data_path, metadata_path = self.file_paths(code)
+        data.to_pickle(data_path)
+        with open(metadata_path, 'w') as file:
+            json.dump(metadata, file)
+
+    def fetch(self, code, start_date, end_date):
+        start_time = time.perf_counter()
+        data = self.fetch_function(code, start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'))
+        self.add_stats(fetches=1, fetch_seconds=time.perf_counter() - start_time)
+        return pd.DataFrame(data)
+
+    def add_stats(self, **increments):
+        # The loads of different codes run concurrently, so the counters are only updated under the lock.
+        with self.lock:
+            for name, increment in increments.items():
+                self.stats[name] += increment
+
+    def code_lock(self, code):
+        with self.lock:
+            return self.code_locks.setdefault(code, threading.Lock())
+
+    def get(self, code, start_date, end_date):
+        """
+        Returns the data of the code in [start_date, end_date); see get_unlocked. Thread-safe.
+        """
+        with self.code_lock(code):
+            return self.get_unlocked(code, start_date, end_date)
+
+    def get_unlocked(self, code, start_date, end_date):
+        """
+        Returns the data of the code in [start_date, end_date), downloading only what is missing on disk.
+
+        Raises an exception if nothing is on disk and the download fails (or the cache is offline), and also if a
+        missing head or tail cannot be downloaded, so that the caller can retry instead of using stale data; the
+        segments that were downloaded are kept on disk nonetheless.
+        """
+        start_time = time.perf_counter()
+        start_date = pd.Timestamp(start_date)
+        now = pd.Timestamp.now()
+        # nothing can be downloaded beyond today
+        end_date = min(pd.Timestamp(end_date), now.normalize() + pd.Timedelta(days=1))
+        data, metadata = self.load(code)
+        is_changed = False
+
+        if data is None:
+            if self.is_offline:
+                raise LookupError(f"{code} is not in the local cache and the cache is offline.")
+            data = self.fetch(code, start_date, end_date)
+            metadata = {'covered_start': str(start_date.date()), 'covered_end': str(end_date.date()),
+                        'fetched_at': now.isoformat()}
+            self.add_stats(cold_loads=1)
+            is_changed = True
+        elif not self.is_offline:
+            covered_start = pd.Timestamp(metadata['covered_start'])
+            covered_end = pd.Timestamp(metadata['covered_end'])
+            fetched_at = pd.Timestamp(metadata['fetched_at'])
+            segments = []
+            if start_date < covered_start:
+                segments.append((start_date, covered_start))
+            is_tail_stale = (covered_end > fetched_at.normalize()) and (
+                    now - fetched_at > pd.Timedelta(hours=self.max_age_in_hours))
+            if end_date > covered_end or (is_tail_stale and end_date >= covered_end):
+                # download the last cached observation again, it may have been incomplete
+                tail_start = min(covered_end, data.index[-1]) if len(data) > 0 else covered_end
+                segments.append((tail_start, end_date))
+
+            for segment_start, segment_end in segments:
+                try:
+                    new_data = self.fetch(code, segment_start, segment_end)
+                except Exception:
+                    if is_changed:
+                        self.save(code, data, metadata)
+                    raise
+                data = pd.concat([data, new_data])
+                data = data[~data.index.duplicated(keep='last')].sort_index()
+                is_changed = True
+                metadata['covered_start'] = str(min(covered_start, segment_start).date())
+                if segment_end > covered_end:
+                    metadata['covered_end'] = str(segment_end.date())
+                    metadata['fetched_at'] = now.isoformat()
+            self.add_stats(**{'partial_loads' if segments else 'warm_loads': 1})
+        else:
+            self.add_stats(warm_loads=1)
+
+        if is_changed:
+            if len(data) > 0:
+                metadata['last_observation'] = str(data.index[-1].date())
+            self.save(code, data, metadata)
+        self.add_stats(load_seconds=time.perf_counter() - start_time)
+        return data[(data.index >= start_date) & (data.index < end_date)]
+
+
 # US yield curve data downloader. Generated by CHATGPT.
-def download_yield_curve_data(series_code, start_date='1962-01-02', end_date=datetime.today().strftime('%Y-%m-%d')):
+def download_yield_curve_data(series_code, start_date='1962-01-02', end_date=datetime.today().strftime('%Y-%m-%d'),
+                              cache=None):
     # The main difference between the USTREASURY and DGS* series is the maturity of the Treasury securities used to calculate the yields.
     # The DGS* series represents the yields on actively traded Treasury securities with specific maturities, such as 1-month, 2-year, 5-year, etc. These yields are based on the secondary market, where Treasury securities are bought and sold after they are issued. As a result, the DGS* series reflects market expectations about future interest rates, inflation, and other economic factors that affect the demand for and supply of Treasury securities.
     # The USTREASURY series, on the other hand, represents the yields on Treasury securities of various maturities that are auctioned by the U.S. Treasury Department. The maturities range from 4 weeks to 30 years, and the yields are based on the prices at which the securities are sold to investors. As a result, the USTREASURY series reflects the actual borrowing costs of the U.S. government and is used as a benchmark for many financial instruments, such as mortgages and corporate bonds.
@@ -37,23 +342,19 @@ def download_yield_curve_data(series_code, start_date='1962-01-02', end_date=dat
             'DGS1MO', 'DGS3MO', 'DGS6MO', 'DGS1', 'DGS2', 'DGS3',
             'DGS5', 'DGS7', 'DGS10', 'DGS20', 'DGS30'
         ]  # Series IDs for the yield curve data
-
-        # Download yield curve data from FRED
-        yield_curve_data = pd.DataFrame()
-        for series_id in series_ids:
-            data = web.DataReader(series_id, 'fred', start_date, end_date)
-            yield_curve_data[series_id] = data[series_id]
+        fred_ids = series_ids
     else:
         series_ids = [
             'DTB1', 'DTB3', 'DTB6', 'DGS1', 'DGS2', 'DGS3', 'DGS5',
             'DGS7', 'DGS10', 'DGS20', 'DGS30'
         ]  # Series IDs for the yield curve data
+        fred_ids = [f'USTREASURY/YIELD/{series_id}' for series_id in series_ids]
 
-        # Download yield curve data from FRED
-        yield_curve_data = pd.DataFrame()
-        for series_id in series_ids:
-            data = web.DataReader(f'USTREASURY/YIELD/{series_id}', 'fred', start_date, end_date)
-            yield_curve_data[series_id] = data[f'USTREASURY/YIELD/{series_id}']
+    # Download yield curve data from FRED
+    yield_curve_data, failures = download_fred_panel(fred_ids, start_date, end_date, cache)
+    if failures:
+        raise next(iter(failures.values()))
+    yield_curve_data.columns = series_ids
 
     return yield_curve_data
 
@@ -71,6 +372,8 @@ def download_fred_data(series_id, start_date='1990-01-01', end_date=datetime.tod
         pandas.DataFrame: A DataFrame containing the variable of interest.
     """
 
+    import pandas_datareader.data as web
+
     # Fetch the data using pandas_datareader
     try:
         df = web.DataReader(series_id, 'fred', start_date, end_date)
@@ -80,6 +383,42 @@ def download_fred_data(series_id, start_date='1990-01-01', end_date=datetime.tod
         return None
 
 
+def fetch_fred_data(series_id, start_date, end_date):
+    """
+    Fetches one series from Fred, raising an exception if the download fails.
+    """
+    import pandas_datareader.data as web
+
+    with prof.stage('fetch_fred_data', code=series_id) as record:
+        data = web.DataReader(series_id, 'fred', start_date, end_date)
+        record['rows'] = len(data)
+    return data
+
+
+def download_fred_panel(series_ids, start_date='1990-01-01', end_date=datetime.today().strftime('%Y-%m-%d'),
+                        cache=None, max_workers=8, max_retries=3, backoff_in_seconds=1.0, provider=None):
+    """
+    Downloads several series from Fred concurrently and puts them in one DataFrame with a single concat. With a cache,
+    each series is kept on disk together with its last observation, so that a re-run only downloads the new
+    observations.
+
+    Parameters:
+        series_ids (list): The series IDs of the variables of interest.
+        start_date (str): Start date of the data in the format 'YYYY-MM-DD'.
+        end_date (str): End date of the data in the format 'YYYY-MM-DD'.
+        cache (LocalSeriesCache): optional local store of the series, with fetch_fred_data as fetch function.
+        provider (data_providers.DataProvider): optional source of the series instead of Fred.
+
+    Returns:
+        pandas.DataFrame: The series, one column per series ID, aligned on the union of the dates.
+        dict: The exception per series ID for which the download failed.
+    """
+    if provider is not None:
+        return provider.fetch(series_ids, start_date, end_date, cache, max_workers, max_retries, backoff_in_seconds)
+    return download_series_panel(series_ids, start_date, end_date, fetch_fred_data, cache, max_workers, max_retries,
+                                 backoff_in_seconds)
+
+
 def identify_data_frequency(data_df):
     time_diffs = data_df.index.to_series().diff()
     average_time_diff = time_diffs.mean(skipna=True)
@@ -100,10 +439,139 @@ def resample_to_last_day_in_month(data_df):
     return data_df_resampled
 
 
-def calculate_percentiles(data):
-    # Calculate the percentile values for each data point
-    percentile_values = [stats.percentileofscore(data, x, kind='rank') for x in data]
-    return percentile_values
+# The largest median spacing of the dates (in days) per frequency; see detect_frequency.
+FREQUENCY_MAX_SPACING_IN_DAYS = {'D': 4, 'W': 10, 'M': 45, 'Q': 120}
+
+
+def detect_frequency(index):
+    """
+    Detect the frequency of a series from the median spacing of its dates, without resampling it.
+
+    Parameters:
+        index (pd.DatetimeIndex): The sorted dates of the observations.
+
+    Returns:
+        str: 'D' (daily, incl. business days), 'W', 'M', 'Q' or 'A'.
+    """
+    if len(index) < 2:
+        raise ValueError("At least 2 observations are needed to detect the frequency.")
+    spacing_in_days = np.median(np.diff(index.values.astype('datetime64[D]').astype(np.int64)))
+    for frequency, max_spacing_in_days in FREQUENCY_MAX_SPACING_IN_DAYS.items():
+        if spacing_in_days <= max_spacing_in_days:
+            return frequency
+    return 'A'
+
+
+def build_monthly_panel(economic_variables_list, join='inner'):
+    """
+    Align many economic variables of mixed frequencies (daily, weekly, monthly, quarterly) on one calendar of month
+    ends, in a single pass over the observations of each variable, into one float64 matrix.
+
+    The value of a variable at a month end is as of that date: daily variables give the average of the month (as
+    calculate_monthly_average), the other ones their last observation in the month. The value is then shifted by the
+    publication lag of the variable (lag_period_in_months), i.e. the observation of month m is only used from month
+    m + lag on, and forward-filled until the next one (as resample_to_last_day_in_month), up to the last month of the
+    variable.
+
+    Parameters:
+        economic_variables_list (list): EconomicVariables with the raw observations in the first column of their data;
+            their frequency is detected if it is None.
+        join (str): 'inner' keeps the months in which all the variables have a value, 'outer' the months in which any
+            of them has one (NaN elsewhere).
+
+    Returns:
+        pd.DataFrame: One column per series ID, indexed by the month ends; all the values are in a single float64 block.
+    """
+    assert join in ('inner', 'outer'), "The join should be 'inner' or 'outer'!"
+    months_list = []
+    values_list = []
+    for variable in economic_variables_list:
+        data = variable.data.iloc[:, 0].dropna().sort_index()
+        frequency = detect_frequency(data.index) if variable.frequency is None else variable.frequency
+        # the months since 1970-01 of the observations
+        months = data.index.values.astype('datetime64[M]').astype(np.int64)
+        values = data.to_numpy(dtype=float)
+        is_last_in_month = np.r_[months[1:] != months[:-1], True]
+        if frequency == 'D':
+            month_starts = np.flatnonzero(np.r_[True, is_last_in_month[:-1]])
+            values = np.add.reduceat(values, month_starts) / np.diff(np.r_[month_starts, len(months)])
+        else:
+            values = values[is_last_in_month]
+        months_list.append(months[is_last_in_month] + variable.lag_period)
+        values_list.append(values)
+
+    first_months = np.array([months[0] for months in months_list])
+    last_months = np.array([months[-1] for months in months_list])
+    if join == 'inner':
+        first_month, last_month = first_months.max(), last_months.min()
+    else:
+        first_month, last_month = first_months.min(), last_months.max()
+    number_months = max(last_month - first_month + 1, 0)
+
+    # column-major, which is the layout of a pandas block, so that the DataFrame is a view on it
+    panel_values = np.full((number_months, len(months_list)), np.nan, order='F')
+    for column, (months, values) in enumerate(zip(months_list, values_list)):
+        rows = months - first_month
+        is_in_calendar = (rows >= 0) & (rows < number_months)
+        panel_values[rows[is_in_calendar], column] = values[is_in_calendar]
+        # as of: carry the row of the last observation forward, within the months of the variable (observations
+        # before the calendar carry into its first row)
+        start, end = max(rows[0], 0), min(rows[-1] + 1, number_months)
+        if start >= end:
+            continue
+        if rows[0] < 0 and np.isnan(panel_values[0, column]):
+            panel_values[0, column] = values[np.searchsorted(rows, 0, side='right') - 1]
+        is_observed = ~np.isnan(panel_values[start:end, column])
+        last_observed = np.maximum.accumulate(np.where(is_observed, np.arange(start, end), start))
+        panel_values[start:end, column] = panel_values[last_observed, column]
+
+    month_ends = (np.arange(first_month, first_month + number_months) + 1).astype('datetime64[M]') \
+        .astype('datetime64[ns]') - np.timedelta64(1, 'D')
+    return pd.DataFrame(panel_values, index=pd.DatetimeIndex(month_ends),
+                        columns=[variable.series_id for variable in economic_variables_list])
+
+
+def calculate_percentiles(data, kind='rank', nan_policy='propagate'):
+    """
+    Calculate the percentile of each data point within its own data, i.e. stats.percentileofscore(data, x, kind) for
+    every x in data, based on a single sort instead of comparing every data point with all the others.
+
+    Parameters:
+        data (array-like, pd.Series or pd.DataFrame): the data; for 2-D data the percentiles are calculated per column.
+        kind (str): 'rank', 'weak', 'strict' or 'mean'; see stats.percentileofscore.
+        nan_policy (str): 'propagate' gives only NaN for a column containing NaN, 'omit' ignores the NaN values (which
+            get a NaN percentile) and 'raise' raises a ValueError.
+
+    Returns:
+        The percentiles (between 0 and 100): a pd.Series / pd.DataFrame for pandas input, an array for other 2-D
+        input and a list otherwise.
+    """
+    if nan_policy not in ['propagate', 'omit', 'raise']:
+        raise ValueError('nan_policy must be either "propagate", "omit" or "raise"')
+    values = np.asarray(data, dtype=float)
+    if values.size == 0:
+        # nothing to rank, like the list comprehension over the data points that this function replaces
+        if isinstance(data, (pd.Series, pd.DataFrame)):
+            return data.astype(float)
+        return values if values.ndim == 2 else []
+    columns = values.reshape(len(values), -1)
+    percentile_values = np.full(columns.shape, np.nan)
+    for i in range(columns.shape[1]):
+        is_nan = np.isnan(columns[:, i])
+        if is_nan.any() and nan_policy == 'raise':
+            raise ValueError("The input contains nan values")
+        if is_nan.any() and nan_policy == 'propagate':
+            continue
+        sorted_values = np.sort(columns[~is_nan, i])
+        percentile_values[:, i] = ut.percentile_of_scores(sorted_values, columns[:, i], kind)
+
+    if isinstance(data, pd.DataFrame):
+        return pd.DataFrame(percentile_values, index=data.index, columns=data.columns)
+    if isinstance(data, pd.Series):
+        return pd.Series(percentile_values[:, 0], index=data.index, name=data.name)
+    if values.ndim == 2:
+        return percentile_values
+    return percentile_values[:, 0].tolist()
 
 
 def calculate_monthly_average(data_df):
@@ -124,15 +592,80 @@ def calculate_yoy_change(data_df):
     Returns:
         pd.DataFrame: DataFrame containing the YoY changes with date as index.
     """
-    # Ensure the DataFrame is sorted by date
+    # Ensure the DataFrame is sorted by date; the input itself is left unchanged
     data_df = data_df.sort_index()
-    # Calculate YoY change using pandas' shift() and pct_change() methods
-    data_df['YoY Change'] = data_df.iloc[:, 0].pct_change(periods=12)
+    # Calculate YoY change using pandas' pct_change() method
+    yoy_df = data_df.iloc[:, 0].pct_change(periods=12).to_frame('YoY Change')
     # Drop the first 12 rows since they don't have enough data for the YoY calculation
-    data_df = data_df.iloc[12:]
-    # Create a new DataFrame containing only the YoY Change column
-    yoy_df = data_df[['YoY Change']].copy()
-    return yoy_df
+    return yoy_df.iloc[12:]
+
+
+def calculate_rolling_zscore(data_df, window_size):
+    """
+    Calculate the z-score of the current data relative to the mean and standard deviation of the past x months.
+
+    Parameters:
+        data_df (pd.DataFrame): DataFrame containing the economic data with date as index.
+        window_size (int): Number of months for the rolling window, including the current one.
+
+    Returns:
+        pd.DataFrame: DataFrame containing the z-scores with date as index, from the first full window on.
+    """
+    data_df = data_df.sort_index()
+    rolling_window = data_df.rolling(window=window_size)
+    zscore = (data_df - rolling_window.mean()) / rolling_window.std()
+    return zscore.iloc[window_size - 1:]
+
+
+def calculate_difference(data_df, periods=1):
+    """
+    Calculate the change of the economic data over the given number of periods.
+
+    Returns:
+        pd.DataFrame: DataFrame containing the differences with date as index, without the first periods rows.
+    """
+    data_df = data_df.sort_index()
+    return data_df.diff(periods=periods).iloc[periods:]
+
+
+def rolling_percentile_rank(data_df, window_size):
+    """
+    Calculate, for every column, the percentile rank of each value within the window of the last window_size values,
+    i.e. the same as data_df.rolling(window=window_size).apply(lambda x: pd.Series(x).rank(pct=True).iloc[-1]).
+    Ties get the average rank, and a window containing a NaN gives NaN.
+
+    A sorted copy of the window is maintained incrementally: every step inserts the new value and removes the oldest
+    one by binary search, instead of ranking the whole window again.
+
+    Parameters:
+        data_df (pd.DataFrame): DataFrame containing the data with date as index, sorted by date.
+        window_size (int): Number of observations in the rolling window.
+
+    Returns:
+        pd.DataFrame: DataFrame containing the rolling percentile ranks, with the same index and columns.
+    """
+    values = data_df.to_numpy(dtype=float)
+    percentile_ranks = np.full(values.shape, np.nan)
+    for column in range(values.shape[1]):
+        column_values = values[:, column].tolist()
+        sorted_window = []  # the non-NaN values in the window
+        number_nan = 0
+        for i, value in enumerate(column_values):
+            if value != value:  # NaN
+                number_nan += 1
+            else:
+                insort(sorted_window, value)
+            if i >= window_size:
+                old_value = column_values[i - window_size]
+                if old_value != old_value:
+                    number_nan -= 1
+                else:
+                    del sorted_window[bisect_left(sorted_window, old_value)]
+            if i >= window_size - 1 and number_nan == 0:
+                number_less = bisect_left(sorted_window, value)
+                number_equal = bisect_right(sorted_window, value) - number_less
+                percentile_ranks[i, column] = (number_less + (number_equal + 1) / 2) / window_size
+    return pd.DataFrame(percentile_ranks, index=data_df.index, columns=data_df.columns)
 
 
 def calculate_running_percentile(data_df, window_size):
@@ -149,34 +682,99 @@ def calculate_running_percentile(data_df, window_size):
     # Ensure the DataFrame is sorted by date
     data_df = data_df.sort_index()
 
-    # Calculate the running percentile rank using rolling window and apply method
-    def percentile_rank(x):
-        return pd.Series(x).rank(pct=True).iloc[-1]
-    running_percentile = data_df.rolling(window=window_size).apply(percentile_rank)
+    # Calculate the running percentile rank with the sorted-window engine
+    running_percentile = rolling_percentile_rank(data_df, window_size)
     # Drop the first window_size rows since they don't have enough data for the YoY calculation
     running_percentile = running_percentile.iloc[window_size:]
     return running_percentile
 
 
+# The transforms of the feature store of EconomicVariables by name: function (data_df, **parameters) -> DataFrame.
+FEATURE_TRANSFORMS = {
+    'yoy': calculate_yoy_change,
+    'running_percentile': calculate_running_percentile,
+    'zscore': calculate_rolling_zscore,
+    'diff': calculate_difference,
+}
+
+# The version of the transforms, part of the key of the stored features: increase it when a transform changes, so that
+# the features stored on disk by the previous version are not used anymore.
+FEATURE_VERSION = 1
+
+
 class EconomicVariables:
-    def __init__(self, data_df, series_id, frequency, country_code='US', lag_period_in_months=0):
+    """
+    An economic series together with a lazy feature store: a transform of the data (see FEATURE_TRANSFORMS) is
+    requested by name and parameters with feature(), computed on the first request, memoized per parameter set and, if
+    a cache folder is given, kept on disk under a hash of the content of the data (dates and values), the transform,
+    its parameters and FEATURE_VERSION. A study re-run with new parameters thus only computes the new features, while
+    new observations, revised values or another start date give new files. The data itself is never changed.
+    """
+
+    def __init__(self, data_df, series_id, frequency, country_code='US', lag_period_in_months=0, cache_folder=None):
         self.data = data_df
         self.country_code = country_code
         self.series_id = series_id
         self.lag_period = lag_period_in_months
         self.frequency = frequency
+        self.cache_folder = cache_folder
+        self.features = {}
         self.data_r_p = None
         self.data_yoy = None
+        if cache_folder is not None:
+            os.makedirs(cache_folder, exist_ok=True)
+
+    def feature_key(self, name, parameters):
+        """
+        :return: the hexadecimal blake2b hash of the data and of the transform, with its parameters and version.
+        """
+        hasher = hashlib.blake2b(digest_size=16)
+        hasher.update(np.ascontiguousarray(self.data.to_numpy(dtype=float)).view(np.uint8))
+        hasher.update(np.ascontiguousarray(pd.DatetimeIndex(self.data.index).asi8).view(np.uint8))
+        hasher.update(repr((self.data.shape, [str(column) for column in self.data.columns], name, parameters,
+                            FEATURE_VERSION)).encode())
+        return hasher.hexdigest()
+
+    def feature_file_path(self, name, parameters):
+        # the series ID, the frequency and the transform only make the files readable; the hash is the key
+        parameter_text = ''.join(f"_{key}{value}" for key, value in parameters)
+        file_name = f"{self.series_id}_{self.frequency}_{name}{parameter_text}_{self.feature_key(name, parameters)}.pkl"
+        return os.path.join(self.cache_folder, series_file_name(file_name))
+
+    def feature(self, name, **parameters):
+        """
+        Returns a feature of the series, e.g. feature('running_percentile', window_size=36).
+
+        Parameters:
+            name (str): The name of the transform; see FEATURE_TRANSFORMS.
+            parameters: The parameters of the transform.
+
+        Returns:
+            pd.DataFrame: A copy of the feature, with the column named after the series ID, the transform and the
+            parameter values (e.g. 'UNRATE_running_percentile_36').
+        """
+        if name not in FEATURE_TRANSFORMS:
+            raise ValueError(f"Unknown feature {name}; should be one of {list(FEATURE_TRANSFORMS)}.")
+        key = (name, tuple(sorted(parameters.items())))
+        feature_df = self.features.get(key)
+        if feature_df is None:
+            file_path = None if self.cache_folder is None else self.feature_file_path(*key)
+            if file_path is not None and os.path.exists(file_path):
+                feature_df = pd.read_pickle(file_path)
+            else:
+                feature_df = FEATURE_TRANSFORMS[name](self.data, **parameters)
+                feature_df.columns = ['_'.join([self.series_id, name, *(str(value) for _, value in key[1])])]
+                if file_path is not None:
+                    feature_df.to_pickle(file_path)
+            self.features[key] = feature_df
+        return feature_df.copy()
 
     def generate_yoy_change(self):
-        self.data_yoy = calculate_yoy_change(self.data)
+        self.data_yoy = self.feature('yoy')
         column_name = f"{self.series_id}_yoy"
         self.data_yoy.rename(columns={self.data_yoy.columns[0]: column_name}, inplace=True)
 
     def generate_running_percentile(self, window_size=12):
-        self.data_r_p = calculate_running_percentile(self.data, window_size)
+        self.data_r_p = self.feature('running_percentile', window_size=window_size)
         column_name = f"{self.series_id}_rp"
         self.data_r_p.rename(columns={self.data_r_p.columns[0]: column_name}, inplace=True)
-
-
-
@@ -1,13 +1,9 @@
-import data_sourcer as ds
-import trend_identification as trend
-import utils as ut
+import batch_runner as batch
+import data_providers as dp
+import profiling as prof
 from configparser import ConfigParser, ExtendedInterpolation
 import pandas as pd
 import os
-import matplotlib
-import matplotlib.pyplot as plt
-matplotlib.use('Agg')  # Set the non-interactive backend
-from tqdm import tqdm
 
 # read configuration
 config = ConfigParser(interpolation=ExtendedInterpolation())
@@ -27,28 +23,34 @@ current_folder = os.path.dirname(os.path.abspath(__file__))
 figure_folder = os.path.join(current_folder, '..', 'output', 'figures')
 if not os.path.exists(figure_folder):
     os.makedirs(figure_folder)
+cache_folder = os.path.join(current_folder, '..', 'output', 'cache', 'prices')
+provider = dp.create_provider(config['data_provider']['price_provider'],
+                              os.path.join(current_folder, '..', config['data_provider']['snapshot_folder']),
+                              float(config['data_provider']['latency_in_seconds']))
+if not provider.is_network:
+    cache_folder = None  # the snapshots are local already
 
-for code in tqdm(code_list, desc="Processing instruments in the code list"):
-    price_raw = ds.download_stock_price_daily_close(code, start_date, end_date)
-    RP_vector, RP_summary = trend.trend_identification_main(price_raw, False, window_in_days)
-    trend.trend_plot_curve(RP_vector, RP_summary, window_in_days)
-    fig_file_name = ut.remove_illegal_symbols(code)
-    plt.savefig(os.path.join(figure_folder, f"curve_{fig_file_name}_{window_in_days}D.png"))
-    plt.close()
+# The instruments are processed in parallel worker processes, which download the prices, identify the trends and save
+# the figures. The guard is needed since the workers import this module again on Windows.
+if __name__ == '__main__':
+    results, errors = batch.run_batch(code_list, start_date, end_date, window_in_days, window_in_days_list,
+                                      figure_folder, cache_folder,
+                                      max_age_in_hours=float(config['data_cache']['max_age_in_hours']),
+                                      is_offline=config['data_cache'].getboolean('is_offline'),
+                                      is_profiled=config['profiling'].getboolean('is_profiled'),
+                                      track_memory=config['profiling'].getboolean('track_memory'),
+                                      provider=provider)
+    for code, error in errors.items():
+        print(f"Failed to process {code}:\n{error}")
 
-    # Create a 2x2 subplot grid for scatter plots
-    fig, axs = plt.subplots(2, 2, figsize=[10, 8])
-    # Generate figures and plot them in the subplots
-    for i, ax in enumerate(axs.flatten(), 1):
-        RP_vector, RP_summary = trend.trend_identification_main(price_raw, False, window_in_days_list[i-1])
-        trend.trend_plot_scatter(RP_summary, window_in_days_list[i-1])
-        plt.sca(ax)
-    # Adjust the layout to prevent overlapping titles
-    plt.tight_layout()
-    # plt.show()
-    # plt.savefig(os.path.join(figure_folder, f"scatter_{fig_file_name}.png"))
-    plt.close()
+    # Report which stage and which instrument took the time.
+    if config['profiling'].getboolean('is_profiled'):
+        records = batch.profile_records(results)
+        profile_folder = os.path.join(current_folder, '..', 'output', 'profiling')
+        os.makedirs(profile_folder, exist_ok=True)
+        prof.write_records(records, os.path.join(profile_folder, 'profile_records.jsonl'))
+        print(prof.summary_table(records))
+        prof.summary_table(records, by=('stage', 'code')).to_csv(os.path.join(profile_folder, 'profile_summary.csv'))
 
-# Reset the warning filter to default behavior
-pd.options.mode.chained_assignment = 'warn'
-matplotlib.use('TkAgg')  # Set to the interactive backend again
+    # Reset the warning filter to default behavior
+    pd.options.mode.chained_assignment = 'warn'
@@ -1,15 +1,14 @@
+import os
 import configparser
+import functools
 import pandas as pd
-import pandas_datareader.data as web
 import data_sourcer as ds
+import data_providers as dp
 import trend_identification as trend
+import walk_forward as wf
 from tqdm import tqdm
 import matplotlib.pyplot as plt
 
-from sklearn.linear_model import LogisticRegression
-from sklearn.model_selection import train_test_split
-from sklearn import metrics
-
 # Specifically to suppress the warning "A value is trying to be set on a copy of a slice from a DataFrame."
 pd.options.mode.chained_assignment = None  # 'warn', 'raise', None
 
@@ -32,62 +31,90 @@ for key, value in config.items('fred_data_label'):
 start_date = config['trend_identification']['start_date']
 end_date = pd.to_datetime('today')
 
-# Download data for each series ID and store it in a list of EconomicVariables objects
-economic_variables_list = []
-for series_id in tqdm(section_data, desc="Processing variables in the series ID list"):
-    data_raw = web.DataReader(series_id, 'fred', start_date, end_date)
-    data, frequency = ds.identify_data_frequency(data_raw)
-    data_resampled = ds.resample_to_last_day_in_month(data)
-    assert frequency == 30, f"Please check the variable {series_id}; it may not have the monthly frequency!"
-    variable = ds.EconomicVariables(data_resampled, series_id, frequency, series_id[:2])
-    variable.generate_yoy_change()
-    variable.generate_running_percentile(window_size=36)
-    economic_variables_list.append(variable)
-
-# Prepare the data for logistic regression
-risk_drivers_list = []
-for variable in tqdm(economic_variables_list, desc="Collecting variables as risk drivers"):
-    risk_drivers_list.append(variable.data)
-    # risk_drivers_list.append(variable.data_yoy)
-    risk_drivers_list.append(variable.data_r_p)
-
-risk_drivers_df = pd.concat(risk_drivers_list, axis=1, join='inner')
-
-# Next, process the dependent variable
-code = config['trend_identification']['code']
-window_in_days = int(config['local_extreme']['window_in_days'])
-price_raw = ds.download_stock_price_daily_close(code, start_date, end_date)
-price_raw_monthly = ds.calculate_monthly_average(price_raw) # Here we work with monthly data!
-price_raw_monthly_resampled = ds.resample_to_last_day_in_month(price_raw_monthly)
-RP_vector, RP_summary = trend.trend_identification_main(price_raw_monthly_resampled, True, window_in_days)
-
-# Now, extend the df and prepare for logistic regression
-risk_drivers_list.append(pd.DataFrame(RP_vector.is_upward_trend).astype(int))
-regression_dataset_df = pd.concat(risk_drivers_list, axis=1, join='inner')
-predictors = regression_dataset_df.drop('is_upward_trend', axis=1)
-target = regression_dataset_df['is_upward_trend']
-
-# Regression
-model = LogisticRegression(max_iter=100000)
-model.fit(predictors, target)
-predictions = model.predict(predictors)
-predictions_series = pd.Series(predictions, index=target.index)
-
-# Evaluation
-report = metrics.classification_report(target, predictions)
-print("Classification Report:\n", report)
-
-logits = model.decision_function(predictors)
-y_pred_proba = model.predict_proba(predictors)[::,1]
-fpr, tpr, _ = metrics.roc_curve(target,  y_pred_proba)
-auc = metrics.roc_auc_score(target, y_pred_proba)
-plt.plot(fpr,tpr,label="data 1, auc="+str(auc))
-plt.legend(loc=4)
-plt.show()
-
-plt.figure()
-plt.scatter(logits, y_pred_proba, alpha=0.3)
-plt.scatter(logits, target, alpha=0.3)
-
-
-
+# The guard is needed since the walk-forward workers import this module again on Windows.
+if __name__ == '__main__':
+    # Download all series at once (concurrently; only new observations if already on disk) and store them in a list of
+    # EconomicVariables objects
+    current_folder = os.path.dirname(os.path.abspath(__file__))
+    snapshot_folder = os.path.join(current_folder, '..', config['data_provider']['snapshot_folder'])
+    latency_in_seconds = float(config['data_provider']['latency_in_seconds'])
+    economic_provider = dp.create_provider(config['data_provider']['economic_provider'], snapshot_folder,
+                                           latency_in_seconds)
+    price_provider = dp.create_provider(config['data_provider']['price_provider'], snapshot_folder, latency_in_seconds)
+    fred_cache = None
+    if economic_provider.is_network:
+        fred_cache = ds.LocalSeriesCache(os.path.join(current_folder, '..', 'output', 'cache', 'fred'),
+                                         economic_provider.fetch_one,
+                                         max_age_in_hours=float(config['data_cache']['max_age_in_hours']),
+                                         is_offline=config['data_cache'].getboolean('is_offline'))
+    fred_panel, failures = ds.download_fred_panel(section_data, start_date, end_date, fred_cache,
+                                                  provider=economic_provider)
+    assert not failures, f"Failed to download the series {list(failures)}!"
+    economic_variables_list = []
+    for series_id in tqdm(section_data, desc="Processing variables in the series ID list"):
+        data_raw = fred_panel[[series_id]].dropna()
+        lag_period_in_months = config.getint('fred_publication_lag', series_id, fallback=0)
+        variable = ds.EconomicVariables(data_raw, series_id, ds.detect_frequency(data_raw.index), series_id[:2],
+                                        lag_period_in_months)
+        economic_variables_list.append(variable)
+
+    # Prepare the data for logistic regression: all the variables on one monthly calendar, as of the month ends, with
+    # their running percentiles from the feature store
+    monthly_panel = ds.build_monthly_panel(economic_variables_list, join='outer')
+    feature_folder = os.path.join(current_folder, '..', 'output', 'cache', 'features')
+    window_size_list = [int(item.strip())
+                        for item in config['economic_features']['running_percentile_window_list'].split(',')]
+    risk_drivers_list = [monthly_panel]
+    for variable in economic_variables_list:
+        monthly_variable = ds.EconomicVariables(monthly_panel[[variable.series_id]].dropna(), variable.series_id, 'M',
+                                                variable.country_code, cache_folder=feature_folder)
+        for window_size in window_size_list:
+            risk_drivers_list.append(monthly_variable.feature('running_percentile', window_size=window_size))
+    risk_drivers_df = pd.concat(risk_drivers_list, axis=1)
+
+    # Next, process the dependent variable
+    code = config['trend_identification']['code']
+    window_in_days = int(config['local_extreme']['window_in_days'])
+    price_raw = ds.download_stock_price_daily_close(code, start_date, end_date, provider=price_provider)
+    price_raw_monthly = ds.calculate_monthly_average(price_raw) # Here we work with monthly data!
+    price_raw_monthly_resampled = ds.resample_to_last_day_in_month(price_raw_monthly)
+    # The trends of an unchanged price curve are read from the disk tier of the memoization
+    trend_cache = trend.TrendResultCache(cache_folder=os.path.join(current_folder, '..', 'output', 'cache', 'trends'))
+    RP_vector, RP_summary = trend.trend_identification_cached(price_raw_monthly_resampled, True, window_in_days,
+                                                              cache=trend_cache)
+
+    # Now, extend the df and prepare for logistic regression
+    regression_dataset_df = risk_drivers_df.join(RP_vector.is_upward_trend.astype(int), how='inner').dropna()
+
+    # Walk-forward backtest: the model is refitted every refit_every_in_months on the past months only, and its
+    # out-of-sample probabilities are evaluated. The training labels of every refit are identified on the prices
+    # before the refit date only, unless the hindsight labels are asked for.
+    walk_forward_config = config['walk_forward']
+    training_target = None
+    if walk_forward_config.getboolean('is_point_in_time_target'):
+        training_target = functools.partial(wf.point_in_time_target, price_raw_monthly_resampled, True, window_in_days)
+    backtest_df, evaluation = wf.run_walk_forward(
+        regression_dataset_df,
+        min_train_size=int(walk_forward_config['min_train_size_in_months']),
+        refit_every=int(walk_forward_config['refit_every_in_months']),
+        train_size=(int(walk_forward_config['train_size_in_months']) if walk_forward_config['train_size_in_months']
+                    else None),
+        gap=int(walk_forward_config['gap_in_months']),
+        max_workers=int(walk_forward_config['max_workers']) if walk_forward_config['max_workers'] else None,
+        model_parameters={'max_iter': 100000},
+        training_target=training_target)
+
+    # Evaluation
+    print(f"Out-of-sample evaluation over {evaluation['number_dates']} months:")
+    print("Classification Report:\n", evaluation['report'])
+
+    if evaluation['auc'] is not None:
+        plt.plot(evaluation['fpr'], evaluation['tpr'], label="out of sample, auc=" + str(evaluation['auc']))
+        plt.legend(loc=4)
+        plt.show()
+
+    plt.figure()
+    plt.plot(backtest_df['probability'], label='probability of an upward trend')
+    plt.plot(backtest_df['target'], alpha=0.3, label='upward trend')
+    plt.legend()
+    plt.show()
@@ -0,0 +1,153 @@
+# This module contains an opt-in instrumentation of the pipeline stages. The stages are marked in the code with
+#
+#     with prof.stage('find_RP') as record:
+#         ...
+#         record['rows'] = len(RP_summary)
+#
+# As long as no profiler is enabled, stage() returns a shared no-op context manager, so the marks cost next to nothing.
+# Once enabled, every stage records its wall time, the rows it reports and optionally its memory, together with the
+# labels that are active (e.g. the instrument code), such that a slow batch can be traced to a stage and an instrument.
+
+import os
+import json
+import time
+import threading
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+import pandas as pd
+
+# The profiler that records the stages; None if profiling is disabled.
+active_profiler = None
+# The labels added to every record, e.g. {'code': '^GSPC'}; see labels().
+_active_labels = ContextVar('active_labels', default={})
+# The record of a disabled stage is a throwaway dictionary, so that the code in the stage does not need to check.
+_disabled_stage = nullcontext({})
+
+
+class StageProfiler:
+    """
+    This class collects the records of the stages while it is the active profiler.
+
+    With track_memory, tracemalloc is started and each record gets the peak of the traced memory during the stage and
+    the memory still allocated at its end, both relative to its start. Note that tracemalloc traces the whole process
+    (so concurrent threads count as well) and slows the allocations down.
+    """
+
+    def __init__(self, track_memory=False):
+        self.track_memory = track_memory
+        self.records = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @contextmanager
+    def stage(self, name, **labels):
+        record = {'stage': name, **_active_labels.get(), **labels, 'rows': None}
+        # tracemalloc has only one peak, which is reset per stage; the peaks of the stages within a stage are carried
+        # to it on the stack of the thread.
+        peak_stack = self._local.__dict__.setdefault('peak_stack', [])
+        if self.track_memory:
+            memory_start, memory_peak = tracemalloc.get_traced_memory()
+            if peak_stack:
+                peak_stack[-1] = max(peak_stack[-1], memory_peak)
+            peak_stack.append(0)
+            tracemalloc.reset_peak()
+        start_time = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['seconds'] = time.perf_counter() - start_time
+            if self.track_memory:
+                memory_end, memory_peak = tracemalloc.get_traced_memory()
+                memory_peak = max(memory_peak, peak_stack.pop())
+                record['memory_peak_bytes'] = memory_peak - memory_start
+                record['memory_delta_bytes'] = memory_end - memory_start
+                if peak_stack:
+                    peak_stack[-1] = max(peak_stack[-1], memory_peak)
+                tracemalloc.reset_peak()
+            record['pid'] = os.getpid()
+            record['thread'] = threading.current_thread().name
+            with self._lock:
+                self.records.append(record)
+
+
+def enable(track_memory=False):
+    """
+    This function makes a new profiler the active one.
+
+    :param track_memory: whether the memory of the stages is traced as well.
+    :return: the StageProfiler.
+    """
+    global active_profiler
+    active_profiler = StageProfiler(track_memory)
+    if track_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    return active_profiler
+
+
+def disable():
+    """
+    This function stops the profiling.
+
+    :return: the profiler that was active, with its records; None if no profiler was active.
+    """
+    global active_profiler
+    profiler, active_profiler = active_profiler, None
+    if profiler is not None and profiler.track_memory:
+        tracemalloc.stop()
+    return profiler
+
+
+def stage(name, **labels):
+    """
+    This function marks a stage of the pipeline; see the top of the module.
+
+    :param name: the name of the stage.
+    :param labels: extra fields of the record, e.g. the code of the series.
+    :return: a context manager that yields the record (a dictionary) of the stage.
+    """
+    if active_profiler is None:
+        return _disabled_stage
+    return active_profiler.stage(name, **labels)
+
+
+@contextmanager
+def labels(**new_labels):
+    """
+    This function adds labels to the records of all the stages within its context (in the same thread), e.g. the
+    instrument that is being processed.
+    """
+    token = _active_labels.set({**_active_labels.get(), **new_labels})
+    try:
+        yield
+    finally:
+        _active_labels.reset(token)
+
+
+def summary_table(records, by=('stage',)):
+    """
+    This function summarizes the records per stage (or per any other fields of the records).
+
+    :param records: the records of one or more profilers.
+    :param by: the fields to group by, e.g. ('stage', 'code').
+    :return: a dataframe with the number of calls, the total, mean and maximum wall time, the total rows and, if
+    traced, the maximum memory peak; sorted by the total time.
+    """
+    records_df = pd.DataFrame(records)
+    if records_df.empty:
+        return records_df
+    aggregations = {'calls': ('seconds', 'size'), 'total_seconds': ('seconds', 'sum'),
+                    'mean_seconds': ('seconds', 'mean'), 'max_seconds': ('seconds', 'max'), 'rows': ('rows', 'sum')}
+    if 'memory_peak_bytes' in records_df.columns:
+        aggregations['max_memory_peak_bytes'] = ('memory_peak_bytes', 'max')
+    summary = records_df.groupby(list(by), dropna=False).agg(**aggregations)
+    return summary.sort_values('total_seconds', ascending=False)
+
+
+def write_records(records, file_path):
+    """
+    This function writes the records as a structured log, one JSON object per line.
+    """
+    with open(file_path, 'w') as file:
+        for record in records:
+            file.write(json.dumps(record, default=str) + '\n')
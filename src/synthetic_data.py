@@ -0,0 +1,113 @@
+# This module generates deterministic synthetic price curves, such that the trend identification can be run and
+# benchmarked without downloading any data. The paths follow either a geometric Brownian motion (GBM) or a GBM whose
+# drift and volatility switch between a bull and a bear regime.
+
+import numpy as np
+import pandas as pd
+
+# The number of bars per year of the supported frequencies, used to scale the drift and the volatility.
+BARS_PER_YEAR = {'B': 252, 'M': 12, 'h': 252 * 24, 'min': 252 * 24 * 60, 's': 252 * 24 * 60 * 60}
+# If the date range of the requested frequency does not fit in pandas' timestamps (i.e. after 2262), the bars are
+# placed on the next finer frequency, which keeps the index sorted and unique.
+FINER_FREQUENCIES = ['M', 'B', 'h', 'min', 's']
+
+
+def synthetic_index(number_bars, frequency='B', start_date='1990-01-01'):
+    """
+    This function creates the datetime index of a synthetic price curve.
+
+    :param number_bars: the number of bars.
+    :param frequency: 'B' for business days or 'M' for month ends.
+    :param start_date: the date of the first bar.
+    :return index: the DatetimeIndex, in the given frequency or a finer one if the range does not fit.
+    :return frequency: the frequency of the index, which sets the time step of the paths.
+    """
+    assert frequency in FINER_FREQUENCIES, f"The frequency should be one of {FINER_FREQUENCIES}!"
+    for finer_frequency in FINER_FREQUENCIES[FINER_FREQUENCIES.index(frequency):]:
+        try:
+            return pd.date_range(start=start_date, periods=number_bars, freq=finer_frequency), finer_frequency
+        except (ValueError, OverflowError):  # pandas' out-of-bounds errors are ValueErrors
+            continue
+    raise ValueError(f"{number_bars} bars do not fit in a datetime index.")
+
+
+def generate_gbm_price(number_bars, frequency='B', drift=0.05, volatility=0.2, start_price=100.0,
+                       start_date='1990-01-01', seed=0):
+    """
+    This function generates a price curve following a geometric Brownian motion.
+
+    :param number_bars: the number of bars.
+    :param frequency: 'B' for business days or 'M' for month ends; see synthetic_index for long curves.
+    :param drift: the annual drift.
+    :param volatility: the annual volatility.
+    :param start_price: the price of the first bar.
+    :param start_date: the date of the first bar.
+    :param seed: the seed of the random generator; the same seed gives the same curve.
+    :return: a dataframe with one column 'Close' and a datetime index, like download_stock_price_daily_close.
+    """
+    rng = np.random.default_rng(seed)
+    index, frequency = synthetic_index(number_bars, frequency, start_date)
+    time_step = 1 / BARS_PER_YEAR[frequency]
+    log_returns = (drift - volatility ** 2 / 2) * time_step + volatility * np.sqrt(time_step) * \
+        rng.standard_normal(number_bars)
+    log_returns[0] = 0
+    price = start_price * np.exp(np.cumsum(log_returns))
+    return pd.DataFrame({'Close': price}, index=index)
+
+
+def generate_regime_switching_price(number_bars, frequency='B', drifts=(0.15, -0.25), volatilities=(0.12, 0.35),
+                                    switch_probabilities=(0.005, 0.02), start_price=100.0, start_date='1990-01-01',
+                                    seed=0):
+    """
+    This function generates a price curve from a GBM whose drift and volatility follow a 2-state Markov chain, i.e. a
+    curve with long bull trends and shorter, more volatile bear trends.
+
+    :param number_bars: the number of bars.
+    :param frequency: 'B' for business days or 'M' for month ends; see synthetic_index for long curves.
+    :param drifts: the annual drift per regime (bull, bear).
+    :param volatilities: the annual volatility per regime (bull, bear).
+    :param switch_probabilities: per regime, the probability per bar to switch to the other regime.
+    :param start_price: the price of the first bar.
+    :param start_date: the date of the first bar.
+    :param seed: the seed of the random generator; the same seed gives the same curve.
+    :return: a dataframe with the columns 'Close' and 'regime' (0 for bull, 1 for bear) and a datetime index.
+    """
+    rng = np.random.default_rng(seed)
+    index, frequency = synthetic_index(number_bars, frequency, start_date)
+    time_step = 1 / BARS_PER_YEAR[frequency]
+    # The regime path: the switches are drawn for both regimes, and the regime only changes on a switch of the
+    # current regime. Only the regime changes are looped over, by binary search in the switches of each regime.
+    is_switch_draw = rng.random((2, number_bars)) < np.asarray(switch_probabilities)[:, None]
+    switch_positions = [np.flatnonzero(is_switch_draw[0]), np.flatnonzero(is_switch_draw[1])]
+    regime = np.zeros(number_bars, dtype=np.int8)
+    position = 0
+    current_regime = 0
+    while position < number_bars:
+        next_switch = np.searchsorted(switch_positions[current_regime], position)
+        end = switch_positions[current_regime][next_switch] + 1 \
+            if next_switch < switch_positions[current_regime].size else number_bars
+        regime[position:end] = current_regime
+        position = end
+        current_regime = 1 - current_regime
+
+    drift = np.asarray(drifts)[regime]
+    volatility = np.asarray(volatilities)[regime]
+    log_returns = (drift - volatility ** 2 / 2) * time_step + volatility * np.sqrt(time_step) * \
+        rng.standard_normal(number_bars)
+    log_returns[0] = 0
+    price = start_price * np.exp(np.cumsum(log_returns))
+    return pd.DataFrame({'Close': price, 'regime': regime}, index=index)
+
+
+def generate_price(model, number_bars, frequency='B', seed=0):
+    """
+    This function dispatches to the generator of the given model.
+
+    :param model: 'gbm' or 'regime_switching'.
+    :return: a dataframe with the price in the column 'Close'.
+    """
+    if model == 'gbm':
+        return generate_gbm_price(number_bars, frequency, seed=seed)
+    elif model == 'regime_switching':
+        return generate_regime_switching_price(number_bars, frequency, seed=seed)[['Close']]
+    raise ValueError(f"Unknown model {model}; should be 'gbm' or 'regime_switching'.")
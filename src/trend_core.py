@@ -0,0 +1,1103 @@
+# This module is the compute core of the trend identification, including a.o. the following:
+#   - finding all the reflection points and then the validated ones (vMARP & vMIRP).
+#   - divide the price curve into upward and downward trends
+# It only imports NumPy and pandas (and scipy for current_state_in_trend, on first use), such that a worker process that
+# only computes trends starts fast. The plotting functions are in trend_identification, which also re-exports this
+# module.
+
+import os
+from bisect import bisect_left
+import hashlib
+import threading
+import pandas as pd
+import numpy as np
+
+import utils as ut
+import data_sourcer as ds
+import profiling as prof
+
+# Specifically to suppress the warning "A value is trying to be set on a copy of a slice from a DataFrame."
+pd.options.mode.chained_assignment = None  # 'warn', 'raise', None
+
+# Class: precomputed range-extremum index (sparse table) of one price series.
+class RangeExtremaIndex:
+    """
+    This class precomputes a sparse table of the range minima and maxima of a price series, such that the minimum or
+    maximum over any range [left, right] is answered in O(1), without rolling over the series again. It is built once
+    per price series and can then serve the running extrema of find_RP for any window size.
+
+    The running extrema reproduce price.rolling(window=2 * window_in_days, min_periods=window_in_days, center=True),
+    i.e. the window of position t is [t - window_in_days, t + window_in_days - 1], clipped at both ends of the series
+    and NaN values are skipped. Memory usage is O(n log n), so the class is meant for daily histories, not for tick data.
+    """
+
+    def __init__(self, price):
+        """
+        :param price: the price series to index. Either a dataframe with the price in its first column, a series or an
+        array.
+        """
+        values = price.iloc[:, 0] if isinstance(price, pd.DataFrame) else price
+        values = np.asarray(values, dtype=float).ravel()
+        self.size = values.size
+        number_levels = max(int(self.size).bit_length(), 1)
+        self.min_table = np.full((number_levels, self.size), np.nan)
+        self.max_table = np.full((number_levels, self.size), np.nan)
+        self.min_table[0] = values
+        self.max_table[0] = values
+        for level in range(1, number_levels):
+            half = 1 << (level - 1)
+            length = self.size - (1 << level) + 1
+            self.min_table[level, :length] = np.fmin(self.min_table[level - 1, :length],
+                                                     self.min_table[level - 1, half:half + length])
+            self.max_table[level, :length] = np.fmax(self.max_table[level - 1, :length],
+                                                     self.max_table[level - 1, half:half + length])
+        # cumulative count of the non-NaN values, needed to mimic min_periods of the rolling window
+        self.valid_count = np.r_[0, np.cumsum(~np.isnan(values))]
+
+    def query(self, left, right, find_max=False):
+        """
+        This function returns the minimum (or maximum) over the ranges [left, right], both ends included.
+
+        :param left: array of the first positions of the ranges.
+        :param right: array of the last positions of the ranges; right >= left.
+        :param find_max: whether the maximum (True) or the minimum (False) is searched for.
+        :return: array of the range extrema; NaN if a range contains only NaN values.
+        """
+        left = np.asarray(left, dtype=np.int64)
+        right = np.asarray(right, dtype=np.int64)
+        level = np.floor(np.log2(right - left + 1)).astype(np.int64)
+        table, combine = (self.max_table, np.fmax) if find_max else (self.min_table, np.fmin)
+        return combine(table[level, left], table[level, right - (1 << level) + 1])
+
+    def running_extrema(self, window_in_days):
+        """
+        This function gives the centered running minimum and maximum for the given window, identical to the rolling
+        calculation in find_RP.
+
+        :param window_in_days: the 2-sided horizon length.
+        :return: running_min, running_max as arrays.
+        """
+        positions = np.arange(self.size)
+        left = np.maximum(positions - window_in_days, 0)
+        right = np.minimum(positions + window_in_days - 1, self.size - 1)
+        is_enough_data = (self.valid_count[right + 1] - self.valid_count[left]) >= window_in_days
+        running_min = np.where(is_enough_data, self.query(left, right, find_max=False), np.nan)
+        running_max = np.where(is_enough_data, self.query(left, right, find_max=True), np.nan)
+        return running_min, running_max
+
+
+# Function: find all the validated reflection points.
+def find_RP(price, window_in_days, extrema_index=None):
+    """
+    This function tries to identify all the minimum reflection points (MIRP) in a given price curve.
+    Given a horizon tau, at any time t, one can look for the local min as the minimum within the time interval
+    [t-tau, t+tau]:
+
+    .. math::
+
+        MIRP_{t, \tau} = min_s\{S_s | s\in[t-\tau, t+\tau]\}
+
+    If s happens to be equal to t, then :math:`S_t` is called a minimum reflection point (MIRP).
+
+    :param price: the price of interest to find the MIRPs. It should be a dataframe and contain only one column: the
+    price (numeric). Index should be datetime.
+    :param window_in_days: the 2-sided horizon length
+    :param extrema_index: optional RangeExtremaIndex built on the same price; if given, the running extrema are queried
+    from it instead of being rolled over the whole series again.
+    :return RP_vector: the location (i.e. date) of the validated reflection points, together with the full price vector.
+    :return RP_summary: the list of (only) the validated reflection points.
+    """
+
+    RP_vector = pd.DataFrame(data=price.iloc[:, 0], index=price.index)
+    if extrema_index is None:
+        RP_vector.loc[:, "running_min"] = RP_vector.iloc[:, 0].rolling(window=window_in_days * 2, min_periods=window_in_days,
+                                                                center=True).min()
+        RP_vector.loc[:, "running_max"] = RP_vector.iloc[:, 0].rolling(window=window_in_days * 2, min_periods=window_in_days,
+                                                                center=True).max()
+    else:
+        assert extrema_index.size == len(RP_vector), "The extrema index is not built on the given price!"
+        running_min, running_max = extrema_index.running_extrema(window_in_days)
+        RP_vector.loc[:, "running_min"] = running_min
+        RP_vector.loc[:, "running_max"] = running_max
+    RP_vector.loc[:, 'is_MIRP'] = (RP_vector.loc[:, 'running_min'] == RP_vector.iloc[:, 0])
+    RP_vector.loc[:, 'is_MARP'] = (RP_vector.loc[:, 'running_max'] == RP_vector.iloc[:, 0])
+    RP_vector.loc[:, 'is_RP'] = RP_vector.is_MIRP | RP_vector.is_MARP
+
+    return validate_RP(RP_vector)
+
+
+# Function: keep only the validated reflection points.
+def validate_RP(RP_vector):
+    """
+    This function resolves the runs of consecutive MIRPs (MARPs), of which only the lowest (highest) one is a validated
+    reflection point (vMIRP / vMARP). Only the rows flagged by is_RP are used, so the function gives the same result on
+    the full price curve and on its reflection points only.
+
+    :param RP_vector: the price curve with the columns running_min, running_max, is_MIRP, is_MARP and is_RP.
+    :return RP_vector: the same RP_vector, in which is_MIRP and is_MARP are reset for the non-validated points.
+    :return RP_summary: the list of (only) the validated reflection points.
+    """
+
+    # RP_summary contains ONLY the reflection points, while RP_vector contains the entire price curve.
+    RP_summary = RP_vector[RP_vector['is_RP']]
+
+    # find validated reflection points. See the methodology documentation for more information.
+    is_vMIRP, is_vMARP = validate_RP_flags(RP_summary.iloc[:, 0].to_numpy(dtype=float),
+                                           RP_summary['is_MIRP'].to_numpy(dtype=bool),
+                                           RP_summary['is_MARP'].to_numpy(dtype=bool))
+    RP_summary.loc[:, 'is_vMIRP'] = is_vMIRP
+    RP_summary.loc[:, 'is_vMARP'] = is_vMARP
+    RP_summary.loc[:, 'is_vRP'] = is_vMIRP | is_vMARP
+    false_alarm = RP_summary[RP_summary.loc[:, 'is_vRP'] == False]
+    RP_vector.loc[false_alarm.index, ['is_MARP', 'is_MIRP']] = False
+    RP_summary = RP_summary[RP_summary.loc[:, 'is_vRP'] == True]
+
+    return RP_vector, RP_summary
+
+
+def validate_RP_flags(RP_price, is_MIRP, is_MARP, column_ids=None):
+    """
+    This function is the array version of validate_RP: within each run of consecutive MIRPs (MARPs), only the lowest
+    (highest) one is validated. No temporary columns are created.
+
+    :param RP_price: the price of the reflection points (only).
+    :param is_MIRP: per reflection point, whether it is a MIRP.
+    :param is_MARP: per reflection point, whether it is a MARP.
+    :param column_ids: optional, per reflection point, the instrument it belongs to, for the reflection points of many
+    instruments sorted by instrument and date; runs never continue over two instruments.
+    :return is_vMIRP, is_vMARP: per reflection point, whether it is a validated MIRP (MARP).
+    """
+    is_same_column = np.ones(max(len(RP_price) - 1, 0), dtype=bool) if column_ids is None else \
+        column_ids[1:] == column_ids[:-1]
+    is_MIRP_pair = is_MIRP[1:] & is_MIRP[:-1] & is_same_column
+    is_MARP_pair = is_MARP[1:] & is_MARP[:-1] & is_same_column
+    is_duplicate_minimum = is_MIRP & (np.r_[False, is_MIRP_pair] | np.r_[is_MIRP_pair, False])
+    is_duplicate_maximum = is_MARP & (np.r_[False, is_MARP_pair] | np.r_[is_MARP_pair, False])
+    group_ids = np.cumsum(np.r_[True, (is_duplicate_minimum[1:] != is_duplicate_minimum[:-1]) |
+                                (is_duplicate_maximum[1:] != is_duplicate_maximum[:-1]) | ~is_same_column])[:len(RP_price)]
+
+    # Resolve the duplicates with array operations only: within each run of duplicate MIRPs (MARPs), only the lowest
+    # (highest) price remains a validated reflection point.
+    group_starts = ut.segment_starts(group_ids)
+    group_lengths = np.diff(np.r_[group_starts, len(group_ids)])
+    positions = np.arange(len(group_ids))
+    is_duplicate_group = (is_duplicate_minimum | is_duplicate_maximum)[group_starts]
+    is_MIRP_group = np.repeat(is_duplicate_group & is_MIRP[group_starts], group_lengths)
+    is_MARP_group = np.repeat(is_duplicate_group & is_MARP[group_starts], group_lengths)
+    position_of_min = np.repeat(ut.segment_arg_extreme(group_ids, RP_price, find_max=False), group_lengths)
+    position_of_max = np.repeat(ut.segment_arg_extreme(group_ids, RP_price, find_max=True), group_lengths)
+    is_vMIRP = np.where(is_MIRP_group, positions == position_of_min, is_MIRP)
+    is_vMARP = np.where(is_MARP_group, positions == position_of_max, is_MARP)
+    return is_vMIRP, is_vMARP
+
+
+def clean_RP_summary(RP_summary):
+    """
+    This function removes the irregular reflection points, i.e. a vMIRP above the previous RP or a vMARP below it,
+    together with the RP before it, until the vMIRPs and vMARPs strictly alternate; see sweep_irregular_RP. The first
+    RP has no return and is dropped, then the returns and durations of the remaining trends are calculated once. Every
+    remaining RP is either a vMIRP or a vMARP, also one that was validated as both.
+
+    :param RP_summary: the list of (only) the validated reflection points.
+    :return RP_summary: the cleaned RP_summary, extended with returns and duration.
+    """
+    kept, is_vMARP, RP_return, RP_duration = clean_RP_arrays(RP_summary.index.to_numpy(),
+                                                             RP_summary.iloc[:, 0].to_numpy(dtype=float),
+                                                             RP_summary['is_vMIRP'].to_numpy(dtype=bool),
+                                                             RP_summary['is_vMARP'].to_numpy(dtype=bool))
+    RP_summary = RP_summary.iloc[kept]
+    RP_summary['is_vMIRP'] = ~is_vMARP
+    RP_summary['is_vMARP'] = is_vMARP
+    RP_summary['return'] = RP_return
+    RP_summary['return_type'] = np.where(is_vMARP, 'gain', 'loss')
+    RP_summary['duration'] = RP_duration
+    return RP_summary
+
+
+def sweep_irregular_RP(RP_price, is_vMIRP, is_vMARP, column_ids=None):
+    """
+    This function removes the irregular reflection points in a single pass with a stack of the RPs kept so far, which
+    always strictly alternate between vMIRP and vMARP:
+        - an RP of the same type as the top of the stack replaces it if it is more extreme (lower for a vMIRP, higher
+          for a vMARP), and is dropped otherwise;
+        - an irregular RP, i.e. a vMIRP above the top of the stack or a vMARP below it, is dropped together with the top
+          of the stack;
+        - any other RP is pushed on the stack.
+    Every RP is pushed and popped at most once, so the result is reached in linear time and is a fixed point: applying
+    the function again keeps all the RPs.
+
+    An RP that is validated as both vMIRP and vMARP (the running minimum and maximum are equal, i.e. the price is flat
+    over the window) takes the type opposite to the top of the stack, or is a vMIRP on an empty stack. The resolved
+    types are returned, so that the cleaning, the returns and the trend labels all use the same type per RP.
+
+    :param RP_price: the price of the validated reflection points.
+    :param is_vMIRP: per validated reflection point, whether it is a vMIRP.
+    :param is_vMARP: per validated reflection point, whether it is a vMARP.
+    :param column_ids: optional, see validate_RP_flags; every instrument has its own stack.
+    :return kept: the positions (in the input arrays) of the reflection points that remain, in order.
+    :return is_kept_vMARP: per remaining reflection point, whether it is a vMARP (otherwise a vMIRP).
+    """
+    # The loop runs on Python lists, which are much faster to index than arrays.
+    RP_price = np.asarray(RP_price).tolist()
+    is_dual = (np.asarray(is_vMIRP) & np.asarray(is_vMARP)).tolist()
+    is_vMARP = (np.asarray(is_vMARP) & ~np.asarray(is_vMIRP)).tolist()
+    column_ids = None if column_ids is None else np.asarray(column_ids).tolist()
+    kept = []
+    column_start = 0  # the position in kept of the first RP of the current instrument
+    for position in range(len(RP_price)):
+        if column_ids is not None and position > 0 and column_ids[position] != column_ids[position - 1]:
+            column_start = len(kept)
+        if len(kept) == column_start:
+            kept.append(position)
+            continue
+        top = kept[-1]
+        if is_dual[position]:
+            is_vMARP[position] = not is_vMARP[top]
+        price = RP_price[position]
+        if is_vMARP[position] == is_vMARP[top]:
+            if (price > RP_price[top]) if is_vMARP[position] else (price < RP_price[top]):
+                kept[-1] = position
+        elif (price < RP_price[top]) if is_vMARP[position] else (price > RP_price[top]):
+            kept.pop()
+        else:
+            kept.append(position)
+    kept = np.asarray(kept, dtype=np.int64)
+    return kept, np.asarray(is_vMARP, dtype=bool)[kept]
+
+
+def clean_RP_arrays(RP_dates, RP_price, is_vMIRP, is_vMARP, column_ids=None):
+    """
+    This function is the array version of clean_RP_summary, on the validated reflection points.
+
+    :param RP_dates: the dates of the validated reflection points, as datetime64 array.
+    :param RP_price: the price of the validated reflection points.
+    :param is_vMIRP: per validated reflection point, whether it is a vMIRP.
+    :param is_vMARP: per validated reflection point, whether it is a vMARP.
+    :param column_ids: optional, see validate_RP_flags; every instrument is then cleaned on its own.
+    :return kept: the positions (in the input arrays) of the reflection points that remain.
+    :return is_kept_vMARP: per kept point, whether it is a vMARP (otherwise a vMIRP); see sweep_irregular_RP.
+    :return RP_return, RP_duration: the return and the duration in days of the trend ending at each kept point.
+    """
+    kept, is_kept_vMARP = sweep_irregular_RP(RP_price, is_vMIRP, is_vMARP, column_ids)
+    # The first RP (of each instrument) starts the first trend; it has no return and is dropped.
+    kept_column_ids = np.zeros(len(kept)) if column_ids is None else column_ids[kept]
+    is_first = np.r_[True, kept_column_ids[1:] != kept_column_ids[:-1]][:len(kept)]
+    price = RP_price[kept]
+    RP_return = (price[1:] / price[:-1] - 1)[~is_first[1:]]
+    RP_duration = (np.diff(RP_dates[kept]) / np.timedelta64(1, 'D'))[~is_first[1:]]
+    return kept[~is_first], is_kept_vMARP[~is_first], RP_return, RP_duration
+
+
+def trend_labels(RP_positions, is_vMIRP, positions):
+    """
+    This function gives the trend indicator for the requested positions of the price curve, using array operations only.
+    The bars from one validated RP up to (excluding) the next one get the direction of the former, the last RP belongs
+    to the trend that ends there, and bars before the first or after the last RP are not in an upward trend.
+
+    :param RP_positions: the (sorted) positions of the validated reflection points in the price curve.
+    :param is_vMIRP: per RP, whether it is a vMIRP, i.e. whether an upward trend starts there.
+    :param positions: the positions of the bars to label.
+    :return: boolean array, True for the bars in an upward trend.
+    """
+    RP_positions = np.asarray(RP_positions)
+    is_vMIRP = np.asarray(is_vMIRP, dtype=bool)
+    positions = np.asarray(positions)
+    if RP_positions.size < 2:
+        return np.zeros(positions.size, dtype=bool)
+    trend_number = np.minimum(np.searchsorted(RP_positions, positions, side='right') - 1, RP_positions.size - 2)
+    is_in_trend = (positions >= RP_positions[0]) & (positions <= RP_positions[-1])
+    return is_in_trend & is_vMIRP[np.maximum(trend_number, 0)]
+
+
+def assign_trend(RP_vector, RP_summary):
+    # Now identify the trend by assigning value 1 for upward trend and 0 for downward.
+    RP_positions = RP_vector.index.get_indexer(RP_summary.index)
+    RP_vector['is_upward_trend'] = trend_labels(RP_positions, RP_summary['is_vMIRP'], np.arange(len(RP_vector)))
+    return RP_vector, RP_summary
+
+
+def count_trend_time(RP_vector):
+    """
+    This function counts the time (number of days/months) since the start of the current trend.
+    :param RP_vector: the price curve WITH the trend indicator. The function first assesses whether the is_upward_trend column exists.
+    :return: RP_vector: the updated RP_vector with the time since the start of trend.
+    """
+    assert 'is_upward_trend' in RP_vector.columns, f"The trend indicator is NOT in the columns of the input!"
+    is_upward_trend = RP_vector['is_upward_trend'].to_numpy(dtype=bool)
+    trend_segment = np.cumsum(np.r_[True, is_upward_trend[1:] != is_upward_trend[:-1]])[:len(is_upward_trend)] - 1
+    # The bars since the start of the trend is the distance to the first bar of the segment
+    RP_vector['Time_since_trend_start'] = np.arange(len(RP_vector)) - ut.segment_starts(trend_segment)[trend_segment]
+    return RP_vector
+
+
+def label_trend_segments(RP_vector, RP_summary):
+    """
+    This function labels every bar of the price curve with its trend in a single pass: the trend indicator, the id of
+    the trend segment (i.e. of the run of equal trend indicators), the position of the first bar of the segment and
+    the number of bars since the start of the trend.
+    :param RP_vector: the location (i.e. date) of the validated reflection points, together with the full price vector.
+    :param RP_summary: the list of (only) the validated reflection points.
+    :return: RP_vector: the RP_vector extended with the columns is_upward_trend, trend_segment, trend_start_index and
+    Time_since_trend_start.
+    """
+    positions = np.arange(len(RP_vector))
+    is_upward_trend = trend_labels(RP_vector.index.get_indexer(RP_summary.index), RP_summary['is_vMIRP'], positions)
+    trend_segment = np.cumsum(np.r_[True, is_upward_trend[1:] != is_upward_trend[:-1]])[:len(positions)] - 1
+    trend_start_index = ut.segment_starts(trend_segment)[trend_segment]
+    RP_vector['is_upward_trend'] = is_upward_trend
+    RP_vector['trend_segment'] = trend_segment
+    RP_vector['trend_start_index'] = trend_start_index
+    RP_vector['Time_since_trend_start'] = positions - trend_start_index
+    return RP_vector
+
+
+def current_state_in_trend(date_of_interest, nth_last_RP: int, RP_vector, RP_summary):
+    """
+
+    :param date_of_interest:
+    :param nth_last_RP: the n-th last RP that the state on date of interest is compared. Should be int. Currently we restrict it to be between 1 and 5.
+    :param RP_vector:
+    :param RP_summary:
+    :return a series of variables of interest
+    """
+    from scipy import stats  # imported on first use, see the top of the module
+
+    date = pd.to_datetime(date_of_interest)
+    assert nth_last_RP in {1, 2, 3, 4, 5}, "nth_last_RP must be an integer in the range {1, 2, 3, 4, 5}"
+    trend_start_row_index = RP_summary.index.get_loc(RP_summary[RP_summary.index < date].index[-nth_last_RP])
+    current_date_row_index = RP_vector.index.get_loc(RP_vector[RP_vector.index <= date].index[-nth_last_RP])
+    current_return = (RP_vector.iloc[current_date_row_index, 0] - RP_summary.iloc[trend_start_row_index, 0]) / RP_vector.iloc[current_date_row_index, 0]
+    current_return_type = 'gain' if current_return > 0 else 'loss'
+    current_duration = date - (RP_summary[RP_summary.index < date].index[-nth_last_RP])
+    current_duration_in_days = current_duration.days
+    current_return_percentile_raw = stats.percentileofscore(RP_summary.loc[RP_summary.return_type == current_return_type, 'return'], current_return, kind='rank')
+    current_return_percentile = current_return_percentile_raw if current_return_type == 'gain' else 100 - current_return_percentile_raw
+    current_duration_percentile = stats.percentileofscore(RP_summary.loc[RP_summary.return_type == current_return_type, 'duration'], current_duration_in_days, kind='rank')
+
+    return [current_return, current_duration_in_days, current_return_percentile / 100, current_duration_percentile / 100]
+
+
+def trend_state_history(RP_vector, RP_summary, dates=None, nth_last_RP_list=(1, 2, 3, 4, 5), window_in_days=None):
+    """
+    This function gives the output of current_state_in_trend for many dates and several nth_last_RP at once. The gain
+    and loss distributions of the returns and durations are sorted once and the percentiles are found by binary search,
+    instead of filtering RP_summary and RP_vector again for every date.
+
+    By default, the distributions contain all the RPs of RP_summary, like current_state_in_trend. If window_in_days is
+    given, only the RPs known at each date are used (both for the trend start and for the distributions): an RP is
+    known once the window_in_days bars after it are in the price curve, as its centered window is only complete then.
+    This avoids look-ahead in a feature history, although it does not redo the validation of the RPs at each date.
+
+    :param RP_vector: the location (i.e. date) of the validated reflection points, together with the full price vector.
+    :param RP_summary: the list of (only) the validated reflection points, with returns and durations.
+    :param dates: the dates of interest; by default all the dates of RP_vector.
+    :param nth_last_RP_list: the n-th last RPs that the state on the dates of interest is compared with.
+    :param window_in_days: the window (in bars of RP_vector) with which the RPs were found; only needed to use the RPs
+    known at each date.
+    :return: a dataframe indexed by the dates, with per nth the columns return_{nth}, duration_{nth},
+    return_percentile_{nth} and duration_percentile_{nth}, in the units of current_state_in_trend.
+    """
+    dates = RP_vector.index if dates is None else pd.DatetimeIndex(pd.to_datetime(dates))
+    RP_dates = RP_summary.index
+    RP_price = RP_summary.iloc[:, 0].to_numpy(dtype=float)
+    RP_return = RP_summary['return'].to_numpy(dtype=float)
+    RP_duration = RP_summary['duration'].to_numpy(dtype=float)
+    is_gain = (RP_summary['return_type'] == 'gain').to_numpy()
+    price = RP_vector.iloc[:, 0].to_numpy(dtype=float)
+
+    number_bars = RP_vector.index.searchsorted(dates, side='right')
+    number_RP_before = RP_dates.searchsorted(dates, side='left')
+    if window_in_days is None:
+        number_known_RP = np.full(len(dates), len(RP_summary))
+    else:
+        confirmation_position = RP_vector.index.get_indexer(RP_dates) + window_in_days
+        number_known_RP = np.searchsorted(confirmation_position, number_bars - 1, side='right')
+        number_RP_before = np.minimum(number_RP_before, number_known_RP)
+
+    state = {}
+    for nth in nth_last_RP_list:
+        trend_start = number_RP_before - nth
+        current_bar = number_bars - nth
+        is_valid = (trend_start >= 0) & (current_bar >= 0)
+        current_price = np.where(is_valid, price[np.maximum(current_bar, 0)], np.nan)
+        current_return = (current_price - RP_price[np.maximum(trend_start, 0)]) / current_price
+        current_duration = np.where(is_valid, (dates - RP_dates[np.maximum(trend_start, 0)]).days, np.nan)
+        state[nth] = [current_return, current_duration, np.full(len(dates), np.nan), np.full(len(dates), np.nan)]
+
+    # The distributions only change with the number of known RPs, so they are sorted once per distinct number.
+    for number_known in np.unique(number_known_RP):
+        is_date = number_known_RP == number_known
+        is_known_gain = is_gain[:number_known]
+        sorted_gain_return = np.sort(RP_return[:number_known][is_known_gain])
+        sorted_loss_return = np.sort(RP_return[:number_known][~is_known_gain])
+        sorted_gain_duration = np.sort(RP_duration[:number_known][is_known_gain])
+        sorted_loss_duration = np.sort(RP_duration[:number_known][~is_known_gain])
+        for nth in nth_last_RP_list:
+            current_return, current_duration, return_percentile, duration_percentile = state[nth]
+            is_current_gain = current_return[is_date] > 0
+            return_percentile[is_date] = np.where(
+                is_current_gain,
+                ut.percentile_of_scores(sorted_gain_return, current_return[is_date]),
+                100 - ut.percentile_of_scores(sorted_loss_return, current_return[is_date])) / 100
+            duration_percentile[is_date] = np.where(
+                is_current_gain,
+                ut.percentile_of_scores(sorted_gain_duration, current_duration[is_date]),
+                ut.percentile_of_scores(sorted_loss_duration, current_duration[is_date])) / 100
+
+    state_history = pd.DataFrame(index=dates)
+    for nth in nth_last_RP_list:
+        for name, values in zip(['return', 'duration', 'return_percentile', 'duration_percentile'], state[nth]):
+            state_history[f"{name}_{nth}"] = values
+    return state_history
+
+
+# Class: compact result of the trend identification.
+class TrendResult:
+    """
+    This class holds the result of the trend identification in a few NumPy arrays instead of the wide dataframes of
+    trend_identification_main: the price curve, the positions of the validated reflection points with their type as
+    packed int8 flags, and the return and duration of each trend. RP_vector and RP_summary are only built when they
+    are asked for (and then kept), with the columns that are used downstream.
+
+    The object is much smaller to keep in memory or to send between processes for a large universe; see nbytes.
+    """
+
+    __slots__ = ('index', 'price_name', 'price', 'RP_positions', 'RP_flags', 'RP_return', 'RP_duration',
+                 '_RP_vector', '_RP_summary')
+
+    # The bits of RP_flags.
+    IS_MIRP = 1
+    IS_MARP = 2
+    IS_VMIRP = 4
+    IS_VMARP = 8
+    IS_KEPT = 16  # not removed by the cleaning, i.e. in RP_summary
+
+    def __init__(self, index, price_name, price, RP_positions, RP_flags, RP_return, RP_duration):
+        """
+        :param index: the dates of the price curve.
+        :param price_name: the name of the price column.
+        :param price: the price curve as a float array.
+        :param RP_positions: the positions of the validated reflection points in the price curve.
+        :param RP_flags: per validated reflection point, its IS_* bits.
+        :param RP_return: the return of the trend ending at each kept reflection point.
+        :param RP_duration: the duration in days of the trend ending at each kept reflection point.
+        """
+        self.index = index
+        self.price_name = price_name
+        self.price = price
+        self.RP_positions = RP_positions
+        self.RP_flags = RP_flags
+        self.RP_return = RP_return
+        self.RP_duration = RP_duration
+        self._RP_vector = None
+        self._RP_summary = None
+
+    def __getstate__(self):
+        # The dataframes are not pickled; they are rebuilt when asked for.
+        return {name: getattr(self, name) for name in self.__slots__[:-2]}
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+        self._RP_vector = None
+        self._RP_summary = None
+
+    def has_flag(self, flag, is_kept_only=True):
+        """
+        :return: per validated (or, by default, kept) reflection point, whether the given IS_* bit is set.
+        """
+        flags = self.RP_flags[self.RP_flags & self.IS_KEPT > 0] if is_kept_only else self.RP_flags
+        return flags & flag > 0
+
+    @property
+    def nbytes(self):
+        """
+        The memory used by the arrays, in bytes; the dataframes built on request are not counted.
+        """
+        return self.index.nbytes + sum(getattr(self, name).nbytes for name in self.__slots__[2:-2])
+
+    @property
+    def RP_vector(self):
+        """
+        The full price curve with the reflection points and the trend indicator, as in trend_identification_main but
+        without the running extrema.
+        """
+        if self._RP_vector is None:
+            # the trend labels of the compact engine are calculated here; see trend_identification_compact
+            with prof.stage('assign_trend') as record:
+                is_vMIRP = self.has_flag(self.IS_VMIRP, is_kept_only=False)
+                is_MIRP = np.zeros(len(self.price), dtype=bool)
+                is_MARP = np.zeros(len(self.price), dtype=bool)
+                is_MIRP[self.RP_positions] = self.has_flag(self.IS_MIRP, is_kept_only=False)
+                is_MARP[self.RP_positions] = self.has_flag(self.IS_MARP, is_kept_only=False)
+                is_kept = self.has_flag(self.IS_KEPT, is_kept_only=False)
+                self._RP_vector = pd.DataFrame({self.price_name: self.price, 'is_MIRP': is_MIRP, 'is_MARP': is_MARP,
+                                                'is_upward_trend': trend_labels(self.RP_positions[is_kept],
+                                                                                is_vMIRP[is_kept],
+                                                                                np.arange(len(self.price)))},
+                                               index=self.index)
+                record['rows'] = len(self._RP_vector)
+        return self._RP_vector
+
+    @property
+    def RP_summary(self):
+        """
+        The list of (only) the reflection points that remain after the cleaning, with returns and durations.
+        """
+        if self._RP_summary is None:
+            is_vMARP = self.has_flag(self.IS_VMARP)
+            RP_positions = self.RP_positions[self.has_flag(self.IS_KEPT, is_kept_only=False)]
+            self._RP_summary = pd.DataFrame({self.price_name: self.price[RP_positions],
+                                             'is_MIRP': self.has_flag(self.IS_MIRP),
+                                             'is_MARP': self.has_flag(self.IS_MARP),
+                                             'is_vMIRP': self.has_flag(self.IS_VMIRP), 'is_vMARP': is_vMARP,
+                                             'return': self.RP_return, 'return_type': np.where(is_vMARP, 'gain', 'loss'),
+                                             'duration': self.RP_duration},
+                                            index=self.index[RP_positions])
+        return self._RP_summary
+
+
+def trend_identification_compact(price_raw, is_month_average=False, window_in_days=63, extrema_index=None):
+    """
+    This function performs the same trend identification as trend_identification_main, on arrays only, and returns a
+    TrendResult instead of the two dataframes.
+    :param price_raw: the entire historical price curve.
+    :param is_month_average: whether the trend identification is performed on an MA curve; boolean variable.
+    :param window_in_days:
+    :param extrema_index: optional RangeExtremaIndex, built on the price the RPs are searched on.
+    :return: the TrendResult.
+    """
+
+    if is_month_average:
+        with prof.stage('calculate_monthly_average') as record:
+            price = ds.calculate_monthly_average(pd.DataFrame(price_raw))
+            record['rows'] = len(price)
+        window = window_in_days // 21
+    else:
+        price = pd.DataFrame(price_raw)
+        window = window_in_days
+    values = price.iloc[:, 0].to_numpy(dtype=float)
+
+    # The stages have the names of those of trend_identification_main; the trend labels are only calculated when the
+    # RP_vector of the TrendResult is built (stage assign_trend).
+    with prof.stage('find_RP', window_in_days=window) as record:
+        if extrema_index is None:
+            rolling = pd.Series(values).rolling(window=window * 2, min_periods=window, center=True)
+            running_min, running_max = rolling.min().to_numpy(), rolling.max().to_numpy()
+        else:
+            assert extrema_index.size == len(values), "The extrema index is not built on the given price!"
+            running_min, running_max = extrema_index.running_extrema(window)
+        is_MIRP = running_min == values
+        is_MARP = running_max == values
+        RP_positions = np.flatnonzero(is_MIRP | is_MARP)
+        is_MIRP, is_MARP = is_MIRP[RP_positions], is_MARP[RP_positions]
+        is_vMIRP, is_vMARP = validate_RP_flags(values[RP_positions], is_MIRP, is_MARP)
+        record['rows'] = len(values)
+
+    with prof.stage('clean_RP_summary', window_in_days=window) as record:
+        is_vRP = is_vMIRP | is_vMARP
+        RP_positions = RP_positions[is_vRP]
+        RP_flags = (is_MIRP[is_vRP] * TrendResult.IS_MIRP + is_MARP[is_vRP] * TrendResult.IS_MARP +
+                    is_vMIRP[is_vRP] * TrendResult.IS_VMIRP + is_vMARP[is_vRP] * TrendResult.IS_VMARP).astype(np.int8)
+        kept, is_kept_vMARP, RP_return, RP_duration = clean_RP_arrays(price.index.to_numpy()[RP_positions],
+                                                                      values[RP_positions], is_vMIRP[is_vRP],
+                                                                      is_vMARP[is_vRP])
+        # a kept RP has one type only, see sweep_irregular_RP
+        RP_flags[kept] = (RP_flags[kept] & ~(TrendResult.IS_VMIRP | TrendResult.IS_VMARP) | TrendResult.IS_KEPT |
+                          np.where(is_kept_vMARP, TrendResult.IS_VMARP, TrendResult.IS_VMIRP))
+        record['rows'] = len(kept)
+    return TrendResult(price.index, price.columns[0], values, RP_positions, RP_flags, RP_return, RP_duration)
+
+
+def trend_identification_main(price_raw, is_month_average=False, window_in_days=63, extrema_index=None):
+
+    """
+    This function mainly summarizes all the steps to perform the trend identification; see the concrete functions below.
+    :param price_raw: the entire historical price curve. It is deliberately designed to be detached from the data collection steps.
+    :param is_month_average: whether the trend identification is performed on an MA curve; boolean variable.
+    :param window_in_days:
+    :param extrema_index: optional RangeExtremaIndex, built on the price the RPs are searched on (i.e. after the monthly
+    averaging, if any).
+    :return: the RP_vector and RP_summary, containing the information of identified trend info.
+    """
+
+    if is_month_average:
+        with prof.stage('calculate_monthly_average') as record:
+            price = ds.calculate_monthly_average(pd.DataFrame(price_raw))
+            record['rows'] = len(price)
+        window = window_in_days // 21
+    else:
+        price = pd.DataFrame(price_raw)
+        window = window_in_days
+
+    # The stages are recorded when profiling is enabled; see the profiling module.
+    with prof.stage('find_RP', window_in_days=window) as record:
+        RP_vector, RP_summary = find_RP(price, window, extrema_index)
+        record['rows'] = len(RP_vector)
+    with prof.stage('clean_RP_summary', window_in_days=window) as record:
+        RP_summary = clean_RP_summary(RP_summary)
+        record['rows'] = len(RP_summary)
+    with prof.stage('assign_trend', window_in_days=window) as record:
+        RP_vector, RP_summary = assign_trend(RP_vector, RP_summary)
+        record['rows'] = len(RP_vector)
+    return RP_vector, RP_summary
+
+
+def trend_identification_cross_section(price_matrix, window_in_days=63):
+    """
+    This function performs the trend identification for many instruments at once, on a matrix of prices with the dates
+    as index and one column per instrument. The result per instrument is the same as trend_identification_main on its
+    column without the NaN values, but every step runs over all the columns in one vectorized pass: the valid prices
+    of each column are packed to the top of the matrix, rolled column-wise, and the reflection points of all the
+    instruments are validated and cleaned as one array, in which a run never continues over two instruments.
+
+    :param price_matrix: dataframe of prices, dates x instruments, with NaN values where an instrument has no price.
+    :param window_in_days: the 2-sided horizon length.
+    :return RP_table: the long-format table of the reflection points of all the instruments, indexed by (code, date),
+    with the columns of RP_summary (price, is_MIRP, is_MARP, is_vMIRP, is_vMARP, return, return_type, duration).
+    :return is_upward_trend: the trend indicator, dates x instruments; False where the price is NaN.
+    """
+    values = price_matrix.to_numpy(dtype=float)
+    number_rows, number_columns = values.shape
+    # The stages have the names of those of trend_identification_main, for all the instruments together.
+    with prof.stage('find_RP', window_in_days=window_in_days) as record:
+        # The stable sort moves the valid prices of each column to the top, in their order.
+        row_order = np.argsort(np.isnan(values), axis=0, kind='stable')
+        packed = np.take_along_axis(values, row_order, axis=0)
+        rolling = pd.DataFrame(packed).rolling(window=window_in_days * 2, min_periods=window_in_days, center=True)
+        is_MIRP = rolling.min().to_numpy() == packed
+        is_MARP = rolling.max().to_numpy() == packed
+
+        # The reflection points of all the instruments, sorted by instrument and date (i.e. packed row).
+        RP_columns, RP_rows = np.nonzero((is_MIRP | is_MARP).T)
+        RP_price = packed[RP_rows, RP_columns]
+        is_vMIRP, is_vMARP = validate_RP_flags(RP_price, is_MIRP[RP_rows, RP_columns], is_MARP[RP_rows, RP_columns],
+                                               RP_columns)
+        record['rows'] = values.size
+    with prof.stage('clean_RP_summary', window_in_days=window_in_days) as record:
+        is_vRP = is_vMIRP | is_vMARP
+        RP_rows, RP_columns, RP_price = RP_rows[is_vRP], RP_columns[is_vRP], RP_price[is_vRP]
+        is_vMIRP, is_vMARP = is_vMIRP[is_vRP], is_vMARP[is_vRP]
+        RP_dates = price_matrix.index.to_numpy()[row_order[RP_rows, RP_columns]]
+        kept, is_vMARP, RP_return, RP_duration = clean_RP_arrays(RP_dates, RP_price, is_vMIRP, is_vMARP, RP_columns)
+        RP_rows, RP_columns, RP_price, RP_dates = RP_rows[kept], RP_columns[kept], RP_price[kept], RP_dates[kept]
+        is_vMIRP = ~is_vMARP
+        record['rows'] = len(kept)
+
+    with prof.stage('assign_trend', window_in_days=window_in_days) as record:
+        # Trend labels, as in trend_labels: the number (1-based) of the last RP at or before each bar is carried down
+        # each column; the last RP of a column closes the trend of the RP before it and nothing after it is in a trend.
+        RP_marker = np.zeros(packed.shape, dtype=np.int64)
+        RP_marker[RP_rows, RP_columns] = np.arange(1, len(RP_rows) + 1)
+        RP_number = np.maximum.accumulate(RP_marker, axis=0)
+        is_new_column = RP_columns[1:] != RP_columns[:-1]
+        is_last_RP = np.r_[False, is_new_column, True]
+        is_same_column_as_previous = np.r_[False, False, ~is_new_column]
+        is_vMIRP_by_number = np.r_[False, is_vMIRP]
+        is_on_last_RP = is_last_RP[RP_number] & (RP_marker == RP_number) & (RP_number > 0)
+        is_vMIRP_before = is_vMIRP_by_number[np.maximum(RP_number - 1, 0)]
+        packed_label = np.where(is_on_last_RP, is_same_column_as_previous[RP_number] & is_vMIRP_before,
+                                ~is_last_RP[RP_number] & is_vMIRP_by_number[RP_number])
+        is_upward_trend = np.zeros(values.shape, dtype=bool)
+        np.put_along_axis(is_upward_trend, row_order, packed_label, axis=0)
+        is_upward_trend &= ~np.isnan(values)
+        record['rows'] = values.size
+
+    is_MIRP, is_MARP = is_MIRP[RP_rows, RP_columns], is_MARP[RP_rows, RP_columns]
+    RP_table = pd.DataFrame({'code': price_matrix.columns.to_numpy()[RP_columns], 'date': RP_dates, 'price': RP_price,
+                             'is_MIRP': is_MIRP, 'is_MARP': is_MARP, 'is_vMIRP': is_vMIRP, 'is_vMARP': is_vMARP,
+                             'return': RP_return, 'return_type': np.where(is_vMARP, 'gain', 'loss'),
+                             'duration': RP_duration}).set_index(['code', 'date'])
+    return RP_table, pd.DataFrame(is_upward_trend, index=price_matrix.index, columns=price_matrix.columns)
+
+
+# Class: memoization of trend_identification_main.
+class TrendResultCache:
+    """
+    This class memoizes trend_identification_main by the content of the price curve: the key is a hash of the price
+    values, the dates and the column name, together with is_month_average and window_in_days. The results are kept in
+    a bounded in-memory LRU tier and, if a cache folder is given, also on disk (one pickle per key), such that a repeat
+    analysis of the same curve returns at once, also in another session.
+
+    Copies of the dataframes are returned, so that the callers can extend them without changing the cached results.
+    The stats attribute counts the memory hits, the disk hits and the misses. The cache can be shared by threads: the
+    in-memory tier is guarded by a lock, a key is computed only once at a time (other requests of it wait for the
+    result, while other keys are computed concurrently) and the files are replaced atomically.
+    """
+
+    def __init__(self, max_size=64, cache_folder=None):
+        """
+        :param max_size: the maximum number of results in memory.
+        :param cache_folder: optional folder of the on-disk tier.
+        """
+        self.memory = ut.LRUCache(max_size)
+        self.lock = threading.Lock()
+        self.key_locks = {}
+        self.cache_folder = cache_folder
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0}
+        if cache_folder is not None:
+            os.makedirs(cache_folder, exist_ok=True)
+
+    @staticmethod
+    def key(price_raw, is_month_average, window_in_days):
+        """
+        :return: the hexadecimal blake2b hash of the price curve and the parameters.
+        """
+        price = price_raw.iloc[:, 0] if isinstance(price_raw, pd.DataFrame) else price_raw
+        hasher = hashlib.blake2b(digest_size=16)
+        hasher.update(np.ascontiguousarray(price.to_numpy(dtype=float)).view(np.uint8))
+        hasher.update(np.ascontiguousarray(pd.DatetimeIndex(price.index).asi8).view(np.uint8))
+        hasher.update(repr((str(price.name), bool(is_month_average), int(window_in_days))).encode())
+        return hasher.hexdigest()
+
+    def get(self, price_raw, is_month_average=False, window_in_days=63, extrema_index=None):
+        """
+        This function returns the result of trend_identification_main, computing it only on a miss of both tiers.
+
+        :param extrema_index: optional RangeExtremaIndex, only used on a miss; see trend_identification_main.
+        :return: copies of RP_vector and RP_summary.
+        """
+        key = self.key(price_raw, is_month_average, window_in_days)
+        with self.lock:
+            result = self.memory.get(key)
+            if result is not None:
+                self.stats['memory_hits'] += 1
+            else:
+                # Concurrent requests of the same key wait for the first one instead of computing it again. The lock of
+                # a key is counted by its requests and dropped by the last one, so key_locks only holds the keys in use.
+                key_lock = self.key_locks.setdefault(key, [threading.Lock(), 0])
+                key_lock[1] += 1
+        if result is None:
+            try:
+                with key_lock[0]:
+                    with self.lock:
+                        result = self.memory.get(key)
+                        if result is not None:
+                            self.stats['memory_hits'] += 1
+                    if result is None:
+                        result, stat = self.load_or_compute(key, price_raw, is_month_average, window_in_days,
+                                                            extrema_index)
+                        with self.lock:
+                            self.stats[stat] += 1
+                            self.memory.put(key, result)
+            finally:
+                with self.lock:
+                    key_lock[1] -= 1
+                    if key_lock[1] == 0:
+                        del self.key_locks[key]
+        return result[0].copy(), result[1].copy()
+
+    def load_or_compute(self, key, price_raw, is_month_average, window_in_days, extrema_index):
+        """
+        :return: the result of the key from the disk tier, or else computed (and written to disk), with the name of
+        the stat it counts for.
+        """
+        file_path = None if self.cache_folder is None else os.path.join(self.cache_folder, f"{key}.pkl")
+        if file_path is not None and os.path.exists(file_path):
+            return pd.read_pickle(file_path), 'disk_hits'
+        result = trend_identification_main(price_raw, is_month_average, window_in_days, extrema_index)
+        if file_path is not None:
+            # a reader in another process never sees a partly written file
+            temporary_path = f"{file_path}.{os.getpid()}.tmp"
+            pd.to_pickle(result, temporary_path)
+            os.replace(temporary_path, file_path)
+        return result, 'misses'
+
+    def clear(self):
+        """
+        This function empties the in-memory tier; the files on disk are kept.
+        """
+        with self.lock:
+            self.memory.clear()
+
+
+# The cache shared by the callers of trend_identification_cached that do not pass their own.
+default_result_cache = TrendResultCache()
+
+
+def trend_identification_cached(price_raw, is_month_average=False, window_in_days=63, extrema_index=None, cache=None):
+    """
+    This function is trend_identification_main memoized by the content of the price curve; see TrendResultCache.
+    :param cache: the TrendResultCache to use; by default the in-memory cache shared within the session.
+    :return: the RP_vector and RP_summary, as copies.
+    """
+    cache = default_result_cache if cache is None else cache
+    return cache.get(price_raw, is_month_average, window_in_days, extrema_index)
+
+
+def trend_identification_sweep(price_raw, is_month_average=False, window_in_days_list=(21, 63, 126, 252),
+                               is_compact=False):
+    """
+    This function performs the trend identification for a list of windows on the same price curve. The range-extremum
+    index is built only once, so that the whole sweep costs little more than a single window.
+    :param price_raw: the entire historical price curve.
+    :param is_month_average: whether the trend identification is performed on an MA curve; boolean variable.
+    :param window_in_days_list: the windows of interest.
+    :param is_compact: whether a TrendResult is returned per window instead of the two dataframes.
+    :return: a dictionary with, per window, the tuple (RP_vector, RP_summary) or the TrendResult.
+    """
+
+    if is_month_average:
+        price = ds.calculate_monthly_average(pd.DataFrame(price_raw))
+    else:
+        price = pd.DataFrame(price_raw)
+    extrema_index = RangeExtremaIndex(price)
+
+    results = {}
+    for window_in_days in dict.fromkeys(window_in_days_list):  # every window once, in order
+        window = window_in_days // 21 if is_month_average else window_in_days
+        if is_compact:
+            results[window_in_days] = trend_identification_compact(price, False, window, extrema_index)
+        else:
+            results[window_in_days] = trend_identification_main(price, False, window, extrema_index)
+    return results
+
+
+# Class: streaming trend identification on a growing price curve.
+class TrendIdentifier:
+    """
+    This class keeps the state of the trend identification of one price curve, such that newly arrived bars can be
+    appended without rerunning trend_identification_main from the first bar. The work of an append is proportional to
+    the new bars and to the part of the curve that is not settled yet, not to the length of the curve:
+        - only the last bars, whose centered window reaches the new bars, can change their reflection-point status;
+          their running extrema are rolled again over the tail only;
+        - the validation of an RP only depends on its run of consecutive MIRPs (MARPs), so the RPs are validated again
+          from the start of the run that reaches the changed bars;
+        - the sweep of the irregular RPs (see sweep_irregular_RP) logs its stack operations, which are undone back to
+          the first revalidated RP and then replayed on the new RPs only;
+        - the trend labels are rewritten from the last RP of the stack that is unchanged.
+    The per-bar arrays grow with an amortized doubling of their capacity, and the dataframes are only built when they
+    are asked for. The resulting RP_vector and RP_summary are identical to a full recompute on the extended price curve.
+
+    The state is seeded from the output of trend_identification_main without monthly averaging, i.e. the price curve
+    of RP_vector is the curve on which the RPs are searched.
+    """
+
+    # The stack operations of the sweep, as logged per validated RP.
+    PUSH, REPLACE, POP, DROP = range(4)
+
+    def __init__(self, RP_vector, RP_summary, window_in_days):
+        """
+        :param RP_vector: the RP_vector returned by trend_identification_main.
+        :param RP_summary: the RP_summary returned by trend_identification_main.
+        :param window_in_days: the window that was used to find RP_vector and RP_summary.
+        """
+        assert {'running_min', 'running_max', 'is_upward_trend'}.issubset(RP_vector.columns), \
+            "RP_vector should be the output of trend_identification_main!"
+        self.window_in_days = window_in_days
+        self.price_name = RP_vector.columns[0]
+        self.index_name = RP_vector.index.name
+        self.size = len(RP_vector)
+        self.capacity = max(self.size, 16)
+        self.dates = np.empty(self.capacity, dtype='datetime64[ns]')
+        self.price = np.empty(self.capacity)
+        self.running_min = np.empty(self.capacity)
+        self.running_max = np.empty(self.capacity)
+        self.is_false_alarm = np.zeros(self.capacity, dtype=bool)
+        self.is_upward_trend = np.zeros(self.capacity, dtype=bool)
+        self.dates[:self.size] = pd.DatetimeIndex(RP_vector.index).to_numpy(dtype='datetime64[ns]')
+        self.price[:self.size] = RP_vector.iloc[:, 0].to_numpy(dtype=float)
+        self.running_min[:self.size] = RP_vector['running_min'].to_numpy(dtype=float)
+        self.running_max[:self.size] = RP_vector['running_max'].to_numpy(dtype=float)
+        self.is_upward_trend[:self.size] = RP_vector['is_upward_trend'].to_numpy(dtype=bool)
+
+        # The raw RPs, the validated RPs (in the order of the sweep) and the stack of the sweep, as Python lists, which
+        # are cheap to truncate and to extend at the end.
+        self.raw_positions, self.raw_is_MIRP, self.raw_is_MARP = [], [], []
+        self.valid_raw_numbers, self.valid_positions, self.valid_price, self.valid_is_dual = [], [], [], []
+        self.valid_is_vMARP = []  # the type of each validated RP as resolved by the sweep
+        self.sweep_log = []  # per validated RP, the stack operation and the stack entry it removed, if any
+        self.stack = []  # the validated RPs (numbers) that are kept so far
+        self.update_RP(0)
+        self._RP_summary = RP_summary
+
+    def reserve(self, size):
+        # Grow the per-bar arrays to at least the given size, doubling the capacity to keep the appends amortized O(1).
+        if size <= self.capacity:
+            return
+        self.capacity = max(size, 2 * self.capacity)
+        for name in ('dates', 'price', 'running_min', 'running_max', 'is_false_alarm', 'is_upward_trend'):
+            old = getattr(self, name)
+            new = np.zeros(self.capacity, dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    @property
+    def index(self):
+        return pd.DatetimeIndex(self.dates[:self.size], name=self.index_name)
+
+    @property
+    def RP_vector(self):
+        """
+        The full price curve with the trend information, in the layout of trend_identification_main.
+        """
+        price = self.price[:self.size]
+        is_MIRP_raw = self.running_min[:self.size] == price
+        is_MARP_raw = self.running_max[:self.size] == price
+        is_false_alarm = self.is_false_alarm[:self.size]
+        RP_vector = pd.DataFrame({self.price_name: price.copy()}, index=self.index)
+        RP_vector['running_min'] = self.running_min[:self.size].copy()
+        RP_vector['running_max'] = self.running_max[:self.size].copy()
+        RP_vector['is_MIRP'] = is_MIRP_raw & ~is_false_alarm
+        RP_vector['is_MARP'] = is_MARP_raw & ~is_false_alarm
+        RP_vector['is_RP'] = is_MIRP_raw | is_MARP_raw
+        RP_vector['is_upward_trend'] = self.is_upward_trend[:self.size].copy()
+        return RP_vector
+
+    @property
+    def RP_summary(self):
+        """
+        The list of (only) the cleaned reflection points, with returns and durations, as in trend_identification_main.
+        """
+        if self._RP_summary is None:
+            positions = np.asarray([self.valid_positions[number] for number in self.stack], dtype=np.int64)
+            is_vMARP = np.asarray([self.valid_is_vMARP[number] for number in self.stack], dtype=bool)
+            price = self.price[positions]
+            dates = self.dates[positions]
+            RP_summary = pd.DataFrame({self.price_name: price}, index=pd.DatetimeIndex(dates, name=self.index_name))
+            RP_summary['running_min'] = self.running_min[positions]
+            RP_summary['running_max'] = self.running_max[positions]
+            RP_summary['is_MIRP'] = RP_summary['running_min'] == price
+            RP_summary['is_MARP'] = RP_summary['running_max'] == price
+            RP_summary['is_RP'] = True
+            RP_summary['is_vMIRP'] = ~is_vMARP
+            RP_summary['is_vMARP'] = is_vMARP
+            RP_summary['is_vRP'] = True
+            # The first kept RP starts the first trend; it has no return and is dropped, as in clean_RP_arrays.
+            RP_summary = RP_summary.iloc[1:]
+            RP_summary['return'] = price[1:] / price[:-1] - 1
+            RP_summary['return_type'] = np.where(is_vMARP[1:], 'gain', 'loss')
+            RP_summary['duration'] = np.diff(dates) / np.timedelta64(1, 'D')
+            self._RP_summary = RP_summary
+        return self._RP_summary
+
+    def is_linked(self, number):
+        # Whether the raw RP of the given number is in the same run of MIRPs (MARPs) as the one before it.
+        return (self.raw_is_MIRP[number] and self.raw_is_MIRP[number - 1]) or (
+                self.raw_is_MARP[number] and self.raw_is_MARP[number - 1])
+
+    def update_RP(self, first_changed_bar):
+        """
+        This function finds, validates and sweeps the RPs again from the given bar on, whose running extrema have been
+        updated, and rewrites the trend labels from the last unchanged RP of the stack.
+        """
+        # The raw RPs before the changed bar keep their status; the others are found again.
+        number_kept_raw = bisect_left(self.raw_positions, first_changed_bar)
+        del self.raw_positions[number_kept_raw:], self.raw_is_MIRP[number_kept_raw:], self.raw_is_MARP[number_kept_raw:]
+        price = self.price[first_changed_bar:self.size]
+        is_MIRP = self.running_min[first_changed_bar:self.size] == price
+        is_MARP = self.running_max[first_changed_bar:self.size] == price
+        new_positions = np.flatnonzero(is_MIRP | is_MARP)
+        self.raw_positions.extend((new_positions + first_changed_bar).tolist())
+        self.raw_is_MIRP.extend(is_MIRP[new_positions].tolist())
+        self.raw_is_MARP.extend(is_MARP[new_positions].tolist())
+        self.is_false_alarm[first_changed_bar:self.size] = False
+
+        # The run that reaches the changed RPs is validated again, from its first RP on.
+        first_raw = max(number_kept_raw - 1, 0)
+        while first_raw > 0 and self.is_linked(first_raw):
+            first_raw -= 1
+        raw_positions = np.asarray(self.raw_positions[first_raw:], dtype=np.int64)
+        is_vMIRP, is_vMARP = validate_RP_flags(self.price[raw_positions],
+                                               np.asarray(self.raw_is_MIRP[first_raw:], dtype=bool),
+                                               np.asarray(self.raw_is_MARP[first_raw:], dtype=bool))
+        is_vRP = is_vMIRP | is_vMARP
+        self.is_false_alarm[raw_positions] = ~is_vRP
+
+        # Undo the sweep back to the first revalidated RP, then sweep the revalidated RPs again.
+        first_valid = bisect_left(self.valid_raw_numbers, first_raw)
+        first_changed_entry = len(self.stack)
+        for number in range(len(self.valid_positions) - 1, first_valid - 1, -1):
+            operation, removed = self.sweep_log[number]
+            if operation == self.PUSH:
+                self.stack.pop()
+                first_changed_entry = min(first_changed_entry, len(self.stack))
+            elif operation == self.REPLACE:
+                self.stack[-1] = removed
+                first_changed_entry = min(first_changed_entry, len(self.stack) - 1)
+            elif operation == self.POP:
+                self.stack.append(removed)
+                first_changed_entry = min(first_changed_entry, len(self.stack) - 1)
+        for values in (self.valid_raw_numbers, self.valid_positions, self.valid_price, self.valid_is_dual,
+                       self.valid_is_vMARP, self.sweep_log):
+            del values[first_valid:]
+        valid_numbers = np.flatnonzero(is_vRP)
+        self.valid_raw_numbers.extend((valid_numbers + first_raw).tolist())
+        self.valid_positions.extend(raw_positions[valid_numbers].tolist())
+        self.valid_price.extend(self.price[raw_positions[valid_numbers]].tolist())
+        self.valid_is_dual.extend((is_vMIRP & is_vMARP)[valid_numbers].tolist())
+        self.valid_is_vMARP.extend((is_vMARP & ~is_vMIRP)[valid_numbers].tolist())
+        for number in range(first_valid, len(self.valid_positions)):
+            first_changed_entry = min(first_changed_entry, self.sweep(number))
+
+        # The labels change from the bar of the last unchanged stack entry on; see trend_labels, in which the last RP
+        # belongs to the trend of the RP before it. The stack without its first entry is the RP_summary.
+        last_unchanged_entry = first_changed_entry - 1
+        first_bar = self.valid_positions[self.stack[last_unchanged_entry]] if last_unchanged_entry >= 1 else 0
+        stack_tail = self.stack[max(last_unchanged_entry - 1, 1):]
+        self.is_upward_trend[first_bar:self.size] = trend_labels(
+            [self.valid_positions[number] for number in stack_tail],
+            [not self.valid_is_vMARP[number] for number in stack_tail], np.arange(first_bar, self.size))
+        self._RP_summary = None
+
+    def sweep(self, number):
+        """
+        This function runs one step of sweep_irregular_RP on the validated RP of the given number and logs it.
+
+        :return: the first stack entry that the step changed; the stack length if none.
+        """
+        stack = self.stack
+        if not stack:
+            # an RP of both types is a vMIRP here, as valid_is_vMARP is only set for the RPs that are no vMIRP
+            stack.append(number)
+            self.sweep_log.append((self.PUSH, None))
+            return 0
+        top = stack[-1]
+        if self.valid_is_dual[number]:
+            self.valid_is_vMARP[number] = not self.valid_is_vMARP[top]
+        is_vMARP = self.valid_is_vMARP[number]
+        price, top_price = self.valid_price[number], self.valid_price[top]
+        if is_vMARP == self.valid_is_vMARP[top]:
+            if (price > top_price) if is_vMARP else (price < top_price):
+                stack[-1] = number
+                self.sweep_log.append((self.REPLACE, top))
+                return len(stack) - 1
+            self.sweep_log.append((self.DROP, None))
+            return len(stack)
+        if (price < top_price) if is_vMARP else (price > top_price):
+            stack.pop()
+            self.sweep_log.append((self.POP, top))
+            return len(stack)
+        stack.append(number)
+        self.sweep_log.append((self.PUSH, None))
+        return len(stack) - 1
+
+    def append(self, bars):
+        """
+        This function appends new bars to the price curve and updates the reflection points, the RP_summary with the
+        returns and the trend labels.
+
+        :param bars: the new bars; a dataframe with the price in its first column or a series, with datetime index. All
+        dates should be later than the last date already in the curve.
+        """
+        bars = pd.DataFrame(bars)
+        if len(bars) == 0:
+            return
+        dates = pd.DatetimeIndex(bars.index).to_numpy(dtype='datetime64[ns]')
+        assert self.size == 0 or dates[0] > self.dates[self.size - 1], "New bars should be after the last known bar!"
+        number_old_bars = self.size
+        window = self.window_in_days
+        self.reserve(self.size + len(bars))
+        self.size += len(bars)
+        self.dates[number_old_bars:self.size] = dates
+        self.price[number_old_bars:self.size] = bars.iloc[:, 0].to_numpy(dtype=float)
+        self.is_upward_trend[number_old_bars:self.size] = False
+
+        # The window of bar t is [t - window, t + window - 1], so only the last bars before the new ones change. The
+        # tail is rolled with enough history in front of it to give exactly the same extrema as the full curve.
+        first_changed_bar = max(number_old_bars - window, 0)
+        tail_start = max(first_changed_bar - window, 0)
+        tail = pd.Series(self.price[tail_start:self.size]).rolling(window=window * 2, min_periods=window, center=True)
+        self.running_min[first_changed_bar:self.size] = tail.min().to_numpy()[first_changed_bar - tail_start:]
+        self.running_max[first_changed_bar:self.size] = tail.max().to_numpy()[first_changed_bar - tail_start:]
+        self.update_RP(first_changed_bar)
@@ -1,221 +1,113 @@
 # This module contains the functions for the trend identification, including a.o. the following:
 #   - finding all the reflection points and then the validated ones (vMARP & vMIRP).
 #   - divide the price curve into upward and downward trends
-
-import pandas as pd
-import numpy as np
-import scipy.stats as stats
-import matplotlib
-import matplotlib.pyplot as plt
-from matplotlib.dates import DateFormatter, AutoDateLocator
+# The computations are in trend_core and are re-exported here; this module adds the plots. matplotlib is only imported
+# by the plotting functions, on first use.
 
 import utils as ut
-import data_sourcer as ds
-
-# Specifically to suppress the warning "A value is trying to be set on a copy of a slice from a DataFrame."
-pd.options.mode.chained_assignment = None  # 'warn', 'raise', None
-
-# Function: find all the validated reflection points.
-def find_RP(price, window_in_days):
-    """
-    This function tries to identify all the minimum reflection points (MIRP) in a given price curve.
-    Given a horizon tau, at any time t, one can look for the local min as the minimum within the time interval
-    [t-tau, t+tau]:
-
-    .. math::
-
-        MIRP_{t, \tau} = min_s\{S_s | s\in[t-\tau, t+\tau]\}
-
-    If s happens to be equal to t, then :math:`S_t` is called a minimum reflection point (MIRP).
-
-    :param price: the price of interest to find the MIRPs. It should be a dataframe and contain only one column: the
-    price (numeric). Index should be datetime.
-    :param window_in_days: the 2-sided horizon length
-    :return RP_vector: the location (i.e. date) of the validated reflection points, together with the full price vector.
-    :return RP_summary: the list of (only) the validated reflection points.
-    """
-
-    RP_vector = pd.DataFrame(data=price.iloc[:, 0], index=price.index)
-    RP_vector.loc[:, "running_min"] = RP_vector.iloc[:, 0].rolling(window=window_in_days * 2, min_periods=window_in_days,
-                                                            center=True).min()
-    RP_vector.loc[:, "running_max"] = RP_vector.iloc[:, 0].rolling(window=window_in_days * 2, min_periods=window_in_days,
-                                                            center=True).max()
-    RP_vector.loc[:, 'is_MIRP'] = (RP_vector.loc[:, 'running_min'] == RP_vector.iloc[:, 0])
-    RP_vector.loc[:, 'is_MARP'] = (RP_vector.loc[:, 'running_max'] == RP_vector.iloc[:, 0])
-    RP_vector.loc[:, 'is_RP'] = RP_vector.is_MIRP | RP_vector.is_MARP
-
-    # RP_summary contains ONLY the reflection points, while RP_vector contains the entire price curve.
-    RP_summary = RP_vector[RP_vector['is_RP']]
-
-    # find validated reflection points. See the methodology documentation for more information.
-
-    RP_summary.loc[:, 'is_MIRP_previous'] = RP_summary.loc[:, 'is_MIRP'].shift(1)
-    RP_summary.loc[:, 'is_MARP_previous'] = RP_summary.loc[:, 'is_MARP'].shift(1)
-    RP_summary.loc[:, 'is_MIRP_next'] = RP_summary.loc[:, 'is_MIRP'].shift(-1)
-    RP_summary.loc[:, 'is_MARP_next'] = RP_summary.loc[:, 'is_MARP'].shift(-1)
-    RP_summary.loc[:, 'is_duplicate_minimum'] = (RP_summary.loc[:, 'is_MIRP'] & RP_summary.loc[:, 'is_MIRP_previous']) | (
-                RP_summary.loc[:, 'is_MIRP'] & RP_summary.loc[:, 'is_MIRP_next'])
-    RP_summary.loc[:, 'is_duplicate_maximum'] = (RP_summary.loc[:, 'is_MARP'] & RP_summary.loc[:, 'is_MARP_previous']) | (
-                RP_summary.loc[:, 'is_MARP'] & RP_summary.loc[:, 'is_MARP_next'])
-    RP_summary.loc[:, 'is_duplicate'] = (RP_summary.loc[:, 'is_duplicate_minimum']) | (RP_summary.loc[:, 'is_duplicate_maximum'])
-
-    RP_summary.loc[:, 'group'] = ((RP_summary.loc[:, 'is_duplicate_minimum'] != RP_summary.loc[:, 'is_duplicate_minimum'].shift()) | (
-                RP_summary.loc[:, 'is_duplicate_maximum'] != RP_summary.loc[:, 'is_duplicate_maximum'].shift())).cumsum()
-    RP_summary.loc[:, 'is_vMIRP'] = RP_summary.loc[:, 'is_MIRP']
-    RP_summary['is_vMIRP'].astype(bool)
-    RP_summary.loc[:, 'is_vMARP'] = RP_summary.loc[:, 'is_MARP']
-    RP_summary['is_vMARP'].astype(bool)
-    groups = RP_summary.groupby('group')
-
-    for group_id, group_df in groups:
-        if group_df.iloc[0, group_df.columns.get_loc('is_duplicate')]:
-            if group_df.iloc[0, group_df.columns.get_loc('is_MIRP')]:
-                index_of_min_value = group_df.iloc[:, 0].idxmin()
-                A = (pd.DataFrame(group_df.index == index_of_min_value)).to_numpy()
-                RP_summary.loc[group_df.index, 'is_vMIRP'] = A
-
-            if group_df.iloc[0, group_df.columns.get_loc('is_MARP')]:
-                index_of_max_value = group_df.iloc[:, 0].idxmax()
-                B = (pd.DataFrame(group_df.index == index_of_max_value)).to_numpy()
-                RP_summary.loc[group_df.index, 'is_vMARP'] = B
-
-    RP_summary.loc[:, 'is_vRP'] = RP_summary.is_vMIRP | RP_summary.is_vMARP
-    false_alarm = RP_summary[RP_summary.loc[:, 'is_vRP'] == False]
-    RP_vector.loc[false_alarm.index, ['is_MARP', 'is_MIRP']] = False
-    RP_summary = RP_summary[RP_summary.loc[:, 'is_vRP'] == True]
-
-    return RP_vector, RP_summary
-
-
-# Function: calculate the duration and return for each identified trend
-def calculate_trend_return(RP_summary):
-    """
-    This function calculates the return and duration per upward / downward trend.
-
-    :param RP_summary: the list of (only) the validated reflection points.
-    :return RP_summary_extended: the RP_summary extended with returns and duration.
-    """
-
-    RP_summary['return'] = RP_summary.iloc[:, 0].pct_change()
-    RP_summary.loc[RP_summary['is_MIRP'], 'return_type'] = 'loss'
-    RP_summary.loc[RP_summary['is_MARP'], 'return_type'] = 'gain'
-    RP_summary['duration'] = pd.to_datetime(RP_summary.index).to_series().diff().dt.days
-    RP_summary.dropna(subset=['return'], inplace=True)  # remove potential rows containing nan
-    return RP_summary
-
-
-def drop_irregular_RP(RP_summary):
-    RP_summary['is_irregular'] = ((RP_summary['is_vMIRP']) & (RP_summary['return'] > 0)) | (
-                (RP_summary['is_vMARP']) & (RP_summary['return'] < 0))
-    RP_summary['is_irregular'] = RP_summary['is_irregular'] | RP_summary['is_irregular'].shift(-1)
-    RP_summary = RP_summary.loc[~RP_summary['is_irregular']]
-    return RP_summary
-
-
-def assign_trend(RP_vector, RP_summary):
-    # Now identify the trend by assigning value 1 for upward trend and 0 for downward.
-    RP_vector['is_upward_trend'] = False
-    for start_date, end_date in zip(RP_summary.index, RP_summary.index[1:]):
-        RP_vector.loc[start_date:end_date, 'is_upward_trend'] = RP_summary.loc[start_date, 'is_vMIRP']
-    return RP_vector, RP_summary
-
-
-def count_trend_time(RP_vector):
-    """
-    This function counts the time (number of days/months) since the start of the current trend.
-    :param RP_vector: the price curve WITH the trend indicator. The function first assesses whether the is_upward_trend column exists.
-    :return: RP_vector: the updated RP_vector with the time since the start of trend.
-    """
-    assert 'is_upward_trend' in RP_vector.columns, f"The trend indicator is NOT in the columns of the input!"
-    # Create a mask for changes in the time series column
-    mask = RP_vector['is_upward_trend'] == RP_vector['is_upward_trend'].shift(1)
-    # Initialize a counter column
-    RP_vector['Time_since_trend_start'] = 0
-    # Calculate consecutive count using cumulative sum of the mask
-    RP_vector['Time_since_trend_start'] = mask.groupby((mask != mask.shift()).cumsum()).cumsum()
-    return RP_vector
-
-
-def current_state_in_trend(date_of_interest, nth_last_RP: int, RP_vector, RP_summary):
-    """
-
-    :param date_of_interest:
-    :param nth_last_RP: the n-th last RP that the state on date of interest is compared. Should be int. Currently we restrict it to be between 1 and 5.
-    :param RP_vector:
-    :param RP_summary:
-    :return a series of variables of interest
-    """
-    date = pd.to_datetime(date_of_interest)
-    assert nth_last_RP in {1, 2, 3, 4, 5}, "nth_last_RP must be an integer in the range {1, 2, 3, 4, 5}"
-    trend_start_row_index = RP_summary.index.get_loc(RP_summary[RP_summary.index < date].index[-nth_last_RP])
-    current_date_row_index = RP_vector.index.get_loc(RP_vector[RP_vector.index <= date].index[-nth_last_RP])
-    current_return = (RP_vector.iloc[current_date_row_index, 0] - RP_summary.iloc[trend_start_row_index, 0]) / RP_vector.iloc[current_date_row_index, 0]
-    current_return_type = 'gain' if current_return > 0 else 'loss'
-    current_duration = date - (RP_summary[RP_summary.index < date].index[-nth_last_RP])
-    current_duration_in_days = current_duration.days
-    current_return_percentile_raw = stats.percentileofscore(RP_summary.loc[RP_summary.return_type == current_return_type, 'return'], current_return, kind='rank')
-    current_return_percentile = current_return_percentile_raw if current_return_type == 'gain' else 100 - current_return_percentile_raw
-    current_duration_percentile = stats.percentileofscore(RP_summary.loc[RP_summary.return_type == current_return_type, 'duration'], current_duration_in_days, kind='rank')
-
-    return [current_return, current_duration_in_days, current_return_percentile / 100, current_duration_percentile / 100]
+from trend_core import (RangeExtremaIndex, find_RP, validate_RP, validate_RP_flags, clean_RP_summary,
+                        sweep_irregular_RP, clean_RP_arrays, trend_labels, assign_trend, count_trend_time,
+                        label_trend_segments, current_state_in_trend, trend_state_history, TrendResult,
+                        trend_identification_compact, trend_identification_main, trend_identification_cross_section,
+                        TrendResultCache, trend_identification_cached, trend_identification_sweep, TrendIdentifier,
+                        default_result_cache)
 
 
 # Function: plot the price curve with indication of trends
-def trend_plot_curve(RP_vector, RP_summary, window_in_days):
+def trend_plot_curve(RP_vector, RP_summary, window_in_days, ax=None, is_decimated=True):
     """
     This function plots the entire price curve with indication of each identified upward / downward trend.
+    All the MIRPs (MARPs) are drawn as one collection of vertical lines, and a long price curve is reduced to the
+    minimum and maximum per pixel column of the Axes, which looks the same but renders much faster.
     :param RP_vector: the location (i.e. date) of the validated reflection points, together with the full price vector.
     :param RP_summary: the list of (only) the validated reflection points.
-    :return a plt object.
+    :param ax: the Axes to plot on; by default a new pyplot figure is created.
+    :param is_decimated: whether the price curve is reduced to the resolution of the Axes.
+    :return the artists of the price curve, the MIRPs and the MARPs, such that they can be updated.
     """
-    MIRP_dates = RP_summary[RP_summary['is_MIRP']].index.tolist()
-    MARP_dates = RP_summary[RP_summary['is_MARP']].index.tolist()
+    from matplotlib.dates import YearLocator, AutoDateLocator
+
+    MIRP_dates = RP_summary[RP_summary['is_MIRP']].index
+    MARP_dates = RP_summary[RP_summary['is_MARP']].index
     # plt.plot(local_minimum, color='g')
     # plt.plot(local_maximum, color='r')
-    plt.figure(figsize=(10, 6))
-    plt.plot(RP_vector.iloc[:, 0])
-    ax = plt.gca()
-    ax.xaxis.set_major_locator(matplotlib.dates.YearLocator())
-    plt.xticks(rotation=45)
-    plt.legend(["price curve", "MIRP, window: " + str(window_in_days), "MARP, window: " +
-                str(window_in_days)], loc="upper left")
-    for date in MIRP_dates:
-        plt.axvline(x=date, color='g', linestyle='--')
-    for date in MARP_dates:
-        plt.axvline(x=date, color='r', linestyle='--')
-    plt.xlabel('date')
-    plt.ylabel('price')
+    if ax is None:
+        import matplotlib.pyplot as plt
+        plt.figure(figsize=(10, 6))
+        ax = plt.gca()
+    price = RP_vector.iloc[:, 0]
+    if is_decimated:
+        price = price.iloc[ut.decimate_min_max(price, int(ax.get_window_extent().width))]
+    price_line, = ax.plot(price, label="price curve")
+    ax.xaxis.set_major_locator(YearLocator())
+    ax.tick_params(axis='x', labelrotation=45)
+    # The vertical lines span the full height of the Axes, whatever the price range.
+    MIRP_lines = ax.vlines(MIRP_dates, 0, 1, transform=ax.get_xaxis_transform(), colors='g', linestyles='--',
+                           label="MIRP, window: " + str(window_in_days))
+    MARP_lines = ax.vlines(MARP_dates, 0, 1, transform=ax.get_xaxis_transform(), colors='r', linestyles='--',
+                           label="MARP, window: " + str(window_in_days))
+    # The y-limits follow the price curve only, not the (axes-relative) vertical lines.
+    ax.relim()
+    ax.autoscale_view()
+    ax.legend(loc="upper left")
+    ax.set_xlabel('date')
+    ax.set_ylabel('price')
 
     # Use AutoDateLocator to automatically choose the date intervals
     locator = AutoDateLocator(maxticks=20)  # Adjust the maxticks value as needed
-    plt.gca().xaxis.set_major_locator(locator)
-    plt.tight_layout()
+    ax.xaxis.set_major_locator(locator)
+    ax.figure.tight_layout()
     # plt.show()
+    return price_line, MIRP_lines, MARP_lines
+
+
+# Function: update the RPs of a plotted price curve
+def trend_update_curve(curve_artists, RP_summary, window_in_days):
+    """
+    This function updates the MIRP and MARP lines drawn by trend_plot_curve for a new RP_summary of the same price
+    curve (e.g. for another window), without drawing the figure again from scratch.
+    :param curve_artists: the artists returned by trend_plot_curve.
+    :param RP_summary: the list of (only) the validated reflection points.
+    :param window_in_days: the window of RP_summary, shown in the legend.
+    """
+    price_line, MIRP_lines, MARP_lines = curve_artists
+    ax = price_line.axes
+    for lines, column, name in [(MIRP_lines, 'is_MIRP', 'MIRP'), (MARP_lines, 'is_MARP', 'MARP')]:
+        x_values = ax.convert_xunits(RP_summary[RP_summary[column]].index)
+        lines.set_segments([[(x, 0), (x, 1)] for x in x_values])
+        lines.set_label(f"{name}, window: {window_in_days}")
+    ax.legend(loc="upper left")
 
 
 # Function: give a scatter plot of the durations and returns for the trends
-def trend_plot_scatter(RP_summary, window_in_days):
+def trend_plot_scatter(RP_summary, window_in_days, ax=None):
     """
     This function gives a scatter plot of the durations and returns for all the identified upward / downward trends.
     :param RP_vector: the location (i.e. date) of the validated reflection points, together with the full price vector.
     :param RP_summary: the list of (only) the validated reflection points.
+    :param ax: the Axes to plot on; by default the current pyplot Axes.
     :return pop-up figure
     """
+    if ax is None:
+        import matplotlib.pyplot as plt
+        ax = plt.gca()
     trend_summary = RP_summary[['duration', 'return', 'return_type']].dropna()
     for return_type in trend_summary['return_type'].unique():
         x_values = trend_summary.loc[trend_summary['return_type'] == return_type, 'duration']
         y_values = trend_summary.loc[trend_summary['return_type'] == return_type, 'return']
-        plt.scatter(x_values, y_values, label=return_type, alpha=0.3, edgecolors='none')
-    plt.xlabel('duration')
-    plt.ylabel('returns in the trend')
-    plt.legend()
-    plt.grid(True)
-    plt.title(f"window: {window_in_days}")
+        ax.scatter(x_values, y_values, label=return_type, alpha=0.3, edgecolors='none')
+    ax.set_xlabel('duration')
+    ax.set_ylabel('returns in the trend')
+    ax.legend()
+    ax.grid(True)
+    ax.set_title(f"window: {window_in_days}")
     # plt.show()
 
 
 # Function: give a scatter plot of the durations and returns for the trends
 def trend_plot_hist(RP_summary, number_bins=20):
+    import matplotlib.pyplot as plt
+
     # Create a figure and two subplots
     fig, axs = plt.subplots(1, 2, figsize=(10, 5))
 
@@ -254,30 +146,3 @@ def trend_plot_hist(RP_summary, number_bins=20):
     # Display the subplots
     plt.tight_layout()
     plt.show()
-
-
-def trend_identification_main(price_raw, is_month_average=False, window_in_days=63):
-
-    """
-    This function mainly summarizes all the steps to perform the trend identification; see the concrete functions below.
-    :param price_raw: the entire historical price curve. It is deliberately designed to be detached from the data collection steps.
-    :param is_month_average: whether the trend identification is performed on an MA curve; boolean variable.
-    :param window_in_days:
-    :return: the RP_vector and RP_summary, containing the information of identified trend info.
-    """
-
-    if is_month_average:
-        price = ds.calculate_monthly_average(pd.DataFrame(price_raw))
-        window = window_in_days // 21
-    else:
-        price = pd.DataFrame(price_raw)
-        window = window_in_days
-
-    RP_vector, RP_summary = find_RP(price, window)
-    RP_summary = calculate_trend_return(RP_summary)
-    RP_summary = drop_irregular_RP(RP_summary)
-    RP_summary = calculate_trend_return(RP_summary)
-    RP_summary = drop_irregular_RP(RP_summary)
-    RP_vector, RP_summary = assign_trend(RP_vector, RP_summary)
-    return RP_vector, RP_summary
-
@@ -1,21 +1,52 @@
+import os
+import queue
+import configparser
+import threading
 import tkinter as tk
 from tkinter import ttk
 from ttkthemes import ThemedTk
 import matplotlib
 from matplotlib.figure import Figure
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
-import matplotlib.pyplot as plt
 from datetime import datetime
 
 import numpy as np
 import trend_identification as trend
 import data_sourcer as ds
+import data_providers as dp
+import utils as ut
+
+
+def format_duration(duration_in_days):
+    # The duration w.r.t. the n-th last RP is NaN if there are fewer than n RPs, e.g. for a long window.
+    return "n/a" if np.isnan(duration_in_days) else f"{int(duration_in_days)}"
+
+
+def format_percentage(value):
+    return "n/a" if np.isnan(value) else "{:.2%}".format(value)
 
 
 class PlottingApp:
-    def __init__(self, root):
+    def __init__(self, root, provider=None):
         self.root = root
         self.root.title("Trend identification visualizer")
+        # The prices come from Yahoo Finance through the local cache, or from the given provider (e.g. the replay of
+        # recorded snapshots, to use the GUI offline).
+        self.provider = provider
+        self.price_cache = None
+        if provider is None or provider.is_network:
+            self.price_cache = ds.LocalSeriesCache(
+                os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'output', 'cache', 'prices'),
+                ds.fetch_stock_price_daily_close if provider is None else provider.fetch_one)
+        # The download and the trend identification run in a worker thread; its results come back via a queue that is
+        # polled on the Tk main thread. Only the result of the latest request is shown; older ones are superseded.
+        self.result_cache = ut.LRUCache(max_size=16)
+        self.result_queue = queue.Queue()
+        self.latest_request_id = 0
+        # The keys being computed, with the latest request and view they answer; a request for a key in flight waits
+        # for its worker instead of starting a second one.
+        self.keys_in_flight = {}
+        self.root.after(50, self.poll_results)
 
         # Create input fields
         self.label_code = ttk.Label(root, text="Enter price code:")
@@ -31,11 +62,24 @@ class PlottingApp:
         self.plot_button_curve = ttk.Button(root, text="Plot the entire curve with identified trend", command=self.plot_trend_curve)
         self.plot_button_scatter = ttk.Button(root, text="Plot the scatter plots of trend P&L and duration", command=self.plot_trend_scatter)
         self.plot_button_clear = ttk.Button(root, text="Clear figure", command=self.clear_canvas)
+        self.label_status = ttk.Label(root, text=" ")
+
+        # Create the window slider; it only redraws the RP lines of the plotted curve (by blitting).
+        self.label_window_slider = ttk.Label(root, text="Slide the window in days:")
+        self.window_slider = ttk.Scale(root, from_=5, to=504, orient=tk.HORIZONTAL, length=300, command=self.on_window_slider)
+        self.label_window_slider_value = ttk.Label(root, text=" ")
+        self.slider_job = None
+        self.curve_artists = None
+        self.curve_key = None
+        self.curve_price = None
+        self.extrema_index = None
+        self.background = None
 
         # Create plot canvas
         self.figure = Figure(figsize=(10, 6), dpi=100)
         self.canvas = FigureCanvasTkAgg(self.figure, master=root)
         self.canvas_widget = self.canvas.get_tk_widget()
+        self.canvas.mpl_connect('draw_event', self.on_canvas_draw)
 
         # Arrange the elements mentioned above
         self.label_code.grid(row=0, column=0, padx=10, pady=5, sticky=tk.W)
@@ -44,9 +88,13 @@ class PlottingApp:
         self.entry_start_date.grid(row=1, column=1, padx=10, pady=5, sticky=tk.W)
         self.label_window.grid(row=0, column=2, padx=10, pady=5, sticky=tk.W)
         self.entry_window.grid(row=0, column=3, padx=10, pady=5, sticky=tk.W)
+        self.label_window_slider.grid(row=2, column=0, padx=10, pady=5, sticky=tk.W)
+        self.window_slider.grid(row=2, column=1, columnspan=2, padx=10, pady=5, sticky=tk.W)
+        self.label_window_slider_value.grid(row=2, column=3, padx=10, pady=5, sticky=tk.W)
         self.plot_button_curve.grid(row=3, column=0, padx=10, pady=10, sticky=tk.W)
         self.plot_button_scatter.grid(row=3, column=1, padx=10, pady=10, sticky=tk.W)
         self.plot_button_clear.grid(row=3, column=2, padx=10, pady=10, sticky=tk.W)
+        self.label_status.grid(row=3, column=3, padx=10, pady=10, sticky=tk.W)
         self.canvas_widget.grid(row=4, column=0, rowspan=12, columnspan=4, padx=10, pady=5, sticky=tk.W+tk.E)
 
         self.output_state_wrt_1st_last_RP_return = ttk.Label(root, text="Return w.r.t. the last RP: ")
@@ -110,114 +158,216 @@ class PlottingApp:
         self.output_state_wrt_3rd_last_RP_duration_pct_value.grid(row=15, column=5, padx=10, pady=5, sticky=tk.W)
 
     def plot_trend_curve(self):
-
-        window_in_days = int(self.entry_window.get())
-        price_raw = ds.download_stock_price_daily_close(code=self.entry_code.get(), start_date=self.entry_start_date.get(), end_date=datetime.now().strftime("%Y-%m-%d"))
-        RP_vector, RP_summary = trend.trend_identification_main(price_raw, False, window_in_days)
-
-        # Here the canvas needs to be cleared
-        self.canvas.get_tk_widget().delete("all")
-        self.canvas = FigureCanvasTkAgg(self.figure, master=root)
-        self.canvas_widget = self.canvas.get_tk_widget()
-        self.canvas_widget.grid(row=4, column=0, rowspan=12, columnspan=4, padx=10, pady=5, sticky=tk.W+tk.E)
-
-        self.update_current_state(RP_vector, RP_summary)
-
-        matplotlib.use('Agg')  # Set the non-interactive backend, in order to prevent the extra popup window when plotting
-        ax = self.figure.add_subplot(111)
-        trend.trend_plot_curve(RP_vector, RP_summary, window_in_days)
-        self.canvas.figure = plt.gcf()
-        self.canvas.draw()
-        self.canvas_widget.grid(row=4, column=0, rowspan=12, columnspan=4, padx=10, pady=5, sticky=tk.W+tk.E)
-
-        matplotlib.use('TkAgg')  # Return to the interactive backend
+        self.request_trend('curve')
 
     def plot_trend_scatter(self):
-
-        window_in_days = int(self.entry_window.get())
-        price_raw = ds.download_stock_price_daily_close(code=self.entry_code.get(), start_date=self.entry_start_date.get(), end_date=datetime.now().strftime("%Y-%m-%d"))
-        RP_vector, RP_summary = trend.trend_identification_main(price_raw, False, window_in_days)
-
-        # Here the canvas needs to be cleared
-        self.canvas.get_tk_widget().delete("all")
-        self.canvas = FigureCanvasTkAgg(self.figure, master=root)
-        self.canvas_widget = self.canvas.get_tk_widget()
-        self.canvas_widget.grid(row=4, column=0, rowspan=12, columnspan=4, padx=10, pady=5, sticky=tk.W+tk.E)
-
-        self.update_current_state(RP_vector, RP_summary)
-
-        matplotlib.use('Agg')  # Set the non-interactive backend, in order to prevent the extra popup window when plotting
+        self.request_trend('scatter')
+
+    def read_window(self):
+        # The entry is the source of truth for the window; the slider only covers part of the range.
+        text = self.entry_window.get().strip()
+        if not text.isdigit() or int(text) < 1:
+            self.label_status.config(text="The window should be a positive whole number of days.")
+            return None
+        return int(text)
+
+    def request_trend(self, view):
+        # The inputs are read here, on the main thread; the worker thread never touches Tk.
+        window_in_days = self.read_window()
+        if window_in_days is None:
+            return
+        key = (self.entry_code.get(), self.entry_start_date.get(), window_in_days)
+        self.latest_request_id += 1
+        result = self.result_cache.get(key)
+        if result is not None:
+            self.show_result(view, key, result)
+            return
+        self.label_status.config(text=f"Computing {key[0]}...")
+        is_in_flight = key in self.keys_in_flight
+        self.keys_in_flight[key] = (self.latest_request_id, view)
+        if not is_in_flight:
+            self.start_worker(key)
+
+    def start_worker(self, key):
+        worker = threading.Thread(target=self.compute_trend, args=(key,), daemon=True)
+        worker.start()
+
+    def compute_trend(self, key):
+        # Runs in the worker thread.
+        code, start_date, window_in_days = key
+        try:
+            price_raw = ds.download_stock_price_daily_close(code=code, start_date=start_date, end_date=datetime.now().strftime("%Y-%m-%d"), cache=self.price_cache, provider=self.provider)
+            if price_raw is None or len(price_raw) == 0:
+                raise LookupError(f"No prices of {code} from {start_date} on.")
+            if self.keys_in_flight[key][0] != self.latest_request_id:
+                self.result_queue.put((key, None, None))
+                return  # superseded by a newer request during the download
+            RP_vector, RP_summary = trend.trend_identification_cached(price_raw, False, window_in_days)
+            current_state = trend.trend_state_history(RP_vector, RP_summary, [datetime.now().strftime("%Y-%m-%d")], (1, 2, 3)).iloc[0]
+            self.result_queue.put((key, (RP_vector, RP_summary, current_state), None))
+        except Exception as e:
+            self.result_queue.put((key, None, e))
+
+    def poll_results(self):
+        try:
+            while not self.result_queue.empty():
+                key, result, error = self.result_queue.get()
+                request_id, view = self.keys_in_flight.pop(key)
+                if result is not None:
+                    self.result_cache.put(key, result)
+                if result is None and error is None and request_id == self.latest_request_id:
+                    # The worker gave up on a superseded request, but the key was requested again since; the new
+                    # request had no worker of its own, so one is started now.
+                    self.keys_in_flight[key] = (request_id, view)
+                    self.start_worker(key)
+                    continue
+                if request_id != self.latest_request_id or (result is None and error is None):
+                    continue  # superseded by a newer request
+                if error is not None:
+                    self.label_status.config(text=f"Failed: {error}")
+                    continue
+                try:
+                    self.show_result(view, key, result)
+                except Exception as e:
+                    self.label_status.config(text=f"Failed to show {key[0]}: {e}")
+        finally:
+            # The polling must go on whatever happens above, else all later requests would wait forever.
+            self.root.after(50, self.poll_results)
+
+    def show_result(self, view, key, result):
+        RP_vector, RP_summary, current_state = result
+        window_in_days = key[2]
+        self.label_status.config(text=" ")
+        self.update_current_state(current_state)
+
+        # The trends are drawn on the figure of the existing canvas.
+        self.figure.clf()
         ax = self.figure.add_subplot(111)
-        trend.trend_plot_scatter(RP_summary, window_in_days)
-        self.canvas.figure = plt.gcf()
-        self.canvas.draw()
-        matplotlib.use('TkAgg')  # Return to the interactive backend
+        if view == 'curve':
+            self.curve_artists = trend.trend_plot_curve(RP_vector, RP_summary, window_in_days, ax)
+            self.set_animated_artists()
+            if self.curve_key != key[:2]:
+                # Keep the price curve and its extrema index in memory for the slider.
+                self.curve_key = key[:2]
+                self.curve_price = RP_vector.iloc[:, [0]]
+                self.extrema_index = trend.RangeExtremaIndex(self.curve_price)
+            self.set_window_slider(window_in_days)
+        else:
+            self.curve_artists = None
+            trend.trend_plot_scatter(RP_summary, window_in_days, ax)
+        self.canvas.draw_idle()
+
+    def set_animated_artists(self):
+        # The RP lines and the legend are left out of the normal draw, so that they can be blitted on the background.
+        for artist in self.curve_artists[1:] + (self.figure.axes[0].get_legend(),):
+            artist.set_animated(True)
+
+    def on_canvas_draw(self, event):
+        # After every full draw (also after a resize), store the background and draw the RP lines on top of it.
+        if self.curve_artists is None:
+            self.background = None
+            return
+        self.background = self.canvas.copy_from_bbox(self.figure.bbox)
+        self.draw_animated_artists()
+
+    def draw_animated_artists(self):
+        for artist in self.curve_artists[1:] + (self.figure.axes[0].get_legend(),):
+            self.figure.draw_artist(artist)
+
+    def set_window_slider(self, window_in_days):
+        # Moving the slider from the code must not trigger a recompute: the slider clamps the window to its range, so
+        # the command would compute another window than the one of the entry.
+        self.window_slider.configure(command='')
+        self.window_slider.set(window_in_days)
+        self.window_slider.configure(command=self.on_window_slider)
+        self.label_window_slider_value.config(text=f"{window_in_days}")
+
+    def on_window_slider(self, value):
+        window_in_days = int(float(value))
+        self.label_window_slider_value.config(text=f"{window_in_days}")
+        # Only the last position of a fast slide is computed.
+        if self.slider_job is not None:
+            self.root.after_cancel(self.slider_job)
+        self.slider_job = self.root.after(10, self.update_window, window_in_days)
+
+    def update_window(self, window_in_days):
+        self.slider_job = None
+        if self.curve_artists is None or str(window_in_days) == self.entry_window.get().strip():
+            return
+        self.latest_request_id += 1  # supersedes the requests in flight
+        key = self.curve_key + (window_in_days,)
+        result = self.result_cache.get(key)
+        if result is None:
+            # The price is in memory and the running extrema come from the index, so this is fast enough for the Tk thread.
+            RP_vector, RP_summary = trend.trend_identification_cached(self.curve_price, False, window_in_days, self.extrema_index)
+            current_state = trend.trend_state_history(RP_vector, RP_summary, [datetime.now().strftime("%Y-%m-%d")], (1, 2, 3)).iloc[0]
+            result = (RP_vector, RP_summary, current_state)
+            self.result_cache.put(key, result)
+
+        self.entry_window.delete(0, tk.END)
+        self.entry_window.insert(0, str(window_in_days))
+        self.update_current_state(result[2])
+        trend.trend_update_curve(self.curve_artists, result[1], window_in_days)
+        self.set_animated_artists()
+        if self.background is not None:
+            self.canvas.restore_region(self.background)
+            self.draw_animated_artists()
+            self.canvas.blit(self.figure.bbox)
 
     def clear_canvas(self):
         # Clear the canvas
+        self.curve_artists = None
         self.canvas.get_tk_widget().delete("all")
         self.figure.clf()
         self.canvas.draw()
 
-    def update_current_state(self, RP_vector, RP_summary):
-        current_state_stat_1st = trend.current_state_in_trend(datetime.now().strftime("%Y-%m-%d"), 1, RP_vector, RP_summary)
-        current_state_stat_2nd = trend.current_state_in_trend(datetime.now().strftime("%Y-%m-%d"), 2, RP_vector, RP_summary)
-        current_state_stat_3rd = trend.current_state_in_trend(datetime.now().strftime("%Y-%m-%d"), 3, RP_vector, RP_summary)
+    def update_current_state(self, current_state):
+        current_state_stat_1st = current_state[['return_1', 'duration_1', 'return_percentile_1', 'duration_percentile_1']].tolist()
+        current_state_stat_2nd = current_state[['return_2', 'duration_2', 'return_percentile_2', 'duration_percentile_2']].tolist()
+        current_state_stat_3rd = current_state[['return_3', 'duration_3', 'return_percentile_3', 'duration_percentile_3']].tolist()
 
         # Next, update the label text by the variables.
         # I know it's ugly but this is simpler to code...
         # wrt 1st last
-        value_to_update = "{:.2%}".format(current_state_stat_1st[0])
-        updated_text = f"{value_to_update}"
+        updated_text = format_percentage(current_state_stat_1st[0])
         # Update the label with the new text
         self.output_state_wrt_1st_last_RP_return_value.config(text=updated_text)
 
-        value_to_update = current_state_stat_1st[1]
-        updated_text = f"{value_to_update}"
+        updated_text = format_duration(current_state_stat_1st[1])
         self.output_state_wrt_1st_last_RP_duration_value.config(text=updated_text)
 
-        value_to_update = "{:.2%}".format(current_state_stat_1st[2])
-        updated_text = f"{value_to_update}"
+        updated_text = format_percentage(current_state_stat_1st[2])
         self.output_state_wrt_1st_last_RP_return_pct_value.config(text=updated_text)
 
-        value_to_update = "{:.2%}".format(current_state_stat_1st[3])
-        updated_text = f"{value_to_update}"
+        updated_text = format_percentage(current_state_stat_1st[3])
         self.output_state_wrt_1st_last_RP_duration_pct_value.config(text=updated_text)
 
         # wrt 2nd last
-        value_to_update = "{:.2%}".format(current_state_stat_2nd[0])
-        updated_text = f"{value_to_update}"
+        updated_text = format_percentage(current_state_stat_2nd[0])
         # Update the label with the new text
         self.output_state_wrt_2nd_last_RP_return_value.config(text=updated_text)
 
-        value_to_update = current_state_stat_2nd[1]
-        updated_text = f"{value_to_update}"
+        updated_text = format_duration(current_state_stat_2nd[1])
         self.output_state_wrt_2nd_last_RP_duration_value.config(text=updated_text)
 
-        value_to_update = "{:.2%}".format(current_state_stat_2nd[2])
-        updated_text = f"{value_to_update}"
+        updated_text = format_percentage(current_state_stat_2nd[2])
         self.output_state_wrt_2nd_last_RP_return_pct_value.config(text=updated_text)
 
-        value_to_update = "{:.2%}".format(current_state_stat_2nd[3])
-        updated_text = f"{value_to_update}"
+        updated_text = format_percentage(current_state_stat_2nd[3])
         self.output_state_wrt_2nd_last_RP_duration_pct_value.config(text=updated_text)
 
         # wrt 3rd last
-        value_to_update = "{:.2%}".format(current_state_stat_3rd[0])
-        updated_text = f"{value_to_update}"
+        updated_text = format_percentage(current_state_stat_3rd[0])
         # Update the label with the new text
         self.output_state_wrt_3rd_last_RP_return_value.config(text=updated_text)
 
-        value_to_update = current_state_stat_3rd[1]
-        updated_text = f"{value_to_update}"
+        updated_text = format_duration(current_state_stat_3rd[1])
         self.output_state_wrt_3rd_last_RP_duration_value.config(text=updated_text)
 
-        value_to_update = "{:.2%}".format(current_state_stat_3rd[2])
-        updated_text = f"{value_to_update}"
+        updated_text = format_percentage(current_state_stat_3rd[2])
         self.output_state_wrt_3rd_last_RP_return_pct_value.config(text=updated_text)
 
-        value_to_update = "{:.2%}".format(current_state_stat_3rd[3])
-        updated_text = f"{value_to_update}"
+        updated_text = format_percentage(current_state_stat_3rd[3])
         self.output_state_wrt_3rd_last_RP_duration_pct_value.config(text=updated_text)
 
     # def show_error(self, message):
@@ -230,7 +380,14 @@ class PlottingApp:
 
 
 if __name__ == "__main__":
+    # The prices come from the price provider of the configuration, e.g. the replay of snapshots to work offline.
+    config = configparser.ConfigParser()
+    config.read('config.ini')
+    current_folder = os.path.dirname(os.path.abspath(__file__))
+    provider = dp.create_provider(config['data_provider']['price_provider'],
+                                  os.path.join(current_folder, '..', config['data_provider']['snapshot_folder']),
+                                  float(config['data_provider']['latency_in_seconds']))
     # root = tk.Tk()
     root = ThemedTk(theme="elegance")  # Specify the theme name here
-    app = PlottingApp(root)
+    app = PlottingApp(root, provider)
     root.mainloop()
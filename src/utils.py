@@ -1,8 +1,8 @@
 # This file contains useful utility functions.
 
+from collections import OrderedDict
 import pandas as pd
 import numpy as np
-from scipy import stats
 
 
 def remove_illegal_symbols(s):
@@ -22,3 +22,127 @@ def remove_illegal_symbols(s):
 
     return cleaned_string
 
+
+
+def segment_starts(segment_ids):
+    """
+    This function locates the first position of each run of equal values in an array of segment ids.
+
+    :param segment_ids: a 1-D array in which consecutive equal values form one segment.
+    :return: the positions (int array) at which a new segment starts.
+    """
+
+    segment_ids = np.asarray(segment_ids)
+    if segment_ids.size == 0:
+        return np.empty(0, dtype=np.int64)
+    return np.flatnonzero(np.r_[True, segment_ids[1:] != segment_ids[:-1]])
+
+
+def segment_arg_extreme(segment_ids, values, find_max=False):
+    """
+    This function finds, for every segment, the position of its minimum (or maximum) value without looping over the
+    segments. Ties are resolved to the first occurrence and NaN values are skipped, just like pandas' idxmin/idxmax.
+
+    :param segment_ids: a 1-D array in which consecutive equal values form one segment.
+    :param values: a 1-D numeric array of the same length as segment_ids.
+    :param find_max: whether the maximum (True) or the minimum (False) is searched for.
+    :return: the position of the extreme value for each segment, in the order of the segments.
+    """
+
+    values = np.asarray(values, dtype=float)
+    positions = np.arange(values.size)
+    starts = segment_starts(segment_ids)
+    is_start = np.zeros(values.size, dtype=bool)
+    is_start[starts] = True
+    segment_number = np.cumsum(is_start) - 1
+    # lexsort sorts on the last key first: segment, then value (NaN last), then position for the first occurrence.
+    order = np.lexsort((positions, -values if find_max else values, segment_number))
+    return order[starts]
+
+
+def percentile_of_scores(sorted_data, scores, kind='rank'):
+    """
+    This function gives the same result as scipy.stats.percentileofscore(data, score, kind) for many scores at once,
+    by binary search in the sorted data instead of comparing every score with all the data.
+
+    :param sorted_data: the data as a 1-D array, sorted ascending and without NaN values.
+    :param scores: the scores (array-like) of which the percentiles are calculated; a NaN score gives NaN.
+    :param kind: 'rank', 'weak', 'strict' or 'mean'; see scipy.stats.percentileofscore.
+    :return: the percentiles (between 0 and 100) as an array of the same shape as scores.
+    """
+
+    scores = np.asarray(scores, dtype=float)
+    number_data = len(sorted_data)
+    if number_data == 0:
+        return np.full(scores.shape, np.nan)
+    left = np.searchsorted(sorted_data, scores, side='left')
+    right = np.searchsorted(sorted_data, scores, side='right')
+    if kind == 'rank':
+        percentiles = (left + right + (left < right)) * (50.0 / number_data)
+    elif kind == 'strict':
+        percentiles = left * (100.0 / number_data)
+    elif kind == 'weak':
+        percentiles = right * (100.0 / number_data)
+    elif kind == 'mean':
+        percentiles = (left + right) * (50.0 / number_data)
+    else:
+        raise ValueError("kind can only be 'rank', 'strict', 'weak' or 'mean'")
+    return np.where(np.isnan(scores), np.nan, percentiles)
+
+
+def decimate_min_max(values, number_buckets):
+    """
+    This function selects the points of a (long) curve that are needed to draw it at a given resolution: the curve is
+    split into number_buckets buckets of consecutive points, of which the minimum and the maximum are kept, together
+    with the first and the last point of the curve. Drawn with one bucket per pixel, the result looks the same as the
+    full curve, including all spikes.
+
+    :param values: the 1-D array of the curve.
+    :param number_buckets: the number of buckets, typically the width of the plot in pixels.
+    :return: the sorted positions of the points to keep.
+    """
+
+    values = np.asarray(values, dtype=float)
+    number_values = values.size
+    if number_values <= 2 * number_buckets:
+        return np.arange(number_values)
+    bucket = np.arange(number_values) * number_buckets // number_values
+    positions = np.concatenate([[0, number_values - 1], segment_arg_extreme(bucket, values, find_max=False),
+                                segment_arg_extreme(bucket, values, find_max=True)])
+    return np.unique(positions)
+
+
+class LRUCache:
+    """
+    A small in-memory cache that keeps the most recently used items up to a maximum number; the least recently used
+    item is dropped first. The numbers of hits and misses are counted.
+    """
+
+    def __init__(self, max_size=32):
+        self.max_size = max_size
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def __len__(self):
+        return len(self.items)
+
+    def get(self, key, default=None):
+        if key not in self.items:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self.items.move_to_end(key)
+        return self.items[key]
+
+    def put(self, key, value):
+        self.items[key] = value
+        self.items.move_to_end(key)
+        while len(self.items) > self.max_size:
+            self.items.popitem(last=False)
+
+    def clear(self):
+        self.items.clear()
@@ -0,0 +1,173 @@
+# This module evaluates the chapter-2 logistic regression out of sample with a walk-forward backtest: the model is
+# refitted at every refit date on the observations before it only (an expanding window, or a rolling one of fixed
+# size), and predicts the dates up to the next refit. The refit dates are split in contiguous blocks, which are fitted
+# in a pool of processes. Within a block, every refit starts from the coefficients of the previous one (warm start),
+# so a monthly refit over decades of data costs little more than a few cold fits.
+#
+# Note that the trend labels are known in hindsight only: the trend of a date is only settled once the later RPs are
+# confirmed, and the cleaning of the RPs can still change it afterwards. Training on the hindsight labels would thus
+# leak the future into every refit. With a training target (see point_in_time_target), every refit is instead trained
+# on the labels of a trend identification on the prices before its refit date only. The gap can leave the last
+# periods before every refit date out of its training set in addition.
+
+import os
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from sklearn.linear_model import LogisticRegression
+from sklearn import metrics
+import trend_core as trend
+
+
+def point_in_time_target(price_raw, is_month_average, window_in_days, refit_date):
+    """
+    This function calculates the trend labels as they were known at a refit date, from the prices before it only.
+
+    :param price_raw: the entire historical price curve.
+    :param is_month_average: whether the trend identification is performed on an MA curve; boolean variable.
+    :param window_in_days: the window of the trend identification.
+    :param refit_date: the refit date; only the prices before it are used.
+    :return: a series with the target (1.0 for an upward trend, else 0.0) per date before the refit date, NaN from the
+    last RP on, since the trend there is not settled yet.
+    """
+    result = trend.trend_identification_compact(price_raw[price_raw.index < refit_date], is_month_average,
+                                                window_in_days)
+    target = result.RP_vector['is_upward_trend'].astype(float)
+    is_kept = result.has_flag(trend.TrendResult.IS_KEPT, is_kept_only=False)
+    last_RP_position = result.RP_positions[is_kept][-1] if is_kept.any() else 0
+    target.iloc[last_RP_position:] = np.nan
+    return target
+
+
+def fit_block(predictors, target, refit_positions, end_positions, train_size=None, gap=0, model_parameters=None,
+              training_targets=None):
+    """
+    This function runs the refits of one block, warm-starting each refit from the previous coefficients.
+
+    :param predictors: the predictors, a 2-D float array with one row per date.
+    :param target: the target, a 1-D array of 0 and 1.
+    :param refit_positions: the rows at which the model is refitted, in ascending order.
+    :param end_positions: per refit, the row (exclusive) up to which the refitted model predicts.
+    :param train_size: the number of rows of the rolling training window; None for an expanding window.
+    :param gap: the number of rows left out between the training window and the refit row.
+    :param model_parameters: the parameters of the LogisticRegression.
+    :param training_targets: optional, per refit, the target known at the refit row, a float array with one row per
+    refit and NaN where the target is unknown; the rows with NaN are left out of the training set. By default, every
+    refit is trained on target.
+    :return: the out-of-sample probabilities of the rows of the block (NaN where the training window has one class).
+    """
+    model = LogisticRegression(warm_start=True, **(model_parameters or {}))
+    probabilities = np.full(end_positions[-1] - refit_positions[0], np.nan)
+    for refit_number, (refit_position, end_position) in enumerate(zip(refit_positions, end_positions)):
+        train_end = refit_position - gap
+        train_start = 0 if train_size is None else max(train_end - train_size, 0)
+        train_predictors = predictors[train_start:train_end]
+        if training_targets is None:
+            train_target = target[train_start:train_end]
+        else:
+            train_target = training_targets[refit_number, train_start:train_end]
+            is_known = ~np.isnan(train_target)
+            train_predictors, train_target = train_predictors[is_known], train_target[is_known].astype(int)
+        if train_target.size == 0 or train_target.min() == train_target.max():
+            continue
+        model.fit(train_predictors, train_target)
+        probabilities[refit_position - refit_positions[0]:end_position - refit_positions[0]] = \
+            model.predict_proba(predictors[refit_position:end_position])[:, 1]
+    return probabilities
+
+
+def walk_forward_probabilities(predictors, target, min_train_size=60, refit_every=1, train_size=None, gap=0,
+                               number_blocks=None, max_workers=None, model_parameters=None, training_target=None):
+    """
+    This function calculates the out-of-sample probabilities of the walk-forward backtest; see the top of the module.
+
+    :param predictors: a dataframe with the predictors, one row per date in ascending order.
+    :param target: a series with the target (0 or 1) on the same dates.
+    :param min_train_size: the number of rows before the first refit.
+    :param refit_every: the number of rows between the refits, e.g. 1 to refit every month.
+    :param train_size: the number of rows of the rolling training window; None for an expanding window.
+    :param gap: the number of rows left out between the training window and every refit row.
+    :param number_blocks: the number of blocks of refits; by default the number of workers, or 1 without a pool.
+    :param max_workers: the number of worker processes; 1 fits the blocks in this process.
+    :param model_parameters: the parameters of the LogisticRegression, e.g. {'max_iter': 100000}.
+    :param training_target: optional function (refit_date) -> series with the target known at the refit date (NaN
+    where unknown), e.g. a functools.partial of point_in_time_target; it is called in this process. By default, every
+    refit is trained on target, i.e. in hindsight.
+    :return: a series with the probability of the target 1 per date, from the first refit on.
+    """
+    predictors_array = np.ascontiguousarray(predictors.to_numpy(dtype=float))
+    target_array = target.to_numpy(dtype=int)
+    number_rows = len(target_array)
+    assert len(predictors_array) == number_rows, "The predictors and the target should have the same dates!"
+    assert min_train_size - gap > 0, "The first training window is empty!"
+    refit_positions = np.arange(min_train_size, number_rows, refit_every)
+    if refit_positions.size == 0:
+        return pd.Series(dtype=float, name='probability')
+    end_positions = np.r_[refit_positions[1:], number_rows]
+    training_targets = None
+    if training_target is not None:
+        training_targets = np.vstack([training_target(target.index[refit_position]).reindex(target.index).to_numpy(
+            dtype=float) for refit_position in refit_positions])
+
+    if number_blocks is None:
+        number_blocks = 1 if max_workers == 1 else (max_workers or os.cpu_count())
+    blocks = [(refit_positions[block], end_positions[block],
+               None if training_targets is None else training_targets[block])
+              for block in np.array_split(np.arange(refit_positions.size), min(number_blocks, refit_positions.size))]
+    if max_workers == 1:
+        probabilities = [fit_block(predictors_array, target_array, block_refits, block_ends, train_size, gap,
+                                   model_parameters, block_targets)
+                         for block_refits, block_ends, block_targets in blocks]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(fit_block, predictors_array, target_array, block_refits, block_ends, train_size,
+                                       gap, model_parameters, block_targets)
+                       for block_refits, block_ends, block_targets in blocks]
+            probabilities = [future.result() for future in futures]
+    return pd.Series(np.concatenate(probabilities), index=target.index[min_train_size:], name='probability')
+
+
+def evaluate_probabilities(target, probabilities, threshold=0.5):
+    """
+    This function evaluates the out-of-sample probabilities on the dates that have one.
+
+    :param target: a series with the target (0 or 1).
+    :param probabilities: a series with the probabilities, e.g. of walk_forward_probabilities.
+    :param threshold: the probability from which the target 1 is predicted.
+    :return: a dictionary with the number of dates, the AUC (None if the target has one class only), the
+    classification report as text and as dictionary, and the ROC curve (false and true positive rates). Without any
+    probability, the number of dates is 0 and the other entries are empty.
+    """
+    probabilities = probabilities.dropna()
+    if probabilities.empty:
+        return {'number_dates': 0, 'auc': None, 'report': '', 'report_dict': {}, 'fpr': None, 'tpr': None}
+    target = target.loc[probabilities.index]
+    predictions = (probabilities >= threshold).astype(int)
+    is_both_classes = target.nunique() == 2
+    fpr, tpr, _ = metrics.roc_curve(target, probabilities) if is_both_classes else (None, None, None)
+    return {'number_dates': len(target),
+            'auc': metrics.roc_auc_score(target, probabilities) if is_both_classes else None,
+            'report': metrics.classification_report(target, predictions, zero_division=0),
+            'report_dict': metrics.classification_report(target, predictions, zero_division=0, output_dict=True),
+            'fpr': fpr, 'tpr': tpr}
+
+
+def run_walk_forward(regression_dataset_df, target_column='is_upward_trend', threshold=0.5, **parameters):
+    """
+    This function runs the walk-forward backtest on a regression dataset and evaluates it.
+
+    :param regression_dataset_df: the dataset with the predictors and the target column, one row per date.
+    :param target_column: the name of the target column.
+    :param threshold: the probability from which the target 1 is predicted.
+    :param parameters: the parameters of walk_forward_probabilities.
+    :return backtest_df: per date, the target, the out-of-sample probability and the prediction.
+    :return evaluation: the output of evaluate_probabilities.
+    """
+    regression_dataset_df = regression_dataset_df.sort_index()
+    predictors = regression_dataset_df.drop(target_column, axis=1)
+    target = regression_dataset_df[target_column]
+    probabilities = walk_forward_probabilities(predictors, target, **parameters)
+    backtest_df = pd.DataFrame({'target': target.loc[probabilities.index], 'probability': probabilities})
+    backtest_df['prediction'] = (backtest_df['probability'] >= threshold).astype(int).where(
+        backtest_df['probability'].notna())
+    return backtest_df, evaluate_probabilities(target, probabilities, threshold)
@@ -0,0 +1,5 @@
+# The modules of the project are imported by their file name from src, like the scripts in src do.
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
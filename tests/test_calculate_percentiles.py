@@ -0,0 +1,43 @@
+# calculate_percentiles must give scipy.stats.percentileofscore of every data point within its own data.
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import stats
+
+import data_sourcer as ds
+
+
+@pytest.mark.parametrize('kind', ['rank', 'weak', 'strict', 'mean'])
+def test_calculate_percentiles_matches_scipy(kind):
+    data = np.random.default_rng(0).integers(0, 20, 300).astype(float)
+    expected = [stats.percentileofscore(data, value, kind) for value in data]
+    np.testing.assert_allclose(ds.calculate_percentiles(data, kind), expected)
+    np.testing.assert_allclose(ds.calculate_percentiles(data.tolist(), kind), expected)
+
+
+def test_calculate_percentiles_per_column_of_a_dataframe():
+    rng = np.random.default_rng(1)
+    data = pd.DataFrame({'a': rng.standard_normal(50), 'b': rng.integers(0, 3, 50).astype(float)},
+                        index=pd.date_range('2000-01-31', periods=50, freq='M'))
+    percentiles = ds.calculate_percentiles(data)
+    assert isinstance(percentiles, pd.DataFrame) and percentiles.index.equals(data.index)
+    for column in data:
+        np.testing.assert_allclose(percentiles[column], [stats.percentileofscore(data[column], value)
+                                                         for value in data[column]])
+
+
+@pytest.mark.parametrize('nan_policy', ['propagate', 'omit'])
+def test_calculate_percentiles_nan_policy(nan_policy):
+    data = pd.Series([3.0, np.nan, 1.0, 2.0, 2.0])
+    expected = [stats.percentileofscore(data.to_numpy(), value, nan_policy=nan_policy) for value in data]
+    np.testing.assert_allclose(ds.calculate_percentiles(data, nan_policy=nan_policy), expected)
+    with pytest.raises(ValueError):
+        ds.calculate_percentiles(data, nan_policy='raise')
+
+
+def test_calculate_percentiles_of_empty_input():
+    assert ds.calculate_percentiles([]) == []
+    assert ds.calculate_percentiles(np.empty((0, 2))).shape == (0, 2)
+    empty_series = ds.calculate_percentiles(pd.Series([], dtype=float, name='x'))
+    assert isinstance(empty_series, pd.Series) and empty_series.empty and empty_series.name == 'x'
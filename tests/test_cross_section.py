@@ -0,0 +1,44 @@
+# The cross-sectional trend identification must give, per instrument, the result of trend_identification_main on its
+# column without the NaN values.
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import trend_core as trend
+
+RP_COLUMNS = ['price', 'is_MIRP', 'is_MARP', 'is_vMIRP', 'is_vMARP', 'return', 'return_type', 'duration']
+
+
+def price_matrix(seed, number_rows=800, number_columns=12):
+    # late listings, holes, rounded (tie-heavy) prices and an empty column
+    rng = np.random.default_rng(seed)
+    values = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, (number_rows, number_columns)), axis=0))
+    values[:, ::3] = np.round(values[:, ::3])
+    for column in range(number_columns):
+        values[:int(rng.integers(0, number_rows // 2)), column] = np.nan
+        values[rng.integers(0, number_rows, 5), column] = np.nan
+    values[:, 4] = np.nan
+    return pd.DataFrame(values, index=pd.bdate_range('2001-01-01', periods=number_rows),
+                        columns=[f"C{column}" for column in range(number_columns)])
+
+
+@pytest.mark.parametrize('seed', range(3))
+@pytest.mark.parametrize('window_in_days', [2, 10, 63])
+def test_cross_section_matches_main_per_column(seed, window_in_days):
+    prices = price_matrix(seed)
+    RP_table, is_upward_trend = trend.trend_identification_cross_section(prices, window_in_days)
+    codes = RP_table.index.get_level_values('code')
+    for code in prices.columns:
+        price = prices[[code]].dropna()
+        if len(price) == 0:
+            assert code not in codes and not is_upward_trend[code].any()
+            continue
+        RP_vector, RP_summary = trend.trend_identification_main(price, False, window_in_days)
+        expected = RP_summary.rename(columns={code: 'price'})[RP_COLUMNS]
+        got = RP_table.xs(code, level='code') if code in codes else expected.iloc[:0]
+        np.testing.assert_array_equal(got.index.to_numpy(), expected.index.to_numpy())
+        pd.testing.assert_frame_equal(got.reset_index(drop=True), expected.reset_index(drop=True), check_dtype=False)
+        np.testing.assert_array_equal(is_upward_trend.loc[price.index, code].to_numpy(),
+                                      RP_vector['is_upward_trend'].to_numpy())
+        assert not is_upward_trend.loc[prices[code].isna(), code].any()
@@ -0,0 +1,88 @@
+# The feature store of EconomicVariables keys a stored feature on the content of the data, the transform, its
+# parameters and FEATURE_VERSION: changed data or a new version give a new file, unchanged data is read from disk.
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import data_sourcer as ds
+
+
+@pytest.fixture
+def data():
+    dates = pd.date_range('1980-01-31', '2024-01-31', freq='M')
+    return pd.DataFrame({'CPI': np.random.default_rng(0).standard_normal(len(dates)).cumsum() + 100}, index=dates)
+
+
+@pytest.fixture
+def computations(monkeypatch):
+    # the data of every call of the transform
+    calls = []
+
+    def running_percentile(data_df, **parameters):
+        calls.append(data_df)
+        return ds.calculate_running_percentile(data_df, **parameters)
+
+    monkeypatch.setitem(ds.FEATURE_TRANSFORMS, 'running_percentile', running_percentile)
+    return calls
+
+
+def feature(data, folder):
+    return ds.EconomicVariables(data, 'CPI/US', 'M', cache_folder=str(folder)).feature('running_percentile',
+                                                                                       window_size=36)
+
+
+def files(folder):
+    return set(folder.iterdir())
+
+
+def assert_computed_on(result, data):
+    expected = ds.calculate_running_percentile(data, 36)
+    np.testing.assert_array_equal(result.to_numpy(), expected.to_numpy())
+    pd.testing.assert_index_equal(result.index, expected.index)
+
+
+def test_unchanged_data_is_read_from_disk(tmp_path, data, computations):
+    first = feature(data, tmp_path)
+    stored = files(tmp_path)
+    second = feature(data.copy(), tmp_path)
+    assert len(computations) == 1 and files(tmp_path) == stored and len(stored) == 1
+    pd.testing.assert_frame_equal(second, first)
+    assert first.columns.tolist() == ['CPI/US_running_percentile_36']
+
+
+@pytest.mark.parametrize('change', ['later_start', 'revision', 'new_observation'])
+def test_changed_data_gives_a_new_file(tmp_path, data, computations, change):
+    feature(data, tmp_path)
+    stored = files(tmp_path)
+    if change == 'later_start':
+        changed = data.iloc[24:]
+    elif change == 'revision':
+        changed = data.copy()
+        changed.iloc[300, 0] += 50
+    else:
+        changed = pd.concat([data, pd.DataFrame({'CPI': [101.0]}, index=[data.index[-1] + pd.offsets.MonthEnd()])])
+    result = feature(changed, tmp_path)
+    assert len(computations) == 2 and len(files(tmp_path) - stored) == 1
+    assert_computed_on(result, changed)
+    # both versions of the data stay available
+    feature(data, tmp_path)
+    feature(changed, tmp_path)
+    assert len(computations) == 2
+
+
+def test_version_bump_gives_a_new_file(tmp_path, data, computations, monkeypatch):
+    feature(data, tmp_path)
+    stored = files(tmp_path)
+    monkeypatch.setattr(ds, 'FEATURE_VERSION', ds.FEATURE_VERSION + 1)
+    result = feature(data, tmp_path)
+    assert len(computations) == 2 and len(files(tmp_path) - stored) == 1
+    assert_computed_on(result, data)
+
+
+def test_other_parameters_give_a_new_file(tmp_path, data, computations):
+    variables = ds.EconomicVariables(data, 'CPI/US', 'M', cache_folder=str(tmp_path))
+    variables.feature('running_percentile', window_size=36)
+    variables.feature('running_percentile', window_size=12)
+    variables.feature('running_percentile', window_size=36)
+    assert len(computations) == 2 and len(files(tmp_path)) == 2
@@ -0,0 +1,115 @@
+# The vectorized resolution of the duplicate reflection points in find_RP must give the same result as the original
+# loop over the groups of duplicates, which is copied below as the reference.
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import trend_core as trend
+
+pd.options.mode.chained_assignment = None
+
+
+def find_RP_loop(price, window_in_days):
+    RP_vector = pd.DataFrame(data=price.iloc[:, 0], index=price.index)
+    RP_vector.loc[:, "running_min"] = RP_vector.iloc[:, 0].rolling(window=window_in_days * 2, min_periods=window_in_days,
+                                                                   center=True).min()
+    RP_vector.loc[:, "running_max"] = RP_vector.iloc[:, 0].rolling(window=window_in_days * 2, min_periods=window_in_days,
+                                                                   center=True).max()
+    RP_vector.loc[:, 'is_MIRP'] = (RP_vector.loc[:, 'running_min'] == RP_vector.iloc[:, 0])
+    RP_vector.loc[:, 'is_MARP'] = (RP_vector.loc[:, 'running_max'] == RP_vector.iloc[:, 0])
+    RP_vector.loc[:, 'is_RP'] = RP_vector.is_MIRP | RP_vector.is_MARP
+
+    RP_summary = RP_vector[RP_vector['is_RP']]
+    RP_summary.loc[:, 'is_MIRP_previous'] = RP_summary.loc[:, 'is_MIRP'].shift(1)
+    RP_summary.loc[:, 'is_MARP_previous'] = RP_summary.loc[:, 'is_MARP'].shift(1)
+    RP_summary.loc[:, 'is_MIRP_next'] = RP_summary.loc[:, 'is_MIRP'].shift(-1)
+    RP_summary.loc[:, 'is_MARP_next'] = RP_summary.loc[:, 'is_MARP'].shift(-1)
+    RP_summary.loc[:, 'is_duplicate_minimum'] = (RP_summary.loc[:, 'is_MIRP'] & RP_summary.loc[:, 'is_MIRP_previous']) | (
+        RP_summary.loc[:, 'is_MIRP'] & RP_summary.loc[:, 'is_MIRP_next'])
+    RP_summary.loc[:, 'is_duplicate_maximum'] = (RP_summary.loc[:, 'is_MARP'] & RP_summary.loc[:, 'is_MARP_previous']) | (
+        RP_summary.loc[:, 'is_MARP'] & RP_summary.loc[:, 'is_MARP_next'])
+    RP_summary.loc[:, 'is_duplicate'] = (RP_summary.loc[:, 'is_duplicate_minimum']) | (
+        RP_summary.loc[:, 'is_duplicate_maximum'])
+
+    RP_summary.loc[:, 'group'] = ((RP_summary.loc[:, 'is_duplicate_minimum'] != RP_summary.loc[:, 'is_duplicate_minimum'].shift()) | (
+        RP_summary.loc[:, 'is_duplicate_maximum'] != RP_summary.loc[:, 'is_duplicate_maximum'].shift())).cumsum()
+    RP_summary.loc[:, 'is_vMIRP'] = RP_summary.loc[:, 'is_MIRP']
+    RP_summary.loc[:, 'is_vMARP'] = RP_summary.loc[:, 'is_MARP']
+    groups = RP_summary.groupby('group')
+
+    for group_id, group_df in groups:
+        if group_df.iloc[0, group_df.columns.get_loc('is_duplicate')]:
+            if group_df.iloc[0, group_df.columns.get_loc('is_MIRP')]:
+                index_of_min_value = group_df.iloc[:, 0].idxmin()
+                A = (pd.DataFrame(group_df.index == index_of_min_value)).to_numpy()
+                RP_summary.loc[group_df.index, 'is_vMIRP'] = A
+
+            if group_df.iloc[0, group_df.columns.get_loc('is_MARP')]:
+                index_of_max_value = group_df.iloc[:, 0].idxmax()
+                B = (pd.DataFrame(group_df.index == index_of_max_value)).to_numpy()
+                RP_summary.loc[group_df.index, 'is_vMARP'] = B
+
+    RP_summary.loc[:, 'is_vRP'] = RP_summary.is_vMIRP | RP_summary.is_vMARP
+    false_alarm = RP_summary[RP_summary.loc[:, 'is_vRP'] == False]
+    RP_vector.loc[false_alarm.index, ['is_MARP', 'is_MIRP']] = False
+    RP_summary = RP_summary[RP_summary.loc[:, 'is_vRP'] == True]
+    return RP_vector, RP_summary
+
+
+def random_walk(seed, number_bars=1500):
+    rng = np.random.default_rng(seed)
+    index = pd.date_range('2000-01-03', periods=number_bars, freq='B')
+    return pd.DataFrame({'Close': 100 * np.exp(np.cumsum(0.01 * rng.standard_normal(number_bars)))}, index=index)
+
+
+def tie_heavy_walk(seed, number_bars=1500):
+    # few distinct price levels, so that many bars share the running minimum or maximum
+    rng = np.random.default_rng(seed)
+    index = pd.date_range('2000-01-03', periods=number_bars, freq='B')
+    return pd.DataFrame({'Close': np.cumsum(rng.integers(-1, 2, number_bars)).astype(float) + 50}, index=index)
+
+
+@pytest.mark.parametrize('make_price', [random_walk, tie_heavy_walk])
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('window_in_days', [2, 5, 21])
+def test_find_RP_matches_loop(make_price, seed, window_in_days):
+    price = make_price(seed)
+    expected_vector, expected_summary = find_RP_loop(price, window_in_days)
+    RP_vector, RP_summary = trend.find_RP(price, window_in_days)
+
+    pd.testing.assert_frame_equal(RP_vector[['is_MIRP', 'is_MARP']].astype(bool),
+                                  expected_vector[['is_MIRP', 'is_MARP']].astype(bool))
+    pd.testing.assert_index_equal(RP_summary.index, expected_summary.index)
+    pd.testing.assert_frame_equal(RP_summary[['is_vMIRP', 'is_vMARP']].astype(bool),
+                                  expected_summary[['is_vMIRP', 'is_vMARP']].astype(bool))
+
+
+def test_find_RP_with_extrema_index_matches_loop():
+    price = tie_heavy_walk(7)
+    extrema_index = trend.RangeExtremaIndex(price)
+    for window_in_days in (3, 10, 63):
+        _, expected_summary = find_RP_loop(price, window_in_days)
+        _, RP_summary = trend.find_RP(price, window_in_days, extrema_index)
+        pd.testing.assert_index_equal(RP_summary.index, expected_summary.index)
+        pd.testing.assert_frame_equal(RP_summary[['is_vMIRP', 'is_vMARP']].astype(bool),
+                                      expected_summary[['is_vMIRP', 'is_vMARP']].astype(bool))
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('window_in_days', [2, 3, 5])
+def test_kept_RP_have_one_type(seed, window_in_days):
+    # mostly flat prices, so that many RPs are validated as both vMIRP and vMARP
+    rng = np.random.default_rng(seed)
+    index = pd.date_range('2000-01-03', periods=400, freq='B')
+    price = pd.DataFrame({'Close': np.cumsum(rng.choice([-1, 0, 0, 0, 1], 400)).astype(float) + 100}, index=index)
+    RP_vector, RP_summary = trend.trend_identification_main(price, False, window_in_days)
+
+    is_vMARP = RP_summary['is_vMARP'].to_numpy(dtype=bool)
+    assert (RP_summary['is_vMIRP'].to_numpy(dtype=bool) ^ is_vMARP).all()
+    assert (is_vMARP[1:] != is_vMARP[:-1]).all()
+    assert ((RP_summary['return_type'] == 'gain').to_numpy() == is_vMARP).all()
+    RP_positions = RP_vector.index.get_indexer(RP_summary.index)
+    is_upward_trend = RP_vector['is_upward_trend'].to_numpy(dtype=bool)
+    for start, end, is_vMIRP in zip(RP_positions[:-1], RP_positions[1:], ~is_vMARP[:-1]):
+        assert (is_upward_trend[start:end] == is_vMIRP).all()
@@ -0,0 +1,83 @@
+# LocalSeriesCache only downloads the head or tail of a request that is not on disk yet, serves the disk offline, and
+# reports a failed top-up instead of returning stale data.
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import data_sourcer as ds
+
+
+class FakeSource:
+    def __init__(self):
+        self.requests = []
+        self.down_from = None  # the source fails for the requests that start on or after this date
+
+    def fetch(self, code, start_date, end_date):
+        self.requests.append((code, start_date, end_date))
+        if self.down_from is not None and start_date >= self.down_from:
+            raise ConnectionError(f"{code} is down")
+        dates = pd.bdate_range(start_date, end_date, inclusive='left')
+        return pd.DataFrame({'Close': np.arange(len(dates), dtype=float) + dates.day}, index=dates)
+
+
+@pytest.fixture
+def source():
+    return FakeSource()
+
+
+def test_cold_then_warm_load(tmp_path, source):
+    cache = ds.LocalSeriesCache(str(tmp_path), source.fetch)
+    first = cache.get('SPY', '2020-01-01', '2020-07-01')
+    second = cache.get('SPY', '2020-02-01', '2020-06-01')
+    assert source.requests == [('SPY', '2020-01-01', '2020-07-01')]
+    pd.testing.assert_frame_equal(second, first[(first.index >= '2020-02-01') & (first.index < '2020-06-01')])
+    assert cache.stats['cold_loads'] == 1 and cache.stats['warm_loads'] == 1 and cache.stats['fetches'] == 1
+
+
+def test_only_the_missing_head_and_tail_are_downloaded(tmp_path, source):
+    cache = ds.LocalSeriesCache(str(tmp_path), source.fetch)
+    cache.get('SPY', '2020-03-02', '2020-06-01')
+    data = cache.get('SPY', '2020-01-01', '2020-09-01')
+    # the tail starts again at the last cached observation, which may have been incomplete
+    assert source.requests[1:] == [('SPY', '2020-01-01', '2020-03-02'), ('SPY', '2020-05-29', '2020-09-01')]
+    assert data.index.equals(pd.bdate_range('2020-01-01', '2020-09-01', inclusive='left'))
+    assert cache.stats['partial_loads'] == 1
+
+
+def test_offline_cache_serves_the_disk_and_raises_for_missing_codes(tmp_path, source):
+    ds.LocalSeriesCache(str(tmp_path), source.fetch).get('SPY', '2020-01-01', '2020-03-01')
+    offline_cache = ds.LocalSeriesCache(str(tmp_path), source.fetch, is_offline=True)
+    data = offline_cache.get('SPY', '2019-01-01', '2020-06-01')
+    assert len(source.requests) == 1
+    assert data.index[0] == pd.Timestamp('2020-01-01') and data.index[-1] == pd.Timestamp('2020-02-28')
+    with pytest.raises(LookupError):
+        offline_cache.get('QQQ', '2020-01-01', '2020-03-01')
+    assert len(source.requests) == 1
+
+
+def test_offline_miss_is_not_retried(tmp_path, source):
+    offline_cache = ds.LocalSeriesCache(str(tmp_path), source.fetch, is_offline=True)
+    panel, failures = ds.download_series_panel(['SPY', 'QQQ'], '2020-01-01', '2020-03-01', None, offline_cache,
+                                               max_retries=3, backoff_in_seconds=60)
+    assert panel.empty and all(isinstance(error, LookupError) for error in failures.values())
+
+
+def test_failed_top_up_raises_and_keeps_the_downloaded_head(tmp_path, source):
+    cache = ds.LocalSeriesCache(str(tmp_path), source.fetch)
+    cache.get('SPY', '2020-03-02', '2020-06-01')
+    # the head succeeds, the tail fails
+    source.down_from = '2020-05-01'
+    with pytest.raises(ConnectionError):
+        cache.get('SPY', '2020-01-01', '2020-09-01')
+    data, metadata = cache.load('SPY')
+    assert metadata['covered_start'] == '2020-01-01' and metadata['covered_end'] == '2020-06-01'
+    assert data.index[0] == pd.Timestamp('2020-01-01')
+
+
+def test_codes_that_differ_in_symbols_have_their_own_files(tmp_path, source):
+    cache = ds.LocalSeriesCache(str(tmp_path), source.fetch)
+    cache.get('^DJI', '2020-01-01', '2020-02-01')
+    cache.get('DJI', '2020-01-01', '2020-02-01')
+    assert len(source.requests) == 2
+    assert cache.file_paths('^DJI') != cache.file_paths('DJI')
@@ -0,0 +1,73 @@
+# build_monthly_panel must give, per variable, the monthly average (daily data) or the last observation of the month
+# (other frequencies), shifted by the publication lag and forward-filled within the months of the variable.
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import data_sourcer as ds
+
+
+def variable(series_id, dates, seed, frequency=None, lag=0, holes=0):
+    rng = np.random.default_rng(seed)
+    values = rng.normal(size=len(dates))
+    if holes:
+        values[rng.integers(0, len(dates), holes)] = np.nan
+    data = pd.DataFrame({series_id: values}, index=dates)
+    return ds.EconomicVariables(data, series_id, frequency, lag_period_in_months=lag)
+
+
+def expected_column(variable):
+    data = variable.data.iloc[:, 0].dropna()
+    frequency = variable.frequency or ds.detect_frequency(data.index)
+    by_month = data.groupby(data.index.to_period('M'))
+    monthly = by_month.mean() if frequency == 'D' else by_month.last()
+    monthly.index = monthly.index + variable.lag_period
+    monthly = monthly.reindex(pd.period_range(monthly.index[0], monthly.index[-1], freq='M')).ffill()
+    monthly.index = monthly.index.to_timestamp(how='end').normalize()
+    return monthly
+
+
+def variables_list():
+    return [variable('DAILY', pd.bdate_range('2000-01-03', '2010-06-30'), 0, holes=50),
+            variable('WEEKLY', pd.date_range('1999-03-05', '2011-02-25', freq='W-FRI'), 1, lag=1),
+            variable('MONTHLY', pd.date_range('1998-01-01', '2009-12-01', freq='MS'), 2, frequency='M', lag=2,
+                     holes=10),
+            variable('QUARTERLY', pd.date_range('2001-03-31', '2012-12-31', freq='Q'), 3, lag=3)]
+
+
+@pytest.mark.parametrize('join', ['inner', 'outer'])
+def test_panel_matches_per_variable_resampling(join):
+    variables = variables_list()
+    panel = ds.build_monthly_panel(variables, join=join)
+    expected = pd.concat([expected_column(v) for v in variables], axis=1, join=join)
+    if join == 'inner':
+        expected = expected.dropna()
+    pd.testing.assert_frame_equal(panel, expected, check_freq=False, check_names=False)
+    assert panel.to_numpy().dtype == np.float64
+
+
+def test_lag_shifts_the_months():
+    dates = pd.date_range('2005-01-31', periods=24, freq='M')
+    panel = ds.build_monthly_panel([variable('X', dates, 0, lag=0)])
+    lagged = ds.build_monthly_panel([variable('X', dates, 0, lag=4)])
+    np.testing.assert_array_equal(lagged.to_numpy(), panel.to_numpy())
+    assert lagged.index[0] == pd.Timestamp('2005-05-31') and lagged.index[-1] == pd.Timestamp('2007-04-30')
+
+
+def test_disjoint_inner_join_is_empty():
+    panel = ds.build_monthly_panel([variable('A', pd.date_range('2000-01-31', periods=12, freq='M'), 0),
+                                    variable('B', pd.date_range('2005-01-31', periods=12, freq='M'), 1)])
+    assert panel.shape == (0, 2)
+
+
+@pytest.mark.parametrize('dates, frequency', [
+    (pd.bdate_range('2000-01-03', periods=300), 'D'),
+    (pd.date_range('2000-01-01', periods=300, freq='D'), 'D'),
+    (pd.date_range('2000-01-07', periods=100, freq='W-FRI'), 'W'),
+    (pd.date_range('2000-01-01', periods=60, freq='MS'), 'M'),
+    (pd.date_range('2000-03-31', periods=40, freq='Q'), 'Q'),
+    (pd.date_range('2000-12-31', periods=20, freq='A'), 'A'),
+])
+def test_detect_frequency(dates, frequency):
+    assert ds.detect_frequency(dates) == frequency
@@ -0,0 +1,29 @@
+# The sorted-window engine must give the rank of rolling().apply with pandas' rank(pct=True), also with ties and NaN.
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import data_sourcer as ds
+
+
+def rolling_rank_reference(data_df, window_size):
+    return data_df.rolling(window=window_size).apply(lambda x: pd.Series(x).rank(pct=True).iloc[-1])
+
+
+@pytest.mark.parametrize('window_size', [1, 3, 12, 36])
+def test_rolling_percentile_rank_matches_pandas(window_size):
+    rng = np.random.default_rng(window_size)
+    index = pd.date_range('1990-01-31', periods=200, freq='M')
+    data_df = pd.DataFrame({'continuous': rng.standard_normal(200), 'ties': rng.integers(0, 5, 200).astype(float),
+                            'holes': rng.standard_normal(200)}, index=index)
+    data_df.iloc[[20, 21, 90], 2] = np.nan
+    pd.testing.assert_frame_equal(ds.rolling_percentile_rank(data_df, window_size),
+                                  rolling_rank_reference(data_df, window_size))
+
+
+def test_calculate_running_percentile_drops_the_first_window():
+    index = pd.date_range('1990-01-31', periods=50, freq='M')
+    data_df = pd.DataFrame({'UNRATE': np.random.default_rng(0).standard_normal(50)}, index=index)
+    running_percentile = ds.calculate_running_percentile(data_df.iloc[::-1], 12)
+    pd.testing.assert_frame_equal(running_percentile, rolling_rank_reference(data_df, 12).iloc[12:])
@@ -0,0 +1,65 @@
+# Appending bars to a TrendIdentifier must give the same RP_vector and RP_summary as trend_identification_main on the
+# extended price curve.
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import trend_core as trend
+
+pd.options.mode.chained_assignment = None
+
+
+def random_walk(seed, number_bars):
+    rng = np.random.default_rng(seed)
+    index = pd.date_range('2000-01-03', periods=number_bars, freq='B')
+    return pd.DataFrame({'Close': 100 * np.exp(np.cumsum(0.01 * rng.standard_normal(number_bars)))}, index=index)
+
+
+def tie_heavy_walk(seed, number_bars):
+    # few distinct price levels, so that many RPs are duplicates or of both types
+    rng = np.random.default_rng(seed)
+    index = pd.date_range('2000-01-03', periods=number_bars, freq='B')
+    return pd.DataFrame({'Close': np.cumsum(rng.choice([-1, 0, 0, 1], number_bars)).astype(float) + 100}, index=index)
+
+
+def assert_same_as_full_recompute(identifier, price, window_in_days):
+    expected_vector, expected_summary = trend.trend_identification_main(price.copy(), False, window_in_days)
+    pd.testing.assert_frame_equal(identifier.RP_vector, expected_vector, check_freq=False)
+    pd.testing.assert_frame_equal(identifier.RP_summary, expected_summary, check_freq=False)
+
+
+@pytest.mark.parametrize('make_price', [random_walk, tie_heavy_walk])
+@pytest.mark.parametrize('seed', range(3))
+@pytest.mark.parametrize('window_in_days', [2, 5, 21])
+def test_append_matches_full_recompute(make_price, seed, window_in_days):
+    price = make_price(seed, 600)
+    rng = np.random.default_rng(seed)
+    number_seed_bars = int(rng.integers(0, 100))
+    identifier = trend.TrendIdentifier(*trend.trend_identification_main(price.iloc[:number_seed_bars].copy(), False,
+                                                                        window_in_days), window_in_days)
+    end = number_seed_bars
+    while end < len(price):
+        # mostly single bars, sometimes a batch
+        number_new_bars = 1 if rng.random() < 0.7 else int(rng.integers(2, 40))
+        identifier.append(price.iloc[end:end + number_new_bars])
+        end += number_new_bars
+        if rng.random() < 0.1:
+            assert_same_as_full_recompute(identifier, price.iloc[:end], window_in_days)
+    assert_same_as_full_recompute(identifier, price, window_in_days)
+
+
+def test_append_series_and_empty_bars():
+    price = random_walk(7, 300)
+    identifier = trend.TrendIdentifier(*trend.trend_identification_main(price.iloc[:200].copy(), False, 5), 5)
+    identifier.append(price.iloc[200:250])
+    identifier.append(price.iloc[:0])
+    identifier.append(price['Close'].iloc[250:])
+    assert_same_as_full_recompute(identifier, price, 5)
+
+
+def test_append_rejects_old_bars():
+    price = random_walk(1, 100)
+    identifier = trend.TrendIdentifier(*trend.trend_identification_main(price.copy(), False, 5), 5)
+    with pytest.raises(AssertionError):
+        identifier.append(price.iloc[-1:])
@@ -0,0 +1,74 @@
+# With a point-in-time training target, the walk-forward probability of a date only depends on the prices before it:
+# changing the prices from row K on must not change the probabilities up to row K.
+
+import functools
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import synthetic_data as sd
+import trend_core as trend
+import walk_forward as wf
+
+WINDOW_IN_DAYS = 63
+MIN_TRAIN_SIZE = 60
+MODEL_PARAMETERS = {'max_iter': 100000}
+
+
+@pytest.fixture(scope='module')
+def dataset():
+    price = sd.generate_price('regime_switching', 240, 'M', seed=3)
+    price.index = price.index + pd.offsets.MonthEnd(0)
+    RP_vector, RP_summary = trend.trend_identification_main(price.copy(), True, WINDOW_IN_DAYS)
+    target = RP_vector['is_upward_trend'].astype(int)
+    rng = np.random.default_rng(0)
+    predictors = pd.DataFrame(rng.standard_normal((len(price), 3)), index=price.index, columns=list('abc'))
+    # a predictor that carries information on the target
+    predictors['a'] += RP_vector['is_upward_trend'].shift(-1).fillna(0).to_numpy()
+    return price, RP_summary, predictors, target
+
+
+def probabilities(price, predictors, target):
+    return wf.walk_forward_probabilities(
+        predictors, target, MIN_TRAIN_SIZE, max_workers=1, model_parameters=MODEL_PARAMETERS,
+        training_target=functools.partial(wf.point_in_time_target, price, True, WINDOW_IN_DAYS))
+
+
+def test_point_in_time_target_on_all_prices(dataset):
+    price, RP_summary, _, target = dataset
+    known = wf.point_in_time_target(price, True, WINDOW_IN_DAYS, price.index[-1] + pd.Timedelta(days=1))
+    last_RP_position = price.index.get_loc(RP_summary.index[-1])
+    np.testing.assert_array_equal(known.iloc[:last_RP_position].to_numpy(), target.iloc[:last_RP_position].to_numpy())
+    assert known.iloc[last_RP_position:].isna().all()
+
+
+def test_point_in_time_target_uses_the_prices_before_the_refit_date(dataset):
+    price = dataset[0]
+    refit_date = price.index[150]
+    known = wf.point_in_time_target(price, True, WINDOW_IN_DAYS, refit_date)
+    assert known.index[-1] < refit_date
+    changed = price.copy()
+    changed.iloc[150:] *= 3
+    pd.testing.assert_series_equal(wf.point_in_time_target(changed, True, WINDOW_IN_DAYS, refit_date), known)
+
+
+@pytest.mark.parametrize('K', [100, 150, 180])
+def test_no_look_ahead(dataset, K):
+    price, _, predictors, target = dataset
+    expected = probabilities(price, predictors, target)
+    # a crash from row K on, which also changes the hindsight labels before K
+    changed = price.copy()
+    changed.iloc[K:] = changed.iloc[K - 1].to_numpy() * np.exp(-0.05 * np.arange(1, len(price) - K + 1))[:, None]
+    changed_target = trend.trend_identification_main(changed.copy(), True, WINDOW_IN_DAYS)[0]['is_upward_trend']
+    assert (changed_target.iloc[:K].astype(int) != target.iloc[:K]).any()
+    result = probabilities(changed, predictors, target)
+    assert expected.iloc[:K - MIN_TRAIN_SIZE + 1].notna().any()
+    np.testing.assert_allclose(result.iloc[:K - MIN_TRAIN_SIZE + 1], expected.iloc[:K - MIN_TRAIN_SIZE + 1])
+
+
+def test_evaluate_without_probabilities(dataset):
+    target = dataset[3]
+    for probabilities_empty in [pd.Series(np.nan, index=target.index), pd.Series(dtype=float)]:
+        evaluation = wf.evaluate_probabilities(target, probabilities_empty)
+        assert evaluation['number_dates'] == 0 and evaluation['auc'] is None